@@ -0,0 +1,84 @@
+import re
+from functools import lru_cache
+from nltk.tokenize import NLTKWordTokenizer, sent_tokenize
+from nltk.corpus import stopwords
+
+CHUNK_CACHE_SIZE = 200000 #Distinct (chunk, context) pairs kept by the tokenizer cache
+QUERY_CACHE_SIZE = 10000 #Distinct query strings kept by the query cache
+
+#Letter-only words that the Treebank tokenizer still splits (CANNOT -> CAN NOT, GONNA -> GON NA, ...)
+CONTRACTION_WORDS = {'CANNOT', 'GIMME', 'GONNA', 'GOTTA', 'LEMME', 'WANNA'}
+SENTENCE_END_CHARS = ('.', '?', '!')
+WHITESPACE_PATTERN = re.compile(r'(\s+)')
+CLOSING_PATTERN = re.compile(r'[\]\)}>"\'»”’]+') #Chunks the sentence-final period rule reaches over, when separated by spaces
+SENTINEL = 'X'
+
+treebank_tokenizer = NLTKWordTokenizer()
+
+@lru_cache(maxsize=CHUNK_CACHE_SIZE)
+def tokenize_chunk(previous_char: str, chunk: str, next_char: str, is_last: bool) -> tuple:
+    #The Treebank rules only look one character around a whitespace-separated chunk, except for the
+    #sentence-final period rule. So tokenizing the chunk with its neighbouring whitespace, plus a sentinel
+    #word when it isn't at the end of the sentence, gives the same tokens as tokenizing the whole sentence.
+    if is_last:
+        return tuple(treebank_tokenizer.tokenize(previous_char + chunk + next_char))
+    return tuple(treebank_tokenizer.tokenize(previous_char + chunk + next_char + SENTINEL)[:-1])
+
+class Analyzer:
+    #Tokenization and normalization shared by indexing and search. Produces the same tokens as
+    #nltk's word_tokenize followed by the stop word and digits filter, but tokenizes each distinct
+    #chunk only once and skips the Treebank rules for plain words.
+
+    def __init__(self) -> None:
+        self.stop_words = set(s.upper() for s in stopwords.words('english')).union(".", ",", ";", "!", "?", ";", "=", "<", "+", "``", "%", "[", "]", "(", ")", '"', "'", ":", "-", "")
+        self.analyze_query = lru_cache(maxsize=QUERY_CACHE_SIZE)(self.analyze_query_text)
+
+    def tokenize(self, text: str) -> list[str]:
+        #Sentence boundaries only change the tokens around '.', '?' and '!', so punkt is skipped without them.
+        #Like punkt, the trailing whitespace of the last sentence is dropped.
+        if any(char in text for char in SENTENCE_END_CHARS):
+            sentences = sent_tokenize(text)
+        else:
+            sentences = [text.rstrip()]
+
+        tokens = []
+        for sentence in sentences:
+            pieces = WHITESPACE_PATTERN.split(sentence) #Chunks at even positions, the whitespace between them at odd ones
+            chunks, separators = pieces[0::2], pieces[1::2]
+            last_index = len(chunks) - 1
+            while last_index > 0 and self.is_closing_chunk(chunks[last_index]) and separators[last_index - 1].strip(' ') == '':
+                last_index -= 1
+            for i, chunk in enumerate(chunks):
+                if chunk.isalpha() and chunk.upper() not in CONTRACTION_WORDS:
+                    tokens.append(chunk)
+                elif chunk:
+                    previous_char = separators[i - 1][-1] if i > 0 else ''
+                    next_char = separators[i][0] if i < len(separators) else ''
+                    tokens.extend(tokenize_chunk(previous_char, chunk, next_char, i >= last_index))
+        return tokens
+
+    def is_closing_chunk(self, chunk: str) -> bool:
+        #A quote opening a chunk becomes `` before the period rule runs, which stops it
+        return CLOSING_PATTERN.fullmatch(chunk) is not None and not chunk.startswith(('"', "''"))
+
+    def is_index_term(self, word: str) -> bool:
+        return word not in self.stop_words and not word.isdigit()
+
+    def analyze(self, text: str) -> list[str]:
+        return [word for word in self.tokenize(text) if self.is_index_term(word)]
+
+    def analyze_positions(self, text: str) -> list[tuple[str, int]]:
+        #Positions count every token, stop words included, so words separated by a stop word aren't adjacent
+        return [(word, position) for position, word in enumerate(self.tokenize(text)) if self.is_index_term(word)]
+
+    def analyze_document(self, text: str) -> list[str]:
+        return self.analyze(text.upper())
+
+    def analyze_document_positions(self, text: str) -> list[tuple[str, int]]:
+        return self.analyze_positions(text.upper())
+
+    def analyze_query_text(self, text: str) -> tuple:
+        return tuple(self.analyze(text.replace('/', ' ')))
+
+    def analyze_query_positions(self, text: str) -> tuple:
+        return tuple(self.analyze_positions(text.replace('/', ' ')))
@@ -0,0 +1,263 @@
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import time
+import xml.etree.ElementTree as ET
+import numpy as np
+
+logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
+logger_extra_dict = {'className': 'Benchmark'}
+logger = logging.getLogger(__name__)
+SRC_FOLDER_PATH = ''
+
+STAGES = ['inverted_index_generator', 'indexer', 'query_processor', 'search_engine']
+LATENCY_PERCENTILES = [50, 95, 99]
+
+def set_stage_folder(folder_path: str):
+    #Every module reads its config, data and result files relative to its SRC_FOLDER_PATH
+    import inverted_index_generator, indexer, query_processor, search_engine
+    for module in (inverted_index_generator, indexer, query_processor, search_engine):
+        module.SRC_FOLDER_PATH = folder_path
+        logging.getLogger(module.__name__).setLevel(logging.WARNING)
+
+def peak_memory_mb() -> float:
+    #ru_maxrss is in kilobytes on Linux. Worker processes of the stage are included
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children)/1024
+
+def run_stage(stage: str, folder_path: str, options: dict, queue):
+    #Runs in a fresh process, so the peak memory only accounts for this stage
+    set_stage_folder(folder_path)
+    result = {}
+    start_time = time.perf_counter()
+
+    if stage == 'inverted_index_generator':
+        from inverted_index_generator import ReverseListGenerator
+        ReverseListGenerator().run()
+    elif stage == 'indexer':
+        from indexer import Indexer
+        idx = Indexer()
+        idx.config['tf_normalized'] = options['tf_normalized']
+        vector_model = idx.run()
+        result['terms'] = len(vector_model.terms)
+    elif stage == 'query_processor':
+        from query_processor import QueryProcessor
+        QueryProcessor().run()
+    elif stage == 'search_engine':
+        from search_engine import SearchEngine
+        SearchEngine().run(keep_results=False)
+        result['time'] = time.perf_counter() - start_time
+
+        #Latency of single queries over a model already in memory, the first pass warms up the caches
+        se = SearchEngine()
+        load_start = time.perf_counter()
+        vector_model = se.read_vector_model()
+        result['model_load_time'] = time.perf_counter() - load_start
+        query_dict = se.read_queries_file()
+        latencies = []
+        for repetition in range(options['repetitions'] + 1):
+            se.analyzer.analyze_query.cache_clear() #Each pass tokenizes the queries again
+            for query_text in query_dict.values():
+                query_start = time.perf_counter()
+                se.search(vector_model, query_text, se.config['top_k'])
+                if repetition > 0:
+                    latencies.append(time.perf_counter() - query_start)
+        for percentile, value in zip(LATENCY_PERCENTILES, np.percentile(latencies, LATENCY_PERCENTILES)):
+            result[f'latency_p{percentile}'] = float(value)
+        result['queries_per_second'] = len(latencies)/sum(latencies)
+
+    result.setdefault('time', time.perf_counter() - start_time)
+    result['peak_memory_mb'] = peak_memory_mb()
+    queue.put(result)
+
+class Benchmark:
+    #Runs the four stages of the pipeline over the CFC collection replicated at each scale,
+    #each stage in its own process, and writes throughput, latency and peak memory in JSON.
+
+    def __init__(self) -> None:
+        logger.info('Starting execution...', extra=logger_extra_dict)
+        self.config = self.read_config_file(SRC_FOLDER_PATH + 'config/BENCHMARK.CFG')
+        self.src_folder_path = os.path.abspath(SRC_FOLDER_PATH or '.')
+        self.data_folder_path = SRC_FOLDER_PATH + 'data/'
+        self.result_folder_path = SRC_FOLDER_PATH + 'result/'
+
+    def read_config_file(self, path: str):
+        logger.info('Reading config file...', extra=logger_extra_dict)
+        config = {
+            'scales': [],
+            'repetitions': 5,
+            'tf_normalized': False,
+            'folder': 'benchmark',
+            'report': None,
+            'baseline': None,
+            'tolerance': 0.2
+        }
+
+        try:
+            with open(path, 'r') as file:
+                lines = file.readlines()
+
+                for line in lines:
+                    key, value = line.strip().split('=')
+                    if key == 'ESCALA':
+                        config['scales'].append(int(value))
+                    elif key == 'REPETICOES':
+                        config['repetitions'] = int(value)
+                    elif key == 'NORMALIZAR_TF':
+                        config['tf_normalized'] = value.upper() in ('S', 'Y')
+                    elif key == 'PASTA':
+                        config['folder'] = value
+                    elif key == 'RELATORIO':
+                        config['report'] = value
+                    elif key == 'BASELINE':
+                        config['baseline'] = value
+                    elif key == 'TOLERANCIA':
+                        config['tolerance'] = float(value)
+        except FileNotFoundError:
+            logger.error(f'Config file "{path}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        except Exception:
+            logger.error(f'Error while reading config file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+
+        if not config['scales']:
+            config['scales'] = [1]
+        logger.info('Config file read successfully.', extra=logger_extra_dict)
+        return config
+
+    def prepare_corpus(self, scale: int) -> tuple[str, int]:
+        #Copies the config files and writes each records file with its records repeated `scale` times.
+        #The copies get record numbers shifted by a multiple of the highest one, so they are new documents.
+        folder_path = os.path.join(self.result_folder_path, self.config['folder'], f'escala_{scale}')
+        shutil.rmtree(folder_path, ignore_errors=True)
+        shutil.copytree(os.path.join(self.src_folder_path, 'config'), os.path.join(folder_path, 'config'))
+        os.makedirs(os.path.join(folder_path, 'data'))
+        os.makedirs(os.path.join(folder_path, 'result'))
+
+        trees = {}
+        for filename in sorted(os.listdir(self.data_folder_path)):
+            filepath = os.path.join(self.data_folder_path, filename)
+            tree = ET.parse(filepath) if filename.endswith('.xml') else None
+            if tree is not None and tree.getroot().find('RECORD') is not None:
+                trees[filename] = tree
+            else:
+                shutil.copy(filepath, os.path.join(folder_path, 'data', filename))
+
+        record_offset = 1 + max(int(record.find('RECORDNUM').text) for tree in trees.values() for record in tree.getroot().findall('RECORD'))
+        documents_count = 0
+        for filename, tree in trees.items():
+            root = tree.getroot()
+            records = root.findall('RECORD')
+            for copy_number in range(1, scale):
+                for record in records:
+                    record_copy = copy.deepcopy(record)
+                    record_num = record_copy.find('RECORDNUM')
+                    record_num.text = str(int(record_num.text) + copy_number*record_offset)
+                    root.append(record_copy)
+            documents_count += len(records)*scale
+            tree.write(os.path.join(folder_path, 'data', filename), encoding='utf-8', xml_declaration=True)
+        return folder_path, documents_count
+
+    def run_stage_in_process(self, stage: str, folder_path: str) -> dict:
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        process = context.Process(target=run_stage, args=(stage, os.path.abspath(folder_path) + '/', self.config, queue))
+        process.start()
+        try:
+            result = queue.get()
+        except Exception:
+            result = None
+        process.join()
+        if process.exitcode != 0 or result is None:
+            logger.error(f'Stage {stage} failed in "{folder_path}". Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        return result
+
+    def run_scale(self, scale: int) -> dict:
+        logger.info(f'Preparing corpus at scale {scale}x...', extra=logger_extra_dict)
+        folder_path, documents_count = self.prepare_corpus(scale)
+        scale_report = {'documents': documents_count, 'stages': {}}
+
+        for stage in STAGES:
+            logger.info(f'Running {stage} at scale {scale}x...', extra=logger_extra_dict)
+            result = self.run_stage_in_process(stage, folder_path)
+            if stage in ('inverted_index_generator', 'indexer'):
+                result['documents_per_second'] = documents_count/result['time']
+            scale_report['stages'][stage] = result
+            logger.info(f'{stage}: {result["time"]:.3f}s, peak memory {result["peak_memory_mb"]:.1f}MB', extra=logger_extra_dict)
+
+        search_result = scale_report['stages']['search_engine']
+        logger.info(f'Query latency p50/p95/p99: {search_result["latency_p50"]*1000:.2f}/{search_result["latency_p95"]*1000:.2f}/{search_result["latency_p99"]*1000:.2f}ms', extra=logger_extra_dict)
+        return scale_report
+
+    def compare_with_baseline(self, report: dict, baseline: dict) -> list:
+        #Times, latencies and memory regress when they grow, throughputs when they shrink
+        comparison = []
+        for scale, scale_report in report['scales'].items():
+            for stage, result in scale_report['stages'].items():
+                baseline_result = baseline.get('scales', {}).get(scale, {}).get('stages', {}).get(stage, {})
+                for metric, value in result.items():
+                    if metric not in baseline_result or not baseline_result[metric]:
+                        continue
+                    ratio = value/baseline_result[metric]
+                    if metric.endswith('_per_second'):
+                        regression = ratio < 1 - self.config['tolerance']
+                    elif metric.endswith('time') or metric.startswith('latency') or metric == 'peak_memory_mb':
+                        regression = ratio > 1 + self.config['tolerance']
+                    else:
+                        continue
+                    comparison.append({'scale': scale, 'stage': stage, 'metric': metric, 'baseline': baseline_result[metric], 'current': value, 'ratio': ratio, 'regression': regression})
+                    if regression:
+                        logger.warning(f'Regression at scale {scale}x, {stage} {metric}: {baseline_result[metric]:.4g} -> {value:.4g}', extra=logger_extra_dict)
+        return comparison
+
+    def read_baseline_file(self):
+        filepath = self.result_folder_path + self.config['baseline']
+        if not os.path.exists(filepath):
+            logger.info(f'Baseline file "{self.config["baseline"]}" not found, comparison skipped.', extra=logger_extra_dict)
+            return None
+        try:
+            with open(filepath, 'r') as file:
+                return json.load(file)
+        except Exception:
+            logger.error(f'Error while reading baseline file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+
+    def write_report_to_file(self, report: dict):
+        logger.info(f'Writing benchmark report to file: {self.config["report"]}', extra=logger_extra_dict)
+        filepath = self.result_folder_path + self.config['report']
+        try:
+            with open(filepath, 'w') as file:
+                json.dump(report, file, indent=2)
+        except Exception:
+            logger.error(f'Couldn\'t write benchmark report file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        logger.info('Benchmark report generated successfully.', extra=logger_extra_dict)
+
+    def run(self):
+        report = {
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'repetitions': self.config['repetitions'],
+            'scales': {}
+        }
+        for scale in self.config['scales']:
+            report['scales'][str(scale)] = self.run_scale(scale)
+
+        if self.config['baseline']:
+            baseline = self.read_baseline_file()
+            if baseline is not None:
+                report['comparison'] = self.compare_with_baseline(report, baseline)
+                regressions = sum(item['regression'] for item in report['comparison'])
+                logger.info(f'{regressions} regressions found against the baseline.', extra=logger_extra_dict)
+        self.write_report_to_file(report)
+        logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+
+if __name__ == '__main__':
+    bm = Benchmark()
+    bm.run()
@@ -0,0 +1,248 @@
+import json
+import logging
+import time
+import numpy as np
+import pandas as pd
+import index_format
+
+logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
+logger_extra_dict = {'className': 'Evaluator'}
+logger = logging.getLogger(__name__)
+SRC_FOLDER_PATH = ''
+
+RECALL_LEVELS = np.linspace(0, 1, 11) #Levels of the 11-point interpolated precision x recall curve
+
+class Evaluator:
+    #Compares the ranking written by the SearchEngine with the relevant documents of each query
+    #(DocVotes > 0 in the expected results file). The votes are used as graded relevance for nDCG.
+
+    def __init__(self) -> None:
+        logger.info('Starting execution...', extra=logger_extra_dict)
+        self.config = self.read_config_file(SRC_FOLDER_PATH + 'config/AVALIA.CFG')
+        self.result_folder_path = SRC_FOLDER_PATH + 'result/'
+
+    def read_config_file(self, path: str):
+        logger.info('Reading config file...', extra=logger_extra_dict)
+        config = {
+            'results': None,
+            'expected': None,
+            'report': None,
+            'k': []
+        }
+
+        try:
+            with open(path, 'r') as file:
+                lines = file.readlines()
+
+                for line in lines:
+                    key, value = line.strip().split('=')
+                    if key == 'RESULTADOS':
+                        config['results'] = value
+                    elif key == 'ESPERADOS':
+                        config['expected'] = value
+                    elif key == 'RELATORIO':
+                        config['report'] = value
+                    elif key == 'K':
+                        config['k'].append(int(value))
+        except FileNotFoundError:
+            logger.error(f'Config file "{path}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        except Exception:
+            logger.error(f'Error while reading config file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+
+        if not config['k']:
+            config['k'] = [10]
+        logger.info('Config file read successfully.', extra=logger_extra_dict)
+        return config
+
+    def read_results_file(self) -> pd.DataFrame:
+        logger.info(f'Reading results file: {self.config["results"]}', extra=logger_extra_dict)
+        filepath = self.result_folder_path + self.config['results']
+        try:
+            #Any of the formats written by the SearchEngine (FORMATO), told apart by the extension or the first line
+            if filepath.endswith('.idx'):
+                results_df = self.read_binary_results(filepath)
+            else:
+                with open(filepath, 'r') as f:
+                    first_line = f.readline().strip()
+                if first_line == 'QueryNumber;DocsRankInfo':
+                    results_df = self.read_legacy_results(filepath)
+                elif first_line.startswith('QueryNumber;'):
+                    results_df = pd.read_csv(filepath, sep=';', usecols=['QueryNumber', 'Rank', 'DocNumber'], dtype=np.int64)
+                else:
+                    results_df = pd.read_csv(filepath, sep=r'\s+', header=None, usecols=[0, 2, 3], names=['QueryNumber', 'Q0', 'DocNumber', 'Rank', 'Similarity', 'Run'], dtype={'QueryNumber': np.int64, 'DocNumber': np.int64, 'Rank': np.int64})
+                    results_df = results_df[['QueryNumber', 'Rank', 'DocNumber']]
+        except FileNotFoundError:
+            logger.error(f'Input file "{self.config["results"]}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        except Exception:
+            logger.error(f'Error while reading results file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        logger.info('Results file read successfully.', extra=logger_extra_dict)
+        return results_df
+
+    def read_legacy_results(self, filepath: str) -> pd.DataFrame:
+        results_df = pd.read_csv(filepath, sep=';', dtype={'QueryNumber': np.int64, 'DocsRankInfo': str})
+        #Each line holds [rank, 'doc', similarity]
+        rank_info = results_df['DocsRankInfo'].str.strip('[]').str.split(',', expand=True)
+        results_df = pd.DataFrame({
+            'QueryNumber': results_df['QueryNumber'],
+            'Rank': rank_info[0].astype(np.int64),
+            'DocNumber': pd.to_numeric(rank_info[1].str.strip(" '"), errors='coerce'),
+        })
+        #Results written by older versions also rank the idf column as a document
+        return results_df.dropna(subset=['DocNumber']).astype({'DocNumber': np.int64})
+
+    def read_binary_results(self, filepath: str) -> pd.DataFrame:
+        index_file = index_format.IndexFile(filepath)
+        if index_file.kind != 'results':
+            raise ValueError(f'"{filepath}" is not a results file.')
+        return pd.DataFrame({
+            'QueryNumber': index_file.section('query_numbers').astype(np.int64),
+            'Rank': index_file.section('ranks').astype(np.int64),
+            'DocNumber': index_file.section('docs').astype(np.int64),
+        })
+
+    def read_expected_results_file(self) -> pd.DataFrame:
+        logger.info(f'Reading expected results file: {self.config["expected"]}', extra=logger_extra_dict)
+        filepath = self.result_folder_path + self.config['expected']
+        try:
+            expected_df = pd.read_csv(filepath, sep=';', dtype=np.int64)
+        except FileNotFoundError:
+            logger.error(f'Input file "{self.config["expected"]}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        except Exception:
+            logger.error(f'Error while reading expected results file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        logger.info('Expected results file read successfully.', extra=logger_extra_dict)
+        return expected_df
+
+    def results_to_dataframe(self, results: dict) -> pd.DataFrame:
+        #Ranking of each query as returned by the SearchEngine, documents already in rank order
+        query_numbers, ranks, doc_numbers = [], [], []
+        for query_number, similarity_df in results.items():
+            query_numbers.append(np.full(len(similarity_df), int(query_number), dtype=np.int64))
+            ranks.append(np.arange(1, len(similarity_df) + 1, dtype=np.int64))
+            doc_numbers.append(similarity_df.index.to_numpy(dtype=np.int64))
+        return pd.DataFrame({
+            'QueryNumber': np.concatenate(query_numbers) if query_numbers else np.zeros(0, dtype=np.int64),
+            'Rank': np.concatenate(ranks) if ranks else np.zeros(0, dtype=np.int64),
+            'DocNumber': np.concatenate(doc_numbers) if doc_numbers else np.zeros(0, dtype=np.int64),
+        })
+
+    def relevant_documents(self, expected_df: pd.DataFrame) -> pd.DataFrame:
+        #A document may be listed twice for a query, its highest vote is kept
+        expected_df = expected_df[expected_df['DocVotes'] > 0]
+        return expected_df.groupby(['QueryNumber', 'DocNumber'], as_index=False)['DocVotes'].max()
+
+    def group_positions(self, group_ids: np.ndarray) -> np.ndarray:
+        #1-based position of each row inside its group, the rows of a group being contiguous
+        starts = np.flatnonzero(np.concatenate(([True], group_ids[1:] != group_ids[:-1])))
+        lengths = np.diff(np.append(starts, len(group_ids)))
+        return np.arange(len(group_ids)) - np.repeat(starts, lengths) + 1
+
+    def calculate_metrics(self, results_df: pd.DataFrame, expected_df: pd.DataFrame) -> dict:
+        #All metrics are computed at once for every query, with one row per retrieved document
+        query_numbers = np.unique(expected_df['QueryNumber'].to_numpy())
+        n_queries = len(query_numbers)
+
+        results_df = results_df[results_df['QueryNumber'].isin(query_numbers)].sort_values(['QueryNumber', 'Rank'], kind='stable')
+        ranked = results_df.merge(expected_df, on=['QueryNumber', 'DocNumber'], how='left')
+        query_ids = np.searchsorted(query_numbers, ranked['QueryNumber'].to_numpy())
+        ranks = self.group_positions(query_ids) if len(query_ids) else np.zeros(0, dtype=np.int64)
+        gains = ranked['DocVotes'].fillna(0).to_numpy(dtype=np.float64)
+        is_relevant = gains > 0
+
+        expected_query_ids = np.searchsorted(query_numbers, expected_df['QueryNumber'].to_numpy())
+        relevant_count = np.bincount(expected_query_ids, minlength=n_queries)
+
+        #Relevant documents retrieved up to each rank
+        relevant_so_far = np.cumsum(is_relevant)
+        query_offsets = np.concatenate(([0], relevant_so_far))[np.searchsorted(query_ids, np.arange(n_queries))]
+        relevant_so_far = relevant_so_far - query_offsets[query_ids]
+        precision = relevant_so_far/ranks
+        recall = relevant_so_far/relevant_count[query_ids]
+
+        metrics = {}
+        for k in self.config['k']:
+            metrics[f'P@{k}'] = np.bincount(query_ids[ranks <= k], weights=is_relevant[ranks <= k], minlength=n_queries)/k
+
+        within_r = ranks <= relevant_count[query_ids]
+        metrics['R-Precision'] = np.bincount(query_ids[within_r], weights=is_relevant[within_r], minlength=n_queries)/relevant_count
+        metrics['AP'] = np.bincount(query_ids[is_relevant], weights=precision[is_relevant], minlength=n_queries)/relevant_count
+
+        #nDCG: the ideal ranking sorts the relevant documents of each query by their votes
+        discounts = 1/np.log2(ranks + 1)
+        order = np.lexsort((-expected_df['DocVotes'].to_numpy(), expected_query_ids))
+        ideal_query_ids = expected_query_ids[order]
+        ideal_gains = expected_df['DocVotes'].to_numpy(dtype=np.float64)[order]
+        ideal_ranks = self.group_positions(ideal_query_ids)
+        ideal_discounts = 1/np.log2(ideal_ranks + 1)
+        for k in self.config['k'] + [None]:
+            in_cut = ranks <= k if k else np.ones(len(ranks), dtype=bool)
+            ideal_in_cut = ideal_ranks <= k if k else np.ones(len(ideal_ranks), dtype=bool)
+            dcg = np.bincount(query_ids[in_cut], weights=(gains*discounts)[in_cut], minlength=n_queries)
+            ideal_dcg = np.bincount(ideal_query_ids[ideal_in_cut], weights=(ideal_gains*ideal_discounts)[ideal_in_cut], minlength=n_queries)
+            metrics[f'nDCG@{k}' if k else 'nDCG'] = dcg/ideal_dcg
+
+        #11-point interpolated precision: the highest precision at any recall >= each level.
+        #Each relevant document reaches the levels up to its recall, then the maximum is carried to the lower levels.
+        interpolated = np.zeros((n_queries, len(RECALL_LEVELS)))
+        highest_level = np.floor(recall[is_relevant]*(len(RECALL_LEVELS) - 1) + 1e-9).astype(np.int64)
+        np.maximum.at(interpolated, (query_ids[is_relevant], highest_level), precision[is_relevant])
+        interpolated = np.maximum.accumulate(interpolated[:, ::-1], axis=1)[:, ::-1]
+
+        return {'query_numbers': query_numbers, 'metrics': metrics, 'interpolated_precision': interpolated}
+
+    def build_report(self, evaluation: dict) -> dict:
+        metrics = evaluation['metrics']
+        interpolated = evaluation['interpolated_precision']
+        report = {
+            'queries_count': len(evaluation['query_numbers']),
+            'k': self.config['k'],
+            'recall_levels': RECALL_LEVELS.round(1).tolist(),
+            'mean': {name: float(values.mean()) for name, values in metrics.items()},
+            'queries': {},
+        }
+        report['mean']['MAP'] = report['mean'].pop('AP')
+        report['mean']['interpolated_precision'] = interpolated.mean(axis=0).tolist()
+        for i, query_number in enumerate(evaluation['query_numbers']):
+            query_report = {name: float(values[i]) for name, values in metrics.items()}
+            query_report['interpolated_precision'] = interpolated[i].tolist()
+            report['queries'][str(query_number)] = query_report
+        return report
+
+    def write_report_to_file(self, report: dict):
+        logger.info(f'Writing evaluation report to file: {self.config["report"]}', extra=logger_extra_dict)
+        filepath = self.result_folder_path + self.config['report']
+        try:
+            with open(filepath, 'w') as file:
+                json.dump(report, file, indent=2)
+        except Exception:
+            logger.error(f'Couldn\'t write evaluation report file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        logger.info('Evaluation report generated successfully.', extra=logger_extra_dict)
+
+    def run(self, results: dict = None, expected_results: list = None):
+        #The ranking and the expected results may come from the previous stages, otherwise they are read from RESULTADOS and ESPERADOS
+        results_df = self.read_results_file() if results is None else self.results_to_dataframe(results)
+        if expected_results is None:
+            expected_df = self.read_expected_results_file()
+        else:
+            expected_df = pd.DataFrame(expected_results, columns=['QueryNumber', 'DocNumber', 'DocVotes']).astype(np.int64)
+        expected_df = self.relevant_documents(expected_df)
+        logger.info(f'Calculating evaluation metrics...', extra=logger_extra_dict)
+        start_time = time.time()
+        report = self.build_report(self.calculate_metrics(results_df, expected_df))
+        end_time = time.time()
+        logger.info(f'Evaluation metrics calculated in {end_time - start_time: .2e}s', extra=logger_extra_dict)
+        for name, value in report['mean'].items():
+            if name != 'interpolated_precision':
+                logger.info(f'{name}: {value:.4f}', extra=logger_extra_dict)
+        self.write_report_to_file(report)
+        logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+
+if __name__ == '__main__':
+    ev = Evaluator()
+    ev.run()
@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import numpy as np
+
+#Binary index layout:
+#   MAGIC (8 bytes) | header length (uint64) | JSON header | sections (each one aligned to 8 bytes)
+#The header holds the file kind, free metadata and, for every section, its dtype, offset and number of items.
+#Integer sequences (docids, tfs) are stored as gaps encoded with variable-byte (varint) codes.
+MAGIC = b'COSIDX01'
+ALIGNMENT = 8
+
+def varint_lengths(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        n_bytes += values >= (np.uint64(1) << np.uint64(shift))
+    return n_bytes
+
+def encode_varint(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = varint_lengths(values)
+    starts = np.cumsum(n_bytes) - n_bytes
+    byte_pos = np.arange(n_bytes.sum()) - np.repeat(starts, n_bytes)
+    repeated_values = np.repeat(values, n_bytes)
+    encoded = (repeated_values >> (7*byte_pos).astype(np.uint64)) & np.uint64(0x7F)
+    encoded[byte_pos < np.repeat(n_bytes - 1, n_bytes)] |= np.uint64(0x80) #Continuation bit
+    return encoded.astype(np.uint8)
+
+def decode_varint(data: np.ndarray) -> np.ndarray:
+    data = np.asarray(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+    is_last = data < 0x80
+    starts = np.flatnonzero(np.concatenate(([True], is_last[:-1])))
+    value_ids = np.cumsum(np.concatenate(([0], is_last[:-1])))
+    byte_pos = np.arange(len(data)) - starts[value_ids]
+    parts = (data & 0x7F).astype(np.int64) << (7*byte_pos)
+    return np.add.reduceat(parts, starts)
+
+def encode_gaps(values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    #Each list of `lengths` values (sorted ascending) keeps its first value and the differences between the next ones
+    values = np.asarray(values, dtype=np.int64)
+    gaps = np.diff(values, prepend=0)
+    starts = (np.cumsum(lengths) - lengths)[lengths > 0]
+    gaps[starts] = values[starts]
+    return gaps
+
+def decode_gaps(gaps: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    running_sum = np.cumsum(gaps)
+    starts = np.cumsum(lengths) - lengths
+    previous_sum = np.concatenate(([0], running_sum))[starts]
+    return running_sum - np.repeat(previous_sum, lengths)
+
+def encode_terms(terms: list[str]) -> np.ndarray:
+    return np.frombuffer('\n'.join(terms).encode('utf-8'), dtype=np.uint8)
+
+def decode_terms(data: np.ndarray) -> list[str]:
+    if len(data) == 0:
+        return []
+    return bytes(data).decode('utf-8').split('\n')
+
+def write_index_file(path: str, kind: str, sections: dict, meta: dict = None):
+    #Each section is either an array or a (raw file path, dtype) pair, copied without being loaded in memory
+    sections = dict(sections)
+    sections_info = {}
+    for name, section in sections.items():
+        if isinstance(section, tuple):
+            raw_path, dtype = section
+            dtype = np.dtype(dtype)
+            sections_info[name] = (dtype, os.path.getsize(raw_path))
+        else:
+            sections[name] = section = np.ascontiguousarray(section)
+            sections_info[name] = (section.dtype, section.nbytes)
+    header = {'kind': kind, 'meta': meta or {}, 'sections': {}}
+
+    #The header size depends on the offsets it contains, so the layout is computed until it is stable
+    header_bytes = b''
+    while True:
+        offset = len(MAGIC) + 8 + len(header_bytes)
+        for name, (dtype, nbytes) in sections_info.items():
+            offset += -offset % ALIGNMENT
+            header['sections'][name] = {'dtype': dtype.str, 'offset': offset, 'count': nbytes//dtype.itemsize}
+            offset += nbytes
+        previous_length = len(header_bytes)
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) == previous_length:
+            break
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, section in sections.items():
+            f.write(b'\0' * (header['sections'][name]['offset'] - f.tell()))
+            if isinstance(section, tuple):
+                with open(section[0], 'rb') as raw_file:
+                    shutil.copyfileobj(raw_file, f)
+            else:
+                f.write(section.tobytes())
+
+class IndexFile:
+
+    def __init__(self, path: str) -> None:
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'"{path}" is not a binary index file.')
+        header_length = int(self.buffer[len(MAGIC):len(MAGIC) + 8].view(np.uint64)[0])
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(self.buffer[header_start:header_start + header_length]).decode('utf-8'))
+        self.kind = header['kind']
+        self.meta = header['meta']
+        self.sections = header['sections']
+
+    def section(self, name: str) -> np.ndarray:
+        info = self.sections[name]
+        dtype = np.dtype(info['dtype'])
+        return self.buffer[info['offset']:info['offset'] + info['count']*dtype.itemsize].view(dtype)
@@ -1,15 +1,25 @@
 import ast
+import os
 import re
-import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import logging
 import time
+import scoring
+from instrumentation import Instrumentation
+from postings import Postings
+from segments import MANIFEST_FILENAME, SegmentedIndex
+from vector_model import VectorModel
 
 logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
 logger_extra_dict = {'className': 'Indexer'}
 logger = logging.getLogger(__name__)
 
 SRC_FOLDER_PATH = r''
+OUTPUT_CHUNK_SIZE = 1000 #Number of terms densified at a time when writing the vector model
+TERM_PATTERN = re.compile(r'^[A-Z]{2,}$') #Over 2 characters and only letters
+SCORER_PARAMS = ('bm25_k1', 'bm25_b', 'bm25_delta', 'dirichlet_mu')
+GENERATION_BITS = 32 #A document is identified by DocNumber and generation, so a document read again counts as new
 
 class Indexer:
     
@@ -17,12 +27,21 @@ class Indexer:
         logger.info('Starting execution...', extra=logger_extra_dict)
         self.config = self.read_config_file(SRC_FOLDER_PATH + 'config/INDEX.CFG')
         self.result_folder_path = SRC_FOLDER_PATH + 'result/'
+        self.instrumentation = Instrumentation('Indexer', SRC_FOLDER_PATH)
 
     def read_config_file(self, path: str):
         logger.info('Reading config file...', extra=logger_extra_dict)
         config = {
             'read': None,
-            'write': None
+            'write': [],
+            'tf_normalized': None,
+            'scorers': [],
+            'bm25_k1': 1.2,
+            'bm25_b': 0.75,
+            'bm25_delta': 1.0,
+            'dirichlet_mu': 2000.0,
+            'shards': 1,
+            'segments': None
         }
 
         try:
@@ -34,7 +53,23 @@ class Indexer:
                     if key == 'LEIA':
                         config['read'] = value
                     elif key == 'ESCREVA':
-                        config['write'] = value
+                        config['write'].append(value)
+                    elif key == 'NORMALIZAR_TF':
+                        config['tf_normalized'] = value.upper() in ('S', 'Y')
+                    elif key == 'PONTUACAO':
+                        config['scorers'].append(value.upper())
+                    elif key == 'BM25_K1':
+                        config['bm25_k1'] = float(value)
+                    elif key == 'BM25_B':
+                        config['bm25_b'] = float(value)
+                    elif key == 'BM25_DELTA':
+                        config['bm25_delta'] = float(value)
+                    elif key == 'DIRICHLET_MU':
+                        config['dirichlet_mu'] = float(value)
+                    elif key == 'FRAGMENTOS':
+                        config['shards'] = int(value)
+                    elif key == 'SEGMENTOS':
+                        config['segments'] = value
         except FileNotFoundError:
             logger.error(f'Config file "{path}" not found. Exiting program.', extra=logger_extra_dict)
             exit(1)
@@ -42,22 +77,25 @@ class Indexer:
             logger.error(f'Error while reading config file. Please check file structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
 
+        if config['shards'] < 1:
+            logger.error(f'FRAGMENTOS must be at least 1. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        for name in config['scorers']:
+            if name not in scoring.IMPACT_SCORERS:
+                logger.error(f'Unknown scorer "{name}" in PONTUACAO. Available: {", ".join(scoring.IMPACT_SCORERS)}. Exiting program.', extra=logger_extra_dict)
+                exit(1)
         logger.info('Config file successfully read.', extra=logger_extra_dict)
         return config
 
-    def read_input_file(self):
+    def read_input_file(self) -> Postings:
         logger.info(f'Reading input file: {self.config["read"]}', extra=logger_extra_dict)
-        inv_list = {}
         filepath = self.result_folder_path + self.config['read']
         try:
-            with open(filepath, 'r') as file:
-                next(file) # Skips header
-                lines = file.readlines()
-
-                for line in lines:
-                    word, appearence_str = line.strip().split(';')
-                    appearence_list = ast.literal_eval(appearence_str)
-                    inv_list[word] = appearence_list
+            with self.instrumentation.span('read'):
+                if filepath.endswith('.csv'):
+                    postings = Postings.from_occurrences_list(self.read_csv_inverted_list(filepath))
+                else:
+                    postings = Postings.read(filepath, read_positions=False) #Positions are only used by the SearchEngine
         except FileNotFoundError:
             logger.error(f'Input file "{self.config["read"]}" not found. Exiting program.', extra=logger_extra_dict)
             exit(1)
@@ -65,72 +103,212 @@ class Indexer:
             logger.error(f'Error while reading input file. Please check file structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
         
+        self.instrumentation.count_file_bytes('bytes_read', filepath)
         logger.info('Input file successfully read.', extra=logger_extra_dict)
-        logger.info(f'Number of terms in inverted index: {len(inv_list)}', extra=logger_extra_dict)
+        logger.info(f'Number of terms in inverted index: {len(postings.terms)}', extra=logger_extra_dict)
+        return postings
+
+    def read_csv_inverted_list(self, filepath: str) -> dict:
+        inv_list = {}
+        with open(filepath, 'r') as file:
+            next(file) # Skips header
+            lines = file.readlines()
+
+            for line in lines:
+                word, appearence_str = line.strip().split(';')
+                appearence_list = ast.literal_eval(appearence_str)
+                inv_list[word] = appearence_list
         return inv_list
     
-    def write_output_file(self, term_doc_matrix: pd.DataFrame):
+    def write_output_file(self, vector_model: VectorModel):
         logger.info(f'Writing output files: {self.config["write"]}', extra=logger_extra_dict)
-        filepath = self.result_folder_path + self.config['write']
-        try:
-            term_doc_matrix.to_csv(filepath, sep=';')
-        except Exception:
-            logger.error(f'Couldn\'t write output file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
-            exit(1)
+        shard_models = None
+        for filename in self.config['write']:
+            filepath = self.result_folder_path + filename
+            try:
+                with self.instrumentation.span('write'):
+                    if filepath.endswith('.csv'):
+                        self.write_csv_vector_model(filepath, vector_model)
+                        filepaths = [filepath]
+                    elif self.config['shards'] > 1:
+                        if shard_models is None:
+                            with self.instrumentation.span('partition'):
+                                shard_models = vector_model.partition(self.config['shards'])
+                        filepaths = self.write_shards(filepath, shard_models)
+                    else:
+                        vector_model.save(filepath)
+                        filepaths = [filepath]
+            except Exception:
+                logger.error(f'Couldn\'t write output file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
+                exit(1)
+            for path in filepaths:
+                self.instrumentation.count_file_bytes('bytes_written', path)
         logger.info('Output file successfully generated.', extra=logger_extra_dict)
 
-    def create_term_doc_matrix(self, inv_list: dict, tf_normalized) -> pd.DataFrame:
+    def write_shards(self, filepath: str, shard_models: list) -> list:
+        #One model file per shard, <name>_<shard>.idx, each with the same terms and global idf
+        filepaths = []
+        for shard, shard_model in enumerate(shard_models):
+            shard_filepath = VectorModel.shard_path(filepath, shard)
+            shard_model.save(shard_filepath, {'shard': shard, 'shards': len(shard_models)})
+            filepaths.append(shard_filepath)
+            logger.info(f'Shard {shard} written to {shard_filepath} ({len(shard_model.doc_numbers)} documents, {shard_model.normalized_weights.nnz} nonzero weights).', extra=logger_extra_dict)
+        return filepaths
+
+    def write_csv_vector_model(self, filepath: str, vector_model: VectorModel):
+        with open(filepath, 'w') as f:
+            for start in range(0, max(len(vector_model.terms), 1), OUTPUT_CHUNK_SIZE):
+                chunk_df = vector_model.to_dataframe(start, start + OUTPUT_CHUNK_SIZE)
+                chunk_df.to_csv(f, sep=';', header=(start == 0))
+
+    def select_terms(self, terms: list[str]) -> np.ndarray:
+        return np.array([TERM_PATTERN.match(term) is not None for term in terms], dtype=bool)
+
+    def build_vector_model(self, terms: list[str], docs_numbers: np.ndarray, tf: sp.csr_matrix, doc_lengths: np.ndarray, tf_normalized, doc_max_tfs: np.ndarray = None) -> VectorModel:
+        vector_model = VectorModel.from_term_frequencies(terms, docs_numbers, tf, tf_normalized, doc_max_tfs)
+        if self.config['scorers']:
+            with self.instrumentation.span('impacts'):
+                for name in self.config['scorers']:
+                    scoring.SCORERS[name]().index(vector_model, tf, doc_lengths, self.config)
+        return vector_model
+
+    def log_term_doc_matrix(self, vector_model: VectorModel):
+        self.instrumentation.count('documents', len(vector_model.doc_numbers))
+        self.instrumentation.count('terms', len(vector_model.terms))
+        self.instrumentation.count('postings', vector_model.normalized_weights.nnz)
+
+        logger.info('Document-term matrix successfully built.', extra=logger_extra_dict)
+        logger.info(f'Number of nonzero weights: {vector_model.normalized_weights.nnz} ({vector_model.normalized_weights.nnz/max(np.prod(vector_model.normalized_weights.shape), 1):.2%} of the matrix)', extra=logger_extra_dict)
+
+    def create_term_doc_matrix(self, postings: Postings, tf_normalized) -> VectorModel:
         logger.info('Building Document-term matrix...', extra=logger_extra_dict)
         
-        regex_pattern = re.compile(r'^[A-Z]{2,}$') #Over 2 characters and only letters
-        filtered_inv_list = {}
-        for key, value in inv_list.items():
-            if regex_pattern.match(key):
-                filtered_inv_list[key] = value
-        
-        terms = filtered_inv_list.keys()
-        docs_numbers = list(set().union(*inv_list.values()))
+        with self.instrumentation.span('matrix'):
+            docs_numbers = postings.doc_numbers()
+            selected_postings = postings.select_terms(self.select_terms(postings.terms))
+            with self.instrumentation.span('tf'):
+                tf = VectorModel.term_frequencies(selected_postings, docs_numbers)
+            #Document lengths count the tokens of every term, including the ones left out of the model
+            doc_lengths = np.bincount(np.searchsorted(docs_numbers, postings.docs), weights=postings.tfs, minlength=len(docs_numbers))
+            vector_model = self.build_vector_model(selected_postings.terms, docs_numbers, tf, doc_lengths, tf_normalized)
+        self.log_term_doc_matrix(vector_model)
+        return vector_model
 
-        term_x_doc_df = pd.DataFrame(index=terms, columns=docs_numbers, dtype='float')
-        term_x_doc_df.fillna(0, inplace=True)
-        
-        for term, appearence in filtered_inv_list.items():
-            for doc_number in appearence:
-                term_x_doc_df.at[term, doc_number] += 1 #Counts the term frequency (tf) in documents
-        
-        if(tf_normalized):
-            max_term_freq = term_x_doc_df.max()
-            term_x_doc_df = term_x_doc_df / max_term_freq
-        
-        documents_count = len(docs_numbers)
+    def read_segmented_index(self) -> SegmentedIndex:
+        folder_path = self.result_folder_path + self.config['segments']
+        if not os.path.exists(os.path.join(folder_path, MANIFEST_FILENAME)):
+            logger.error(f'Segmented index "{self.config["segments"]}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        return SegmentedIndex(folder_path)
 
-        term_x_doc_df['doc_freq'] = term_x_doc_df.apply(lambda row: (row != 0).sum(), axis=1) #Doc frequency for each term
-        term_x_doc_df['idf'] = np.log10(documents_count/term_x_doc_df['doc_freq'])
-        term_x_doc_df.drop('doc_freq', axis=1, inplace=True)
+    def segments_info(self, segmented_index: SegmentedIndex, tf_normalized) -> dict:
+        #Everything the model depends on besides the documents. A previous model built with other values is not updated
+        #but built again.
+        return {'id': segmented_index.id, 'tf_normalized': bool(tf_normalized), 'scorers': self.config['scorers'], 'params': {key: self.config[key] for key in SCORER_PARAMS}}
 
-        docs_columns = term_x_doc_df.columns[term_x_doc_df.columns != 'idf']  #Exclude 'idf' column
-        term_x_doc_df[docs_columns] = term_x_doc_df[docs_columns].mul(term_x_doc_df['idf'], axis=0) #Calculates tf-idf
+    def read_previous_model(self, segments_info: dict) -> VectorModel:
+        #The model written by the previous run (first .idx in ESCREVA) is the base of the update
+        filepaths = [self.result_folder_path + filename for filename in self.config['write'] if not filename.endswith('.csv')]
+        if self.config['shards'] > 1 or not filepaths or not os.path.exists(filepaths[0]):
+            return None
+        try:
+            with self.instrumentation.span('read'):
+                vector_model = VectorModel.load(filepaths[0])
+        except Exception:
+            logger.warning(f'Couldn\'t read previous model "{filepaths[0]}", building it again.', extra=logger_extra_dict)
+            return None
+        if vector_model.segments != segments_info:
+            logger.info('Previous model was built from another index or with other options, building it again.', extra=logger_extra_dict)
+            return None
+        return vector_model
 
-        logger.info('Document-term matrix successfully built.', extra=logger_extra_dict)
-        return term_x_doc_df
+    def update_term_doc_matrix(self, segmented_index: SegmentedIndex, tf_normalized) -> VectorModel:
+        #Only the postings of the documents added since the previous model (new ones, or read again and so with another
+        #generation) are read from the segments. The tfs, highest tf and generation of the other documents come from the
+        #previous model, and their lengths from the manifest. N, df and idf change with any update, so the weights and
+        #impacts are then computed again from the tfs, vectorized.
+        logger.info('Updating Document-term matrix from segmented index...', extra=logger_extra_dict)
+        segments_info = self.segments_info(segmented_index, tf_normalized)
+        previous_model = self.read_previous_model(segments_info)
+        if previous_model is None:
+            previous_terms, previous_tf = [], sp.csr_matrix((0, 0), dtype=np.float64)
+            previous_docs, previous_generations, previous_max_tfs = (np.zeros(0, dtype=np.int64) for _ in range(3))
+        else:
+            previous_terms, previous_tf = previous_model.terms, previous_model.tf_matrix()
+            previous_docs, previous_generations, previous_max_tfs = previous_model.doc_numbers.astype(np.int64), previous_model.doc_generations, previous_model.doc_max_tfs
+
+        live_docs, live_generations, live_lengths = segmented_index.live_documents()
+        live_keys = live_docs << GENERATION_BITS | live_generations
+        previous_keys = previous_docs << GENERATION_BITS | previous_generations
+        kept = np.isin(previous_keys, live_keys)
+        added = ~np.isin(live_keys, previous_keys)
+        added_docs = live_docs[added]
+        with self.instrumentation.span('read'):
+            added_postings = segmented_index.read_documents(added_docs, read_positions=False) #Positions are only used by the SearchEngine
+        self.instrumentation.count('documents_added', len(added_docs))
+        self.instrumentation.count('documents_removed', int(np.count_nonzero(~kept)))
+        logger.info(f'{len(added_docs)} documents added and {np.count_nonzero(~kept)} removed since the previous model.', extra=logger_extra_dict)
+
+        with self.instrumentation.span('matrix'):
+            selected_postings = added_postings.select_terms(self.select_terms(added_postings.terms))
+            term_ids = {term: i for i, term in enumerate(previous_terms)}
+            new_term_ids = np.array([term_ids.setdefault(term, len(term_ids)) for term in selected_postings.terms], dtype=np.int64)
+            terms = list(term_ids.keys())
+
+            #Kept documents come first, then the added ones, before the columns are sorted by DocNumber
+            previous_tf = previous_tf[:, np.flatnonzero(kept)].tocoo()
+            added_columns = np.searchsorted(added_docs, selected_postings.docs)
+            doc_numbers = np.concatenate((previous_docs[kept], added_docs))
+            order = np.argsort(doc_numbers)
+            columns = np.empty(len(order), dtype=np.int64)
+            columns[order] = np.arange(len(order))
+            rows = np.concatenate((previous_tf.row, new_term_ids[selected_postings.term_rows()]))
+            data = np.concatenate((previous_tf.data, selected_postings.tfs.astype(np.float64)))
+            tf = sp.csr_matrix((data, (rows, columns[np.concatenate((previous_tf.col, kept.sum() + added_columns))])), shape=(len(terms), len(doc_numbers)))
+            tf.sort_indices()
+
+            added_max_tfs = np.zeros(len(added_docs), dtype=np.int64)
+            np.maximum.at(added_max_tfs, added_columns, selected_postings.tfs)
+            doc_max_tfs = np.concatenate((previous_max_tfs[kept], added_max_tfs))[order]
+            doc_generations = np.concatenate((previous_generations[kept], live_generations[added]))[order]
+            doc_numbers = doc_numbers[order]
+
+            #Terms found only in removed documents are dropped
+            non_empty = np.diff(tf.indptr) > 0
+            if not non_empty.all():
+                terms = [term for term, keep in zip(terms, non_empty) if keep]
+                tf = tf[non_empty]
+            vector_model = self.build_vector_model(terms, doc_numbers, tf, live_lengths, tf_normalized, doc_max_tfs)
+            vector_model.set_segment_statistics(segments_info, tf.data.astype(np.int64), doc_max_tfs, doc_generations)
+        self.log_term_doc_matrix(vector_model)
+        return vector_model
 
-    def run(self):
-        inv_list = self.read_input_file()
+    def run(self, postings: Postings = None, write_output: bool = True) -> VectorModel:
+        #The postings may come straight from the ReverseListGenerator, otherwise they are read from LEIA, or from the
+        #segmented index when SEGMENTOS is set, updating the previous model
+        if postings is None and self.config['segments'] is None:
+            postings = self.read_input_file()
         
-        ans = input('Should term frequency (tf) be normalized? (Y or N)\n')
-        tf_normalized = False
-        if ans.upper() == 'Y':
-            tf_normalized = True
+        tf_normalized = self.config['tf_normalized']
+        if tf_normalized is None: #Only asked when NORMALIZAR_TF is not in the config file
+            ans = input('Should term frequency (tf) be normalized? (Y or N)\n')
+            tf_normalized = ans.upper() == 'Y'
         
         start_time = time.time()
-        term_doc_matrix = self.create_term_doc_matrix(inv_list, tf_normalized)
+        if postings is None:
+            term_doc_matrix = self.update_term_doc_matrix(self.read_segmented_index(), tf_normalized)
+        else:
+            term_doc_matrix = self.create_term_doc_matrix(postings, tf_normalized)
         end_time = time.time()
         run_time = end_time - start_time
-        avg_time = run_time/len(inv_list)
+        avg_time = run_time/max(len(term_doc_matrix.terms), 1)
         logger.info(f'Total processing time for all terms: {run_time: .2e}s', extra=logger_extra_dict)
         logger.info(f'Average processing time per term: {avg_time: .2e}s', extra=logger_extra_dict)
-        self.write_output_file(term_doc_matrix)
+        if write_output:
+            self.write_output_file(term_doc_matrix)
+        self.instrumentation.finish()
         logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+        return term_doc_matrix
 
 if __name__ == '__main__':
     idx = Indexer()
@@ -0,0 +1,142 @@
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
+logger_extra_dict = {'className': 'Instrumentation'}
+logger = logging.getLogger(__name__)
+
+TRACEMALLOC_TOP_LINES = 10 #Allocation sites kept in the metrics when memory capture is enabled
+SUMMARY_SPANS = 5 #Slowest spans shown in the log at the end of a stage
+
+current = None #Instrumentation of the stage running in this process, used by the span and count helpers
+
+class Instrumentation:
+    #Named timers (spans) and counters of one pipeline stage. Spans opened inside other spans are recorded
+    #with their full path (e.g. "matrix/idf"). At the end of the stage, a JSON line is appended to the metrics file.
+    #cProfile and tracemalloc captures are enabled per stage in config/INSTRUMENTACAO.CFG.
+
+    def __init__(self, stage: str, src_folder_path: str = '') -> None:
+        global current
+        self.stage = stage
+        self.config = self.read_config_file(src_folder_path + 'config/INSTRUMENTACAO.CFG')
+        self.result_folder_path = src_folder_path + 'result/'
+        self.spans = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start_time = time.perf_counter()
+
+        self.profiler = None
+        if stage in self.config['profile']:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.trace_memory = stage in self.config['memory'] and not tracemalloc.is_tracing()
+        if self.trace_memory:
+            tracemalloc.start()
+        current = self
+
+    def read_config_file(self, path: str):
+        config = {
+            'metrics': None,
+            'profile': [],
+            'memory': []
+        }
+
+        #Instrumentation is optional, without its config file only the spans and counters are kept in memory
+        if not os.path.exists(path):
+            return config
+        try:
+            with open(path, 'r') as file:
+                lines = file.readlines()
+
+                for line in lines:
+                    key, value = line.strip().split('=')
+                    if key == 'METRICAS':
+                        config['metrics'] = value
+                    elif key == 'PERFIL':
+                        config['profile'].append(value)
+                    elif key == 'MEMORIA':
+                        config['memory'].append(value)
+        except Exception:
+            logger.error(f'Error while reading config file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        return config
+
+    @contextmanager
+    def span(self, name: str):
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(name)
+        path = '/'.join(stack)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            stack.pop()
+            with self.lock:
+                span_totals = self.spans.setdefault(path, [0.0, 0])
+                span_totals[0] += elapsed
+                span_totals[1] += 1
+
+    def count(self, name: str, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_file_bytes(self, name: str, path: str):
+        if os.path.exists(path):
+            self.count(name, os.path.getsize(path))
+
+    def finish(self) -> dict:
+        global current
+        if current is self:
+            current = None
+        metrics = {
+            'stage': self.stage,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'time': time.perf_counter() - self.start_time,
+            'spans': {path: {'time': total, 'calls': calls} for path, (total, calls) in self.spans.items()},
+            'counters': dict(self.counters)
+        }
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            profile_path = self.result_folder_path + f'perfil_{self.stage}.prof'
+            self.profiler.dump_stats(profile_path) #Readable with pstats or snakeviz
+            metrics['profile'] = profile_path
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            metrics['memory'] = {
+                'peak_mb': peak/1024/1024,
+                'top': [{'line': str(stat.traceback), 'size_mb': stat.size/1024/1024, 'blocks': stat.count} for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP_LINES]]
+            }
+
+        slowest = sorted(metrics['spans'].items(), key=lambda item: -item[1]['time'])[:SUMMARY_SPANS]
+        logger.info(f'{self.stage} spans: ' + ', '.join(f'{path} {info["time"]:.3f}s' for path, info in slowest), extra=logger_extra_dict)
+        if self.counters:
+            logger.info(f'{self.stage} counters: ' + ', '.join(f'{name}={value}' for name, value in self.counters.items()), extra=logger_extra_dict)
+
+        if self.config['metrics']:
+            try:
+                with open(self.result_folder_path + self.config['metrics'], 'a') as file:
+                    file.write(json.dumps(metrics) + '\n')
+            except Exception:
+                logger.error(f'Couldn\'t write metrics file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
+                exit(1)
+        return metrics
+
+def span(name: str):
+    #Hook for code shared by several stages: times the block in the running stage, if there is one
+    return current.span(name) if current is not None else nullcontext()
+
+def count(name: str, value=1):
+    if current is not None:
+        current.count(name, value)
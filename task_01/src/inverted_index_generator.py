@@ -1,14 +1,61 @@
-import xml.etree.ElementTree as ET
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import heapq
+import itertools
 import logging
+import os
+import tempfile
 import time
+import numpy as np
+import xml_records
+from analyzer import Analyzer
+from instrumentation import Instrumentation
+from postings import Postings, PostingsReader, PostingsWriter, range_indices
+from segments import SegmentedIndex
 
 logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
 logger_extra_dict = {'className': 'ReverseListGenerator'}
 logger = logging.getLogger(__name__)
 
 SRC_FOLDER_PATH = ''
+DOCUMENTS_PER_TASK = 100 #Documents sent to a worker process at a time in parallel mode
+TASKS_PER_PROCESS = 2 #Tasks waiting in the pool per worker, which bounds the documents held in memory
+BLOCK_BYTES_PER_TERM = 200 #Estimated memory of a term in an in-memory block (dict entry, string and list)
+BLOCK_BYTES_PER_POSTING = 150 #Estimated memory of each (docid, positions) posting appended to a term list
+BLOCK_BYTES_PER_OCCURRENCE = 36 #Estimated memory of each position in a posting
+
+worker_analyzer = None
+
+def init_worker():
+    #Each worker process keeps its own analyzer, so its caches warm up across tasks
+    global worker_analyzer
+    worker_analyzer = Analyzer()
+
+def build_single_inverted_index(id, text, analyzer: Analyzer):
+    #Each term gets a single (id, positions) posting
+    inv_list = {}
+
+    for w, position in analyzer.analyze_document_positions(text):
+        if w not in inv_list.keys():
+            inv_list[w] = [(id, [position])]
+        else:
+            inv_list[w][0][1].append(position)
+    
+    return inv_list
+
+def build_partial_inverted_index(records: list):
+    #Runs in a worker process: builds the inverted index of a shard of (id, abstract) records
+    partial_inv_index = {}
+    for id, abstract in records:
+        merge_inverted_index(partial_inv_index, build_single_inverted_index(id, abstract, worker_analyzer))
+    return partial_inv_index
+
+def merge_inverted_index(inv_index: dict, partial_inv_index: dict):
+    for word, count in partial_inv_index.items():
+        if word in inv_index:
+            inv_index[word] += count
+        else:
+            inv_index[word] = count
 
 class ReverseListGenerator:
 
@@ -17,14 +64,19 @@ class ReverseListGenerator:
         self.config = self.read_config_file(SRC_FOLDER_PATH + 'config/GLI.CFG')
         self.data_folder_path = SRC_FOLDER_PATH + 'data/'
         self.result_folder_path = SRC_FOLDER_PATH + 'result/'
-        self.stop_words = set(s.upper() for s in stopwords.words('english')).union(".", ",", ";", "!", "?", ";", "=", "<", "+", "``", "%", "[", "]", "(", ")", '"', "'", ":", "-", "")
+        self.analyzer = Analyzer()
+        self.instrumentation = Instrumentation('ReverseListGenerator', SRC_FOLDER_PATH)
         self.inverted_list = {}
 
     def read_config_file(self, path: str):
         logger.info('Reading config file...', extra=logger_extra_dict)
         config = {
             'read': [],
-            'write': None
+            'write': [],
+            'processes': 1,
+            'segments': None,
+            'delete': [],
+            'memory_mb': None
         }
 
         try:
@@ -36,7 +88,15 @@ class ReverseListGenerator:
                     if key == 'LEIA':
                         config['read'].append(value)
                     elif key == 'ESCREVA':
-                        config['write'] = value
+                        config['write'].append(value)
+                    elif key == 'PROCESSOS':
+                        config['processes'] = int(value)
+                    elif key == 'SEGMENTOS':
+                        config['segments'] = value
+                    elif key == 'REMOVA':
+                        config['delete'].append(int(value))
+                    elif key == 'MEMORIA_MB':
+                        config['memory_mb'] = float(value)
             logger.info('Config file successfully read.', extra=logger_extra_dict)
         
         except FileNotFoundError:
@@ -45,20 +105,18 @@ class ReverseListGenerator:
         except Exception:
             logger.error(f'Error while reading config file. Please check file structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
+
+        #The block build is a single-process full build, it doesn't update segments nor start worker processes
+        if config['memory_mb'] and config['segments']:
+            logger.error(f'MEMORIA_MB and SEGMENTOS can\'t be used together. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        if config['memory_mb'] and config['processes'] > 1:
+            logger.warning(f'PROCESSOS is ignored when MEMORIA_MB is set, the blocks are built in a single process.', extra=logger_extra_dict)
         return config
 
     def build_single_inverted_index(self, id, text):
-        inv_list = {}
-
-        tokens = word_tokenize(text.upper())
-        for w in tokens:
-            if w not in self.stop_words and not w.isdigit():
-                if w not in inv_list.keys():
-                    inv_list[w] = [id]
-                else:
-                    inv_list[w].append(id)
-        
-        return inv_list
+        with self.instrumentation.span('tokenize'):
+            return build_single_inverted_index(id, text, self.analyzer)
 
     def read_input_files(self) -> dict:
         logger.info(f'Reading input files: {self.config["read"]}', extra=logger_extra_dict)
@@ -67,65 +125,273 @@ class ReverseListGenerator:
         for filename in self.config['read']:
             filepath = self.data_folder_path + filename
             try:
-                tree = ET.parse(filepath)
-                root = tree.getroot()
-            except Exception:
+                with self.instrumentation.span('parse'):
+                    for record_num, abstract in xml_records.iter_documents(filepath):
+                        records_dict[record_num] = abstract
+            except FileNotFoundError:
                 logger.error(f'Input file "{filepath}" not found. Exiting program.', extra=logger_extra_dict)
                 exit(1)
-            
-            for record in root.findall('.//RECORD'):
-                record_num = int(record.find('RECORDNUM').text)
-                abstract_element = record.find('ABSTRACT')
-                if abstract_element != None:
-                    abstract = abstract_element.text
-                if abstract_element == None:
-                    abstract_element = record.find('EXTRACT')
-                    if abstract_element != None:
-                        abstract = abstract_element.text
-                
-                records_dict[record_num] = abstract
+            except Exception:
+                logger.error(f'Error while reading input file "{filepath}". Please check file structure. Exiting program.', extra=logger_extra_dict)
+                exit(1)
+            self.instrumentation.count_file_bytes('bytes_read', filepath)
 
+        self.instrumentation.count('documents', len(records_dict))
         logger.info('Input files successfully read.', extra=logger_extra_dict)
         logger.info(f'Number of documents read: {len(records_dict)}', extra=logger_extra_dict)
         return records_dict
     
-    def write_output_file(self, inv_list):
+    def iter_input_records(self, filenames: list[str]):
+        #Streams (id, abstract) pairs, memory is bounded by xml_records.READ_CHUNK_BYTES and doesn't grow with the file size
+        for filename in filenames:
+            filepath = self.data_folder_path + filename
+            self.instrumentation.count_file_bytes('bytes_read', filepath)
+            try:
+                for record_num, abstract in xml_records.iter_documents(filepath):
+                    self.instrumentation.count('documents')
+                    yield record_num, abstract
+            except FileNotFoundError:
+                logger.error(f'Input file "{filepath}" not found. Exiting program.', extra=logger_extra_dict)
+                exit(1)
+            except Exception:
+                logger.error(f'Error while reading input file "{filepath}". Please check file structure. Exiting program.', extra=logger_extra_dict)
+                exit(1)
+
+    def build_parallel_inverted_index(self, filenames: list[str]):
+        logger.info(f'Reading input files: {filenames} with {self.config["processes"]} processes', extra=logger_extra_dict)
+        inv_index = {}
+        record_numbers = []
+        pending_tasks = deque()
+
+        with ProcessPoolExecutor(self.config['processes'], initializer=init_worker) as executor:
+            records = []
+            for record in self.iter_input_records(filenames):
+                records.append(record)
+                record_numbers.append(record[0])
+                if len(records) == DOCUMENTS_PER_TASK:
+                    pending_tasks.append(executor.submit(build_partial_inverted_index, records))
+                    records = []
+                #Partial indexes are merged in submission order, so postings keep the documents order
+                while len(pending_tasks) >= self.config['processes']*TASKS_PER_PROCESS:
+                    merge_inverted_index(inv_index, pending_tasks.popleft().result())
+            if records:
+                pending_tasks.append(executor.submit(build_partial_inverted_index, records))
+            while pending_tasks:
+                merge_inverted_index(inv_index, pending_tasks.popleft().result())
+
+        logger.info(f'Number of documents read: {len(record_numbers)}', extra=logger_extra_dict)
+        return inv_index, record_numbers
+
+    def build_streaming_inverted_index(self, filenames: list[str]):
+        if self.config['processes'] > 1:
+            return self.build_parallel_inverted_index(filenames)
+        logger.info(f'Reading input files: {filenames}', extra=logger_extra_dict)
+        inv_index = {}
+        record_numbers = []
+        for id, abstract in self.iter_input_records(filenames):
+            single_inv_index = self.build_single_inverted_index(id, abstract)
+            with self.instrumentation.span('merge'):
+                merge_inverted_index(inv_index, single_inv_index)
+            record_numbers.append(id)
+        logger.info(f'Number of documents read: {len(record_numbers)}', extra=logger_extra_dict)
+        return inv_index, record_numbers
+
+    def build_external_memory_index(self):
+        #SPIMI: documents are indexed into an in-memory block until the memory budget is reached, then the block
+        #is written to disk with its terms sorted. At the end, the blocks are combined with a k-way merge.
+        memory_budget = self.config['memory_mb']*1024*1024
+        documents_count = 0
+        with tempfile.TemporaryDirectory(dir=self.result_folder_path) as blocks_folder:
+            block_paths = []
+            block, block_size = {}, 0
+            for id, abstract in self.iter_input_records(self.config['read']):
+                single_inv_index = self.build_single_inverted_index(id, abstract)
+                for word, word_postings in single_inv_index.items():
+                    block_size += BLOCK_BYTES_PER_POSTING + len(word_postings[0][1])*BLOCK_BYTES_PER_OCCURRENCE + (BLOCK_BYTES_PER_TERM if word not in block else 0)
+                with self.instrumentation.span('merge'):
+                    merge_inverted_index(block, single_inv_index)
+                documents_count += 1
+                if block_size >= memory_budget:
+                    block_paths.append(self.write_block(blocks_folder, len(block_paths), block))
+                    block, block_size = {}, 0
+            if block:
+                block_paths.append(self.write_block(blocks_folder, len(block_paths), block))
+
+            logger.info(f'Number of documents read: {documents_count}', extra=logger_extra_dict)
+            logger.info(f'Merging {len(block_paths)} blocks...', extra=logger_extra_dict)
+            with self.instrumentation.span('merge_blocks'):
+                #The memory budget is shared by the decoding buffers of the blocks
+                self.write_merged_blocks(block_paths, max(int(memory_budget/(len(block_paths)*BLOCK_BYTES_PER_POSTING)), 1))
+        return documents_count
+
+    def write_block(self, blocks_folder: str, block_number: int, block: dict) -> str:
+        block_path = os.path.join(blocks_folder, f'block_{block_number:06d}.idx')
+        with self.instrumentation.span('write_block'):
+            Postings.from_inverted_list(block).sort_terms().write(block_path)
+        self.instrumentation.count_file_bytes('block_bytes_written', block_path)
+        return block_path
+
+    def write_merged_blocks(self, block_paths: list[str], buffer_postings: int):
         logger.info(f'Writing output files: {self.config["write"]}', extra=logger_extra_dict)
-        filepath = self.result_folder_path + self.config['write']
         try:
-            with open(filepath, 'w') as f:
-                f.write('WORD;APPEARENCE\n')
-                for word, count in inv_list.items():
-                    f.write(word + ';' + str(count) + '\n')
+            csv_files = []
+            postings_writers = []
+            for filename in self.config['write']:
+                filepath = self.result_folder_path + filename
+                if filepath.endswith('.csv'):
+                    csv_files.append(open(filepath, 'w'))
+                    csv_files[-1].write('WORD;APPEARENCE\n')
+                else:
+                    postings_writers.append(PostingsWriter(filepath))
+
+            readers = [PostingsReader(block_path).iter_terms(buffer_postings) for block_path in block_paths]
+            merged_terms = heapq.merge(*readers, key=lambda term_postings: term_postings[0])
+            for term, term_postings in itertools.groupby(merged_terms, key=lambda term_postings: term_postings[0]):
+                term_postings = list(term_postings)
+                if len(term_postings) == 1: #Term found in a single block, already sorted by document
+                    _, docs, tfs, positions = term_postings[0]
+                else:
+                    docs = np.concatenate([p[1] for p in term_postings])
+                    tfs = np.concatenate([p[2] for p in term_postings])
+                    positions = np.concatenate([p[3] for p in term_postings])
+                if len(term_postings) > 1 and np.any(docs[1:] < docs[:-1]):
+                    order = np.argsort(docs, kind='stable')
+                    positions = positions[range_indices((np.cumsum(tfs) - tfs)[order], tfs[order])]
+                    docs, tfs = docs[order], tfs[order]
+                for f in csv_files:
+                    f.write(term + ';' + str(np.repeat(docs, tfs).tolist()) + '\n')
+                for writer in postings_writers:
+                    writer.add(term, docs, tfs, positions)
+                self.instrumentation.count('terms')
+                self.instrumentation.count('postings', len(docs))
+                self.instrumentation.count('tokens', int(tfs.sum()))
+
+            for f in csv_files:
+                f.close()
+            for writer in postings_writers:
+                writer.close()
+            for filename in self.config['write']:
+                self.instrumentation.count_file_bytes('bytes_written', self.result_folder_path + filename)
         except Exception:
             logger.error(f'Couldn\'t write output file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
         logger.info('Output file successfully generated.', extra=logger_extra_dict)
 
-    def run(self):
-        records_dict = self.read_input_files()
-        inv_index = {}
-        
+    def file_signature(self, filename: str) -> str:
+        try:
+            file_stat = os.stat(self.data_folder_path + filename)
+        except FileNotFoundError:
+            logger.error(f'Input file "{self.data_folder_path + filename}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        return f'{file_stat.st_size}-{file_stat.st_mtime_ns}'
+
+    def update_segmented_index(self):
+        #Only files that are new or changed since the last run are read and tokenized, into a new segment.
+        #Documents of changed or removed files and the ones listed in REMOVA are recorded as tombstones.
+        segmented_index = SegmentedIndex(self.result_folder_path + self.config['segments'])
+        segmented_index.remove_obsolete_segments()
+        indexed_files = segmented_index.source_files()
+        current_files = {filename: self.file_signature(filename) for filename in self.config['read']}
+
+        for filename, signature in indexed_files.items():
+            if current_files.get(filename) != signature:
+                logger.info(f'Removing documents of changed or removed file: {filename}', extra=logger_extra_dict)
+                segmented_index.delete_source_file(filename)
+
+        new_files = [filename for filename, signature in current_files.items() if indexed_files.get(filename) != signature]
+        logger.info(f'Files to be indexed in a new segment: {new_files}', extra=logger_extra_dict)
+        if new_files:
+            inv_index = {}
+            files_info = {}
+            for filename in new_files:
+                file_inv_index, record_numbers = self.build_streaming_inverted_index([filename])
+                merge_inverted_index(inv_index, file_inv_index)
+                files_info[filename] = {'signature': current_files[filename], 'docs': record_numbers}
+            segmented_index.add_segment(Postings.from_inverted_list(inv_index), files_info)
+        if self.config['delete']:
+            segmented_index.delete_documents(self.config['delete'])
+
+        logger.info(f'Index version {segmented_index.version} with {segmented_index.segments_count} segments.', extra=logger_extra_dict)
+        return segmented_index
+
+    def write_output_file(self, postings: Postings):
+        logger.info(f'Writing output files: {self.config["write"]}', extra=logger_extra_dict)
+        self.instrumentation.count('terms', len(postings.terms))
+        self.instrumentation.count('postings', len(postings.docs))
+        self.instrumentation.count('tokens', int(postings.tfs.sum()))
+        for filename in self.config['write']:
+            filepath = self.result_folder_path + filename
+            try:
+                with self.instrumentation.span('write'):
+                    if filepath.endswith('.csv'):
+                        self.write_csv_inverted_list(filepath, postings.to_inverted_list())
+                    else:
+                        postings.write(filepath)
+            except Exception:
+                logger.error(f'Couldn\'t write output file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
+                exit(1)
+            self.instrumentation.count_file_bytes('bytes_written', filepath)
+        logger.info('Output file successfully generated.', extra=logger_extra_dict)
+
+    def write_csv_inverted_list(self, filepath: str, inv_list):
+        with open(filepath, 'w') as f:
+            f.write('WORD;APPEARENCE\n')
+            for word, count in inv_list.items():
+                f.write(word + ';' + str(count) + '\n')
+
+    def build_postings(self) -> Postings:
+        #Records are streamed from the input files, so only the inverted index is kept in memory
         logger.info('Building inverted index...', extra=logger_extra_dict)
         start_time = time.perf_counter()
-
-        for id, abstract in records_dict.items():
-            single_inv_index = self.build_single_inverted_index(id, abstract)
-            for word, count in single_inv_index.items():
-                if word in inv_index:
-                    inv_index[word] += count
-                else:
-                    inv_index[word] = count
+        with self.instrumentation.span('index'):
+            inv_index, record_numbers = self.build_streaming_inverted_index(self.config['read'])
+        documents_count = len(record_numbers)
 
         end_time = time.perf_counter()
         run_time = end_time - start_time
-        avg_time = run_time/len(records_dict)
+        avg_time = run_time/max(documents_count, 1)
         logger.info('Inverted index successfully built.', extra=logger_extra_dict)
         logger.info(f'Total word processing time for all documents: {run_time: .2e}s', extra=logger_extra_dict)
         logger.info(f'Average processing time per document: {avg_time: .2e}s', extra=logger_extra_dict)
 
-        self.write_output_file(inv_index)
+        with self.instrumentation.span('postings'):
+            return Postings.from_inverted_list(inv_index)
+
+    def run(self, write_output: bool = True) -> Postings:
+        #Returns the postings for the next stage. In block and segments modes they are only written to disk, and None is returned
+        if self.config['memory_mb']:
+            logger.info(f'Building inverted index in blocks of {self.config["memory_mb"]}MB...', extra=logger_extra_dict)
+            start_time = time.perf_counter()
+            with self.instrumentation.span('index'):
+                documents_count = self.build_external_memory_index()
+            run_time = time.perf_counter() - start_time
+            logger.info('Inverted index successfully built.', extra=logger_extra_dict)
+            logger.info(f'Total processing time for all documents: {run_time: .2e}s', extra=logger_extra_dict)
+            logger.info(f'Average processing time per document: {run_time/max(documents_count, 1): .2e}s', extra=logger_extra_dict)
+            self.instrumentation.finish()
+            logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+            return None
+
+        if self.config['segments']:
+            #The Indexer (SEGMENTOS in INDEX.CFG) and the SearchEngine (POSICOES=<folder>) read the segments
+            #themselves, so nothing is returned. ESCREVA, when set, exports every live document, which rewrites
+            #the whole inverted list.
+            logger.info('Updating segmented inverted index...', extra=logger_extra_dict)
+            with self.instrumentation.span('index'):
+                segmented_index = self.update_segmented_index()
+            if write_output and self.config['write']:
+                self.write_output_file(segmented_index.live_postings())
+            segmented_index.start_background_merge()
+            self.instrumentation.finish()
+            logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+            return None
+
+        postings = self.build_postings()
+        if write_output:
+            self.write_output_file(postings)
+        self.instrumentation.finish()
         logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+        return postings
 
 if __name__ == '__main__':
     rlg = ReverseListGenerator()
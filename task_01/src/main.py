@@ -2,12 +2,40 @@ from indexer import Indexer
 from query_processor import QueryProcessor
 from inverted_index_generator import ReverseListGenerator
 from search_engine import SearchEngine
+from evaluator import Evaluator
+import argparse
 import nltk
 
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Runs the five modules of the retrieval system in sequence.')
+    parser.add_argument('--em-memoria', action='store_true', help='pass the inverted index, the model, the queries and the results between modules in memory')
+    parser.add_argument('--intermediarios', action='store_true', help='with --em-memoria, also write the intermediate files (inverted index, model, queries and expected results)')
+    parser.add_argument('--normalizar-tf', choices=['S', 'N'], type=str.upper, help='overrides NORMALIZAR_TF of INDEX.CFG')
+    return parser.parse_args()
+
 if __name__ == '__main__':
+    args = parse_arguments()
     nltk.download('stopwords')
     nltk.download('punkt')
-    ReverseListGenerator().run()
-    Indexer().run()
-    QueryProcessor().run()
-    SearchEngine().run()
\ No newline at end of file
+
+    def create_indexer():
+        #Each module starts its instrumentation when created, so the Indexer is only created when its turn comes
+        indexer = Indexer()
+        if args.normalizar_tf is not None:
+            indexer.config['tf_normalized'] = args.normalizar_tf == 'S'
+        return indexer
+
+    if args.em_memoria:
+        write_intermediate = args.intermediarios
+        #With MEMORIA_MB the inverted index is built on disk, so the Indexer reads it back
+        postings = ReverseListGenerator().run(write_output=write_intermediate)
+        vector_model = create_indexer().run(postings, write_output=write_intermediate)
+        query_dict, expected_results = QueryProcessor().run(write_output=write_intermediate)
+        results = SearchEngine().run(vector_model, query_dict, postings)
+        Evaluator().run(results, expected_results)
+    else:
+        ReverseListGenerator().run()
+        create_indexer().run()
+        QueryProcessor().run()
+        SearchEngine().run(keep_results=False)
+        Evaluator().run()
@@ -0,0 +1,313 @@
+import itertools
+import os
+from functools import cached_property
+import numpy as np
+import index_format
+
+WRITER_BUFFER_POSTINGS = 1000000 #Postings buffered by PostingsWriter before being encoded and written
+READER_BUFFER_POSTINGS = 1000000 #Postings decoded at once by PostingsReader when iterating over all the terms
+
+def encode_postings(doc_freq: np.ndarray, docs: np.ndarray, tfs: np.ndarray):
+    #Varint-encoded docids (as gaps) and tfs, with the number of bytes taken by each term in both streams
+    gaps = index_format.encode_gaps(docs, doc_freq)
+    term_rows = np.repeat(np.arange(len(doc_freq)), doc_freq)
+    docs_bytes = np.bincount(term_rows, weights=index_format.varint_lengths(gaps), minlength=len(doc_freq)).astype(np.int64)
+    tfs_bytes = np.bincount(term_rows, weights=index_format.varint_lengths(tfs), minlength=len(doc_freq)).astype(np.int64)
+    return index_format.encode_varint(gaps), index_format.encode_varint(tfs), docs_bytes, tfs_bytes
+
+def encode_positions(doc_freq: np.ndarray, tfs: np.ndarray, positions: np.ndarray):
+    #Varint-encoded positions, as gaps inside each posting, with the number of bytes taken by each term
+    gaps = index_format.encode_gaps(positions, tfs)
+    occurrence_rows = np.repeat(np.repeat(np.arange(len(doc_freq)), doc_freq), tfs)
+    positions_bytes = np.bincount(occurrence_rows, weights=index_format.varint_lengths(gaps), minlength=len(doc_freq)).astype(np.int64)
+    return index_format.encode_varint(gaps), positions_bytes
+
+def range_indices(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    #Concatenation of the index ranges [start, start + length)
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+
+class Postings:
+    #Array-backed inverted index: for each term, its documents (ascending) and the term frequency (tf) in each one.
+    #The positions of the term in each document (ascending, tf of them per posting) are kept when available.
+
+    def __init__(self, terms: list[str], doc_freq: np.ndarray, docs: np.ndarray, tfs: np.ndarray, positions: np.ndarray = None) -> None:
+        self.terms = terms
+        self.doc_freq = doc_freq
+        self.docs = docs
+        self.tfs = tfs
+        self.positions = positions
+
+    @classmethod
+    def from_inverted_list(cls, inv_list: dict):
+        #inv_list maps each term to a list of (docid, positions) postings
+        terms = list(inv_list.keys())
+        postings_count = np.fromiter((len(a) for a in inv_list.values()), dtype=np.int64, count=len(terms))
+        all_postings = list(itertools.chain.from_iterable(inv_list.values()))
+        posting_docs = np.fromiter((posting[0] for posting in all_postings), dtype=np.int64, count=len(all_postings))
+        posting_tfs = np.fromiter((len(posting[1]) for posting in all_postings), dtype=np.int64, count=len(all_postings))
+        positions = np.fromiter(itertools.chain.from_iterable(posting[1] for posting in all_postings), dtype=np.int64, count=posting_tfs.sum())
+        docs = np.repeat(posting_docs, posting_tfs)
+        rows = np.repeat(np.repeat(np.arange(len(terms)), postings_count), posting_tfs)
+
+        #A document read twice has two postings for the same term, which are joined
+        order = np.lexsort((positions, docs, rows))
+        docs, rows, positions = docs[order], rows[order], positions[order]
+        is_new_pair = np.ones(len(docs), dtype=bool)
+        is_new_pair[1:] = (docs[1:] != docs[:-1]) | (rows[1:] != rows[:-1])
+        starts = np.flatnonzero(is_new_pair)
+        tfs = np.diff(np.append(starts, len(docs)))
+        doc_freq = np.bincount(rows[starts], minlength=len(terms))
+        return cls(terms, doc_freq, docs[starts], tfs, positions)
+
+    @classmethod
+    def from_occurrences_list(cls, inv_list: dict):
+        #inv_list maps each term to a list with one docid per occurrence of the term (the CSV layout), without positions
+        terms = list(inv_list.keys())
+        occurrences_count = np.fromiter((len(a) for a in inv_list.values()), dtype=np.int64, count=len(terms))
+        docs = np.fromiter(itertools.chain.from_iterable(inv_list.values()), dtype=np.int64, count=occurrences_count.sum())
+        rows = np.repeat(np.arange(len(terms)), occurrences_count)
+
+        order = np.lexsort((docs, rows))
+        docs, rows = docs[order], rows[order]
+        is_new_pair = np.ones(len(docs), dtype=bool)
+        is_new_pair[1:] = (docs[1:] != docs[:-1]) | (rows[1:] != rows[:-1])
+        starts = np.flatnonzero(is_new_pair)
+        tfs = np.diff(np.append(starts, len(docs)))
+        doc_freq = np.bincount(rows[starts], minlength=len(terms))
+        return cls(terms, doc_freq, docs[starts], tfs)
+
+    @classmethod
+    def concatenate(cls, postings_list: list):
+        #Joins postings of disjoint document sets, keeping the terms in order of first appearance
+        term_ids = {}
+        rows, docs, tfs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        positions = [np.zeros(0, dtype=np.int64)]
+        for postings in postings_list:
+            ids = np.array([term_ids.setdefault(term, len(term_ids)) for term in postings.terms], dtype=np.int64)
+            rows.append(ids[postings.term_rows()])
+            docs.append(postings.docs)
+            tfs.append(postings.tfs)
+            positions.append(postings.positions)
+        rows, docs, tfs = np.concatenate(rows), np.concatenate(docs), np.concatenate(tfs)
+
+        order = np.lexsort((docs, rows))
+        doc_freq = np.bincount(rows, minlength=len(term_ids))
+        if any(p is None for p in positions):
+            return cls(list(term_ids.keys()), doc_freq, docs[order], tfs[order])
+        positions = np.concatenate(positions)[range_indices((np.cumsum(tfs) - tfs)[order], tfs[order])]
+        return cls(list(term_ids.keys()), doc_freq, docs[order], tfs[order], positions)
+
+    def remove_documents(self, doc_numbers: np.ndarray):
+        keep = ~np.isin(self.docs, doc_numbers)
+        doc_freq = np.bincount(self.term_rows()[keep], minlength=len(self.terms))
+        return Postings(self.terms, doc_freq, self.docs[keep], self.tfs[keep], self.select_positions(keep)).select_terms(doc_freq > 0)
+
+    def to_inverted_list(self) -> dict:
+        occurrences = np.repeat(self.docs, self.tfs)
+        occurrences_count = np.bincount(self.term_rows(), weights=self.tfs, minlength=len(self.terms)).astype(np.int64)
+        splits = np.split(occurrences, np.cumsum(occurrences_count)[:-1])
+        return {term: appearence.tolist() for term, appearence in zip(self.terms, splits)}
+
+    def term_starts(self) -> np.ndarray:
+        return np.cumsum(self.doc_freq) - self.doc_freq
+
+    def term_rows(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.terms)), self.doc_freq)
+
+    def doc_numbers(self) -> np.ndarray:
+        return np.unique(self.docs)
+
+    def select_positions(self, posting_mask: np.ndarray):
+        return self.positions[np.repeat(posting_mask, self.tfs)] if self.positions is not None else None
+
+    def select_terms(self, mask: np.ndarray):
+        posting_mask = np.repeat(mask, self.doc_freq)
+        terms = [term for term, keep in zip(self.terms, mask) if keep]
+        return Postings(terms, self.doc_freq[mask], self.docs[posting_mask], self.tfs[posting_mask], self.select_positions(posting_mask))
+
+    def sort_terms(self):
+        order = np.argsort(np.array(self.terms, dtype=object), kind='stable')
+        lengths = self.doc_freq[order]
+        indices = range_indices(self.term_starts()[order], lengths)
+        positions = None
+        if self.positions is not None:
+            positions = self.positions[range_indices((np.cumsum(self.tfs) - self.tfs)[indices], self.tfs[indices])]
+        return Postings([self.terms[i] for i in order], lengths, self.docs[indices], self.tfs[indices], positions)
+
+    @property
+    def has_positions(self) -> bool:
+        return self.positions is not None
+
+    @cached_property
+    def term_ids(self) -> dict:
+        return {term: i for i, term in enumerate(self.terms)}
+
+    @cached_property
+    def positions_starts(self) -> np.ndarray:
+        return np.cumsum(self.tfs) - self.tfs
+
+    def lookup(self, term: str):
+        #Documents, tfs and positions of a term, empty when it isn't in the index
+        if self.positions is None:
+            raise ValueError('The postings have no positions, they were built or read without them.')
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        start = self.term_starts()[term_id]
+        end = start + self.doc_freq[term_id]
+        positions_start = self.positions_starts[start]
+        positions_end = positions_start + self.tfs[start:end].sum()
+        return self.docs[start:end], self.tfs[start:end], self.positions[positions_start:positions_end]
+
+    def write(self, path: str):
+        docs, tfs, docs_bytes, tfs_bytes = encode_postings(self.doc_freq, self.docs, self.tfs)
+        sections = {
+            'terms': index_format.encode_terms(self.terms),
+            'doc_freq': self.doc_freq.astype(np.uint32),
+            'docs_ptr': np.concatenate(([0], np.cumsum(docs_bytes))).astype(np.uint64),
+            'tfs_ptr': np.concatenate(([0], np.cumsum(tfs_bytes))).astype(np.uint64),
+            'docs': docs,
+            'tfs': tfs,
+        }
+        if self.positions is not None:
+            positions, positions_bytes = encode_positions(self.doc_freq, self.tfs, self.positions)
+            sections['positions_ptr'] = np.concatenate(([0], np.cumsum(positions_bytes))).astype(np.uint64)
+            sections['positions'] = positions
+        index_format.write_index_file(path, 'postings', sections)
+
+    @classmethod
+    def read(cls, path: str, read_positions: bool = True):
+        #Files written before positions were indexed have no positions section
+        index_file = index_format.IndexFile(path)
+        if index_file.kind != 'postings':
+            raise ValueError(f'"{path}" is not a postings file.')
+        doc_freq = index_file.section('doc_freq').astype(np.int64)
+        docs = index_format.decode_gaps(index_format.decode_varint(index_file.section('docs')), doc_freq)
+        tfs = index_format.decode_varint(index_file.section('tfs'))
+        positions = None
+        if read_positions and 'positions' in index_file.sections:
+            positions = index_format.decode_gaps(index_format.decode_varint(index_file.section('positions')), tfs)
+        return cls(index_format.decode_terms(index_file.section('terms')), doc_freq, docs, tfs, positions)
+
+class PostingsReader:
+    #Decodes one term at a time from a memory-mapped postings file
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index_file = index_format.IndexFile(path)
+        if self.index_file.kind != 'postings':
+            raise ValueError(f'"{path}" is not a postings file.')
+        self.terms = index_format.decode_terms(self.index_file.section('terms'))
+        self.doc_freq = self.index_file.section('doc_freq')
+        self.docs_ptr = self.index_file.section('docs_ptr')
+        self.tfs_ptr = self.index_file.section('tfs_ptr')
+        self.docs = self.index_file.section('docs')
+        self.tfs = self.index_file.section('tfs')
+        self.has_positions = 'positions' in self.index_file.sections
+        if self.has_positions:
+            self.positions_ptr = self.index_file.section('positions_ptr')
+            self.positions = self.index_file.section('positions')
+
+    @cached_property
+    def term_ids(self) -> dict:
+        return {term: i for i, term in enumerate(self.terms)}
+
+    def term_postings(self, term_id: int):
+        lengths = self.doc_freq[term_id:term_id + 1].astype(np.int64)
+        gaps = index_format.decode_varint(self.docs[self.docs_ptr[term_id]:self.docs_ptr[term_id + 1]])
+        tfs = index_format.decode_varint(self.tfs[self.tfs_ptr[term_id]:self.tfs_ptr[term_id + 1]])
+        positions = None
+        if self.has_positions:
+            positions = index_format.decode_gaps(index_format.decode_varint(self.positions[self.positions_ptr[term_id]:self.positions_ptr[term_id + 1]]), tfs)
+        return index_format.decode_gaps(gaps, lengths), tfs, positions
+
+    def lookup(self, term: str):
+        #Documents, tfs and positions of a term, empty when it isn't in the index
+        if not self.has_positions:
+            raise ValueError(f'"{self.path}" has no positions.')
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return self.term_postings(term_id)
+
+    def decode_terms_range(self, start: int, stop: int):
+        #Docs, tfs and positions of the terms in [start, stop), each decoded with a single call
+        doc_freq = self.doc_freq[start:stop].astype(np.int64)
+        docs = index_format.decode_gaps(index_format.decode_varint(self.docs[self.docs_ptr[start]:self.docs_ptr[stop]]), doc_freq)
+        tfs = index_format.decode_varint(self.tfs[self.tfs_ptr[start]:self.tfs_ptr[stop]])
+        positions = None
+        if self.has_positions:
+            positions = index_format.decode_gaps(index_format.decode_varint(self.positions[self.positions_ptr[start]:self.positions_ptr[stop]]), tfs)
+        return doc_freq, docs, tfs, positions
+
+    def __iter__(self):
+        return self.iter_terms()
+
+    def iter_terms(self, buffer_postings: int = READER_BUFFER_POSTINGS):
+        #Terms are decoded in buffers of about buffer_postings postings, then split per term
+        postings_ends = np.cumsum(self.doc_freq, dtype=np.int64)
+        start = 0
+        while start < len(self.terms):
+            stop = max(int(np.searchsorted(postings_ends, postings_ends[start] + buffer_postings, side='right')), start + 1)
+            doc_freq, docs, tfs, positions = self.decode_terms_range(start, stop)
+            docs_bounds = np.concatenate(([0], np.cumsum(doc_freq))).tolist()
+            positions_bounds = np.concatenate(([0], np.cumsum(tfs))).tolist()
+            for i, term in enumerate(self.terms[start:stop]):
+                docs_start, docs_end = docs_bounds[i], docs_bounds[i + 1]
+                term_positions = positions[positions_bounds[docs_start]:positions_bounds[docs_end]] if positions is not None else None
+                yield term, docs[docs_start:docs_end], tfs[docs_start:docs_end], term_positions
+            start = stop
+
+class PostingsWriter:
+    #Writes a postings file term by term, keeping only a bounded buffer in memory
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.sections_dtypes = {'terms': np.uint8, 'doc_freq': np.uint32, 'docs_ptr': np.uint64, 'tfs_ptr': np.uint64, 'docs': np.uint8, 'tfs': np.uint8, 'positions_ptr': np.uint64, 'positions': np.uint8}
+        self.raw_files = {name: open(f'{path}.{name}.tmp', 'wb') for name in self.sections_dtypes}
+        self.docs_offset, self.tfs_offset, self.positions_offset = 0, 0, 0
+        self.raw_files['docs_ptr'].write(np.uint64(0).tobytes())
+        self.raw_files['tfs_ptr'].write(np.uint64(0).tobytes())
+        self.raw_files['positions_ptr'].write(np.uint64(0).tobytes())
+        self.terms_count = 0
+        self.buffer_doc_freq, self.buffer_docs, self.buffer_tfs, self.buffer_positions = [], [], [], []
+        self.buffered_postings = 0
+
+    def add(self, term: str, docs: np.ndarray, tfs: np.ndarray, positions: np.ndarray):
+        self.raw_files['terms'].write((('\n' if self.terms_count else '') + term).encode('utf-8'))
+        self.terms_count += 1
+        self.buffer_doc_freq.append(len(docs))
+        self.buffer_docs.append(docs)
+        self.buffer_tfs.append(tfs)
+        self.buffer_positions.append(positions)
+        self.buffered_postings += len(docs)
+        if self.buffered_postings >= WRITER_BUFFER_POSTINGS:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer_doc_freq:
+            return
+        doc_freq = np.array(self.buffer_doc_freq, dtype=np.int64)
+        buffer_tfs = np.concatenate(self.buffer_tfs)
+        docs, tfs, docs_bytes, tfs_bytes = encode_postings(doc_freq, np.concatenate(self.buffer_docs), buffer_tfs)
+        positions, positions_bytes = encode_positions(doc_freq, buffer_tfs, np.concatenate(self.buffer_positions))
+        self.raw_files['doc_freq'].write(doc_freq.astype(np.uint32).tobytes())
+        self.raw_files['docs_ptr'].write((self.docs_offset + np.cumsum(docs_bytes)).astype(np.uint64).tobytes())
+        self.raw_files['tfs_ptr'].write((self.tfs_offset + np.cumsum(tfs_bytes)).astype(np.uint64).tobytes())
+        self.raw_files['positions_ptr'].write((self.positions_offset + np.cumsum(positions_bytes)).astype(np.uint64).tobytes())
+        self.raw_files['docs'].write(docs.tobytes())
+        self.raw_files['tfs'].write(tfs.tobytes())
+        self.raw_files['positions'].write(positions.tobytes())
+        self.docs_offset += len(docs)
+        self.tfs_offset += len(tfs)
+        self.positions_offset += len(positions)
+        self.buffer_doc_freq, self.buffer_docs, self.buffer_tfs, self.buffer_positions = [], [], [], []
+        self.buffered_postings = 0
+
+    def close(self):
+        self.flush()
+        for raw_file in self.raw_files.values():
+            raw_file.close()
+        index_format.write_index_file(self.path, 'postings', {name: (f'{self.path}.{name}.tmp', dtype) for name, dtype in self.sections_dtypes.items()})
+        for name in self.sections_dtypes:
+            os.remove(f'{self.path}.{name}.tmp')
@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+DISK_MAX_ENTRIES = 100000 #Default number of results kept by the on-disk tier
+
+class QueryCache:
+    #Results of already answered queries. The memory tier keeps the most recently used entries, up to its capacity.
+    #The optional disk tier (a SQLite file) keeps results across runs. Every entry belongs to the index version
+    #it was computed with, so all of them are dropped when a rebuilt or updated index is loaded.
+
+    def __init__(self, capacity: int, disk_path: str = None, disk_max_entries: int = DISK_MAX_ENTRIES) -> None:
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.disk = None
+        self.disk_max_entries = disk_max_entries
+        if disk_path:
+            self.disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self.disk.execute('CREATE TABLE IF NOT EXISTS info (name TEXT PRIMARY KEY, value TEXT)')
+            self.disk.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, docs BLOB, scores BLOB, used INTEGER)')
+            self.disk_entries, last_used = self.disk.execute('SELECT COUNT(*), COALESCE(MAX(used), 0) FROM results').fetchone()
+            self.disk_clock = last_used
+
+    def set_version(self, version: str):
+        with self.lock:
+            if version == self.version:
+                return
+            self.version = version
+            self.entries.clear()
+            if self.disk is not None:
+                stored_version = self.disk.execute("SELECT value FROM info WHERE name = 'version'").fetchone()
+                if stored_version is None or stored_version[0] != version:
+                    self.disk.execute('DELETE FROM results')
+                    self.disk.execute("INSERT OR REPLACE INTO info VALUES ('version', ?)", (version,))
+                    self.disk.commit()
+                    self.disk_entries = 0
+
+    def get(self, key: str) -> pd.DataFrame:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.to_dataframe(*self.entries[key])
+            if self.disk is not None:
+                row = self.disk.execute('SELECT docs, scores FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self.disk_clock += 1
+                    self.disk.execute('UPDATE results SET used = ? WHERE key = ?', (self.disk_clock, key))
+                    self.stats['disk_hits'] += 1
+                    docs, scores = np.frombuffer(row[0], dtype=np.int64), np.frombuffer(row[1], dtype=np.float64)
+                    self.add_to_memory(key, docs, scores)
+                    return self.to_dataframe(docs, scores)
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key: str, similarity_df: pd.DataFrame):
+        #Stored as arrays, so the DataFrames returned by get can be changed (e.g. sorted in place) by the caller
+        docs = similarity_df.index.to_numpy().astype(np.int64)
+        scores = similarity_df['Similarity'].to_numpy(dtype=np.float64, copy=True)
+        with self.lock:
+            self.add_to_memory(key, docs, scores)
+            if self.disk is not None:
+                self.disk_clock += 1
+                self.disk.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, docs.tobytes(), scores.tobytes(), self.disk_clock))
+                self.disk_entries += 1
+                if self.disk_entries > self.disk_max_entries:
+                    self.disk_entries = self.disk.execute('SELECT COUNT(*) FROM results').fetchone()[0] #Replaced keys were counted as new
+                    evicted = max(self.disk_entries - self.disk_max_entries, 0)
+                    self.disk.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (evicted,))
+                    self.disk_entries -= evicted
+                    self.stats['evictions'] += evicted
+
+    def add_to_memory(self, key: str, docs: np.ndarray, scores: np.ndarray):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = (docs, scores)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def to_dataframe(self, docs: np.ndarray, scores: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(scores.copy(), index=docs.astype(str), columns=['Similarity'])
+
+    def close(self):
+        #The disk tier is only committed here, losing the entries of a run that didn't finish is harmless
+        with self.lock:
+            if self.disk is not None:
+                self.disk.commit()
+                self.disk.close()
+                self.disk = None
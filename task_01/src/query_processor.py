@@ -1,6 +1,7 @@
-import xml.etree.ElementTree as ET
 import logging
 import time
+import xml_records
+from instrumentation import Instrumentation
 
 logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
 logger_extra_dict = {'className': 'QueryProcessor'}
@@ -14,6 +15,7 @@ class QueryProcessor:
         self.config = self.read_config_file(SRC_FOLDER_PATH + 'config/PC.CFG')
         self.data_folder_path = SRC_FOLDER_PATH + 'data/'
         self.result_folder_path = SRC_FOLDER_PATH + 'result/'
+        self.instrumentation = Instrumentation('QueryProcessor', SRC_FOLDER_PATH)
 
     def read_config_file(self, path: str):
         logger.info('Reading config file...', extra=logger_extra_dict)
@@ -46,32 +48,42 @@ class QueryProcessor:
         return config
     
     def read_input_file(self):
+        #Single pass over the queries file: query number (as written in the processed queries file) -> clean
+        #upper case text, and (query number, document number, votes) of every document judged for each query
         filepath = self.data_folder_path + self.config['read']
+        query_dict = {}
+        expected_results = []
         try:
-            tree = ET.parse(filepath)
+            with self.instrumentation.span('parse'):
+                for query_number, query_text, items in xml_records.iter_queries(filepath):
+                    query_dict[str(query_number)] = self.clean_query_text(query_text)
+                    for doc_number, score in items:
+                        expected_results.append((query_number, doc_number, self.calculate_score(score)))
         except FileNotFoundError:
             logger.error(f'Input file "{self.config["read"]}" not found. Exiting program.', extra=logger_extra_dict)
             exit(1)
         except Exception:
             logger.error(f'Error while reading input file. Please check file structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
-        return tree.getroot()
+        self.instrumentation.count_file_bytes('bytes_read', filepath)
+        return query_dict, expected_results
 
-    def write_processed_queries_to_file(self, root_tree: ET.Element):
+    def clean_query_text(self, query_text: str) -> str:
+        return ' '.join(query_text.strip().replace(';', '').split()).upper()
+
+    def write_processed_queries_to_file(self, query_dict: dict):
         logger.info(f'Writing processed queries to file: {self.config["query"]}', extra=logger_extra_dict)
         query_filepath = self.result_folder_path + self.config['query']
         try:
-            with open(query_filepath, 'w') as file:
+            with open(query_filepath, 'w') as file, self.instrumentation.span('write_queries'):
                 file.write("QueryNumber;QueryText\n")
 
-                for query in root_tree.findall('QUERY'):
-                    query_number = int(query.find('QueryNumber').text.strip())
-                    query_text = query.find('QueryText').text.strip().replace(';', '')
-                    clean_text = ' '.join(query_text.split())
-                    file.write(f'{query_number};{clean_text.upper()}\n')
+                for query_number, query_text in query_dict.items():
+                    file.write(f'{query_number};{query_text}\n')
         except Exception:
             logger.error(f'Couldn\'t write output processed queries file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
+        self.instrumentation.count_file_bytes('bytes_written', query_filepath)
         logger.info('Processed queries file generated successfully.', extra=logger_extra_dict)
     
     def calculate_score(self, score: str):
@@ -80,37 +92,39 @@ class QueryProcessor:
             return 0
         return int(score[0]) + int(score[1]) + int(score[2]) + int(score[3])
 
-    def write_expected_results_to_file(self, root_tree: ET.Element):
+    def write_expected_results_to_file(self, expected_results: list):
         logger.info(f'Calculating score and writing expected results to file: {self.config["expected"]}', extra=logger_extra_dict)
         expected_filepath = self.result_folder_path + self.config['expected']
 
         try:
-            with open(expected_filepath, 'w') as file:
+            with open(expected_filepath, 'w') as file, self.instrumentation.span('write_expected'):
                 file.write("QueryNumber;DocNumber;DocVotes\n")
 
-                for query in root_tree.findall('QUERY'):
-                    query_number = int(query.find('QueryNumber').text.strip())
-                    for item in query.findall('Records/Item'):
-                        doc_number = item.text
-                        doc_votes = self.calculate_score(item.get('score'))
-                        file.write(f'{query_number};{doc_number};{doc_votes}\n')
+                for query_number, doc_number, doc_votes in expected_results:
+                    file.write(f'{query_number};{doc_number};{doc_votes}\n')
         except Exception:
             logger.error(f'Couldn\'t write output expected results file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
+        self.instrumentation.count_file_bytes('bytes_written', expected_filepath)
         logger.info('Expected results file generated successfully.', extra=logger_extra_dict)
 
-    def run(self):
-        xml_input = self.read_input_file()
-        logger.info(f'Number of queries read: {len(xml_input.findall("QUERY"))}', extra=logger_extra_dict)
+    def run(self, write_output: bool = True):
+        #Returns the processed queries and the expected results, for the next stages
         start_time = time.time()
-        self.write_processed_queries_to_file(xml_input)
-        self.write_expected_results_to_file(xml_input)
+        query_dict, expected_results = self.read_input_file()
+        logger.info(f'Number of queries read: {len(query_dict)}', extra=logger_extra_dict)
+        self.instrumentation.count('queries', len(query_dict))
+        if write_output:
+            self.write_processed_queries_to_file(query_dict)
+            self.write_expected_results_to_file(expected_results)
         end_time = time.time()
         run_time = end_time - start_time
-        avg_time = run_time/len(xml_input.findall("QUERY"))
+        avg_time = run_time/len(query_dict)
         logger.info(f'Total processing time for all queries: {run_time: .2e}s', extra=logger_extra_dict)
         logger.info(f'Average processing time per query: {avg_time: .2e}s', extra=logger_extra_dict)
+        self.instrumentation.finish()
         logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+        return query_dict, expected_results
 
 if __name__ == '__main__':
     qp = QueryProcessor()
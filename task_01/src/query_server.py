@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from search_engine import SearchEngine
+
+logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
+logger_extra_dict = {'className': 'QueryServer'}
+logger = logging.getLogger(__name__)
+
+SRC_FOLDER_PATH = ''
+SEARCH_THREADS = 4 #Queries scored at the same time, the event loop keeps accepting connections meanwhile
+MAX_REQUEST_LINE = 8192
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+class QueryServer:
+    #Keeps the vector model loaded and answers queries over HTTP:
+    #   GET /search?q=<query text>&k=<number of results>
+    #   GET /health
+
+    def __init__(self) -> None:
+        logger.info('Starting execution...', extra=logger_extra_dict)
+        self.config = self.read_config_file(SRC_FOLDER_PATH + 'config/SERVIDOR.CFG')
+        self.search_engine = SearchEngine()
+        self.vector_model = None
+        self.shard_pool = None
+        if self.search_engine.config['shards'] > 1: #Each query is searched in all the shards at the same time
+            self.shard_pool = self.search_engine.read_shards()
+        else:
+            self.vector_model = self.search_engine.read_vector_model()
+            self.search_engine.check_scorer(self.vector_model)
+            self.search_engine.positional_index = self.search_engine.read_positional_index()
+        self.search_engine.open_cache(self.vector_model.version if self.shard_pool is None else self.shard_pool.version)
+        self.executor = ThreadPoolExecutor(SEARCH_THREADS)
+        self.server = None
+
+    def read_config_file(self, path: str):
+        logger.info('Reading config file...', extra=logger_extra_dict)
+        config = {
+            'host': '127.0.0.1',
+            'port': 8080,
+            'socket': None,
+            'top_k': 10
+        }
+
+        try:
+            with open(path, 'r') as file:
+                lines = file.readlines()
+
+                for line in lines:
+                    key, value = line.strip().split('=')
+                    if key == 'HOST':
+                        config['host'] = value
+                    elif key == 'PORTA':
+                        config['port'] = int(value)
+                    elif key == 'SOCKET':
+                        config['socket'] = value
+                    elif key == 'TOPK':
+                        config['top_k'] = int(value)
+        except FileNotFoundError:
+            logger.error(f'Config file "{path}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        except Exception:
+            logger.error(f'Error while reading config file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+
+        logger.info('Config file read successfully.', extra=logger_extra_dict)
+        return config
+
+    def search(self, query_text: str, top_k: int) -> dict:
+        start_time = time.perf_counter()
+        similarity_df = self.search_engine.search_cached({query_text: query_text}, top_k, lambda query_dict: self.search_queries(query_dict, top_k))[query_text]
+        similarity_df = similarity_df.sort_values(by='Similarity', ascending=False, kind='stable')
+        if top_k > 0:
+            similarity_df = similarity_df.head(top_k)
+        results = [{'rank': rank, 'doc': int(doc), 'similarity': float(similarity)} for rank, (doc, similarity) in enumerate(similarity_df['Similarity'].items(), start=1)]
+        return {'query': query_text, 'results': results, 'time': time.perf_counter() - start_time}
+
+    def search_queries(self, query_dict: dict, top_k: int) -> dict:
+        if self.shard_pool is not None:
+            return self.shard_pool.search(query_dict, top_k)
+        return {query_number: self.search_engine.search(self.vector_model, query_text, top_k) for query_number, query_text in query_dict.items()}
+
+    def health(self) -> dict:
+        if self.shard_pool is not None:
+            health = {'status': 'ok', 'terms': self.shard_pool.terms_count, 'documents': self.shard_pool.documents_count, 'shards': len(self.shard_pool.executors)}
+        else:
+            health = {'status': 'ok', 'terms': len(self.vector_model.terms), 'documents': len(self.vector_model.doc_numbers)}
+        if self.search_engine.cache is not None:
+            health['cache'] = dict(self.search_engine.cache.stats)
+        return health
+
+    async def handle_request(self, method: str, target: str):
+        url = urlsplit(target)
+        if method != 'GET':
+            return 405, {'error': 'Only GET is supported.'}
+        if url.path == '/health':
+            return 200, self.health()
+        if url.path != '/search':
+            return 404, {'error': f'Unknown path "{url.path}".'}
+
+        params = parse_qs(url.query)
+        if 'q' not in params:
+            return 400, {'error': 'Missing query parameter "q".'}
+        try:
+            top_k = int(params['k'][0]) if 'k' in params else self.config['top_k']
+        except ValueError:
+            return 400, {'error': 'Parameter "k" must be an integer.'}
+
+        #Normalized like the processed queries file written by the QueryProcessor
+        query_text = ' '.join(params['q'][0].replace(';', '').split()).upper()
+        loop = asyncio.get_running_loop()
+        return 200, await loop.run_in_executor(self.executor, self.search, query_text, top_k)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline())[:MAX_REQUEST_LINE].decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''): #Headers are not used
+                pass
+            if len(request_line) < 2:
+                status, body = 400, {'error': 'Malformed request line.'}
+            else:
+                status, body = await self.handle_request(request_line[0], request_line[1])
+        except Exception:
+            logger.exception('Error while answering request.', extra=logger_extra_dict)
+            status, body = 500, {'error': 'Internal error.'}
+
+        payload = json.dumps(body).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self):
+        if self.config['socket']:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=self.config['socket'])
+            logger.info(f'Listening on unix socket {self.config["socket"]}', extra=logger_extra_dict)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, self.config['host'], self.config['port'])
+            logger.info(f'Listening on http://{self.config["host"]}:{self.server.sockets[0].getsockname()[1]}', extra=logger_extra_dict)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown()
+        if self.shard_pool is not None:
+            self.shard_pool.close()
+        self.search_engine.close_cache()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            self.search_engine.close_cache()
+            self.search_engine.instrumentation.finish()
+            logger.info('Server stopped. Program exiting.', extra=logger_extra_dict)
+
+if __name__ == '__main__':
+    qs = QueryServer()
+    qs.run()
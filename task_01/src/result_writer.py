@@ -0,0 +1,116 @@
+from abc import ABC, abstractmethod
+import os
+import numpy as np
+import index_format
+
+WRITER_BUFFER_RESULTS = 65536 #Ranked documents kept in memory before being written
+
+class ResultWriter(ABC):
+    #Writes the ranking of each query as soon as it is computed, keeping only a bounded buffer in memory.
+    #The buffered rankings are formatted together, as arrays of query numbers, ranks, DocNumbers and scores.
+    name = None
+
+    def __init__(self, path: str, run_name: str) -> None:
+        self.path = path
+        self.run_name = run_name
+        self.buffer_query_numbers, self.buffer_docs, self.buffer_scores = [], [], []
+        self.buffered_results = 0
+        self.open()
+
+    @abstractmethod
+    def open(self):
+        pass
+
+    @abstractmethod
+    def write_batch(self, query_numbers: np.ndarray, ranks: np.ndarray, docs: np.ndarray, scores: np.ndarray):
+        pass
+
+    @abstractmethod
+    def finish(self):
+        pass
+
+    def write(self, query_number: str, docs: np.ndarray, scores: np.ndarray):
+        #docs and scores of one query, already in rank order
+        self.buffer_query_numbers.append(query_number)
+        self.buffer_docs.append(docs)
+        self.buffer_scores.append(scores)
+        self.buffered_results += len(docs)
+        if self.buffered_results >= WRITER_BUFFER_RESULTS:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer_query_numbers:
+            return
+        lengths = np.array([len(docs) for docs in self.buffer_docs], dtype=np.int64)
+        query_numbers = np.repeat(np.array(self.buffer_query_numbers, dtype=str), lengths)
+        ranks = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + 1
+        docs = np.concatenate(self.buffer_docs).astype(np.int64)
+        scores = np.concatenate(self.buffer_scores).astype(np.float64)
+        self.write_batch(query_numbers, ranks, docs, scores)
+        self.buffer_query_numbers, self.buffer_docs, self.buffer_scores = [], [], []
+        self.buffered_results = 0
+
+    def close(self):
+        self.flush()
+        self.finish()
+
+class TextResultWriter(ResultWriter):
+    header = ''
+
+    def open(self):
+        self.file = open(self.path, 'w')
+        self.file.write(self.header)
+
+    @abstractmethod
+    def format_lines(self, query_numbers: list, ranks: list, docs: list, scores: list) -> str:
+        pass
+
+    def write_batch(self, query_numbers, ranks, docs, scores):
+        self.file.write(self.format_lines(query_numbers.tolist(), ranks.tolist(), docs.tolist(), scores.tolist()))
+
+    def finish(self):
+        self.file.close()
+
+class LegacyResultWriter(TextResultWriter):
+    #QueryNumber;[rank, 'DocNumber', similarity], the layout of the baseline resultados.csv
+    name = 'LEGADO'
+    header = 'QueryNumber;DocsRankInfo\n'
+
+    def format_lines(self, query_numbers, ranks, docs, scores):
+        return ''.join(f"{query_number};[{rank}, '{doc}', {score!r}]\n" for query_number, rank, doc, score in zip(query_numbers, ranks, docs, scores))
+
+class CsvResultWriter(TextResultWriter):
+    name = 'CSV'
+    header = 'QueryNumber;Rank;DocNumber;Similarity\n'
+
+    def format_lines(self, query_numbers, ranks, docs, scores):
+        return ''.join(f'{query_number};{rank};{doc};{score!r}\n' for query_number, rank, doc, score in zip(query_numbers, ranks, docs, scores))
+
+class TrecResultWriter(TextResultWriter):
+    #TREC run format, read by trec_eval: query Q0 document rank score run
+    name = 'TREC'
+
+    def format_lines(self, query_numbers, ranks, docs, scores):
+        return ''.join(f'{query_number} Q0 {doc} {rank} {score!r} {self.run_name}\n' for query_number, rank, doc, score in zip(query_numbers, ranks, docs, scores))
+
+class BinaryResultWriter(ResultWriter):
+    #One section per column in the binary index format (see index_format.py), streamed to raw files first
+    name = 'BINARIO'
+    columns_dtypes = {'query_numbers': np.uint32, 'ranks': np.uint32, 'docs': np.uint32, 'scores': np.float64}
+
+    def open(self):
+        self.raw_files = {name: open(f'{self.path}.{name}.tmp', 'wb') for name in self.columns_dtypes}
+
+    def write_batch(self, query_numbers, ranks, docs, scores):
+        columns = {'query_numbers': query_numbers.astype(np.int64), 'ranks': ranks, 'docs': docs, 'scores': scores}
+        for name, dtype in self.columns_dtypes.items():
+            self.raw_files[name].write(columns[name].astype(dtype).tobytes())
+
+    def finish(self):
+        for raw_file in self.raw_files.values():
+            raw_file.close()
+        index_format.write_index_file(self.path, 'results', {name: (f'{self.path}.{name}.tmp', dtype) for name, dtype in self.columns_dtypes.items()}, {'run': self.run_name})
+        for name in self.columns_dtypes:
+            os.remove(f'{self.path}.{name}.tmp')
+
+RESULT_WRITERS = {writer.name: writer for writer in (LegacyResultWriter, CsvResultWriter, TrecResultWriter, BinaryResultWriter)}
@@ -0,0 +1,171 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import scipy.sparse as sp
+from numpy.linalg import norm
+
+IMPACT_BITS = 8 #Impact scores are quantized to unsigned integers of this size
+IMPACT_LEVELS = 2**IMPACT_BITS - 1
+
+def quantize_impacts(impacts: np.ndarray):
+    #Linear quantization with a single scale per scorer. Postings with a positive impact never round down to 0.
+    max_impact = impacts.max() if len(impacts) else 0.0
+    scale = max_impact/IMPACT_LEVELS if max_impact > 0 else 1.0
+    quantized = np.rint(impacts/scale)
+    quantized[(quantized == 0) & (impacts > 0)] = 1
+    return quantized.astype(np.uint8), float(scale)
+
+class Scorer(ABC):
+    #Ranking function of the SearchEngine. Each query term adds its query weight times the score of each of its
+    #postings to an accumulator per document, and document_scores turns the accumulators into the final scores.
+    name = None
+    prunable = True #MaxScore only applies when the final score grows with the accumulator, the same way for every document
+    accumulator_dtype = np.float64
+
+    def check_model(self, vector_model) -> bool:
+        return True
+
+    @abstractmethod
+    def query_weights(self, vector_model, query_term_ids: np.ndarray, query_term_counts: np.ndarray) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def term_postings(self, vector_model, term_id: int):
+        pass
+
+    @abstractmethod
+    def term_upper_bounds(self, vector_model, term_ids: np.ndarray) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def score_matrix(self, vector_model) -> sp.csr_matrix:
+        pass
+
+    def accumulate(self, ids: np.ndarray, scores: np.ndarray, size: int) -> np.ndarray:
+        #Adds up the scores of each accumulator id
+        return np.bincount(ids, weights=scores, minlength=size)
+
+    @abstractmethod
+    def document_scores(self, vector_model, docs: np.ndarray, accumulators: np.ndarray, query_weights: np.ndarray) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def matrix_scores(self, vector_model, queries_matrix: sp.csr_matrix) -> sp.csr_matrix:
+        #All queries at once: (queries x terms) @ (terms x documents), then the final scores of each nonzero entry
+        pass
+
+class CosineScorer(Scorer):
+    #tf-idf cosine over the normalized document vectors, the query weighted by the idf of its distinct terms
+    name = 'COSSENO'
+
+    def query_weights(self, vector_model, query_term_ids, query_term_counts):
+        return vector_model.idf[query_term_ids].astype(np.float64)
+
+    def term_postings(self, vector_model, term_id):
+        return vector_model.term_postings(term_id)
+
+    def term_upper_bounds(self, vector_model, term_ids):
+        return vector_model.term_upper_bounds[term_ids].astype(np.float64)
+
+    def score_matrix(self, vector_model):
+        return vector_model.normalized_weights
+
+    def document_scores(self, vector_model, docs, accumulators, query_weights):
+        return accumulators/norm(query_weights)
+
+    def matrix_scores(self, vector_model, queries_matrix):
+        queries_norm = sp.linalg.norm(queries_matrix, axis=1)
+        inverse_norms = np.divide(1.0, queries_norm, out=np.zeros_like(queries_norm), where=queries_norm > 0)
+        return (sp.diags(inverse_norms) @ queries_matrix @ vector_model.normalized_weights).tocsr()
+
+class ImpactScorer(Scorer):
+    #Query-independent part of the score precomputed per posting by the Indexer and quantized, so a query
+    #accumulates integers (query term count x impact) that are scaled back at the end
+    accumulator_dtype = np.int64
+
+    @abstractmethod
+    def calculate_impacts(self, tf: sp.csr_matrix, doc_lengths: np.ndarray, params: dict):
+        #Returns the impact of each nonzero of the term x document tf matrix and, if the scorer has one, a prior per document
+        pass
+
+    def index(self, vector_model, tf: sp.csr_matrix, doc_lengths: np.ndarray, params: dict):
+        impacts, doc_priors = self.calculate_impacts(tf, doc_lengths, params)
+        quantized_impacts, scale = quantize_impacts(impacts)
+        vector_model.add_impacts(self.name, quantized_impacts, scale, doc_priors)
+
+    def check_model(self, vector_model):
+        return self.name in vector_model.impacts
+
+    def query_weights(self, vector_model, query_term_ids, query_term_counts):
+        return query_term_counts.astype(np.int64)
+
+    def term_postings(self, vector_model, term_id):
+        #Widened, the uint8 impacts would wrap around when multiplied by the count of a repeated query term
+        docs, impacts = vector_model.term_impacts(self.name, term_id)
+        return docs, impacts.astype(np.int64)
+
+    def term_upper_bounds(self, vector_model, term_ids):
+        return vector_model.impact_upper_bounds(self.name)[term_ids].astype(np.int64)
+
+    def score_matrix(self, vector_model):
+        return vector_model.impact_matrix(self.name)
+
+    def accumulate(self, ids, scores, size):
+        #Integer sums, so the score of a document doesn't depend on the order its postings are added in
+        accumulators = np.zeros(size, dtype=np.int64)
+        np.add.at(accumulators, ids, scores)
+        return accumulators
+
+    def document_scores(self, vector_model, docs, accumulators, query_weights):
+        return accumulators*vector_model.impact_scales[self.name]
+
+    def matrix_scores(self, vector_model, queries_matrix):
+        #Integer queries x integer impacts, scaled once
+        return (sp.csr_matrix(queries_matrix, dtype=np.int64) @ vector_model.impact_matrix(self.name)).tocsr()*vector_model.impact_scales[self.name]
+
+class BM25Scorer(ImpactScorer):
+    name = 'BM25'
+
+    def idf(self, tf: sp.csr_matrix) -> np.ndarray:
+        doc_freq = np.diff(tf.indptr)
+        return np.log(1 + (tf.shape[1] - doc_freq + 0.5)/(doc_freq + 0.5))
+
+    def saturated_tf(self, tf: sp.csr_matrix, doc_lengths: np.ndarray, params: dict) -> np.ndarray:
+        k1, b = params['bm25_k1'], params['bm25_b']
+        length_norm = 1 - b + b*doc_lengths/doc_lengths.mean()
+        return tf.data*(k1 + 1)/(tf.data + k1*length_norm[tf.indices])
+
+    def calculate_impacts(self, tf, doc_lengths, params):
+        return np.repeat(self.idf(tf), np.diff(tf.indptr))*self.saturated_tf(tf, doc_lengths, params), None
+
+class BM25PlusScorer(BM25Scorer):
+    #BM25 with a lower bound (delta) on the contribution of a term present in the document, so long documents aren't over-penalized
+    name = 'BM25+'
+
+    def calculate_impacts(self, tf, doc_lengths, params):
+        return np.repeat(self.idf(tf), np.diff(tf.indptr))*(self.saturated_tf(tf, doc_lengths, params) + params['bm25_delta']), None
+
+class DirichletScorer(ImpactScorer):
+    #Query likelihood with Dirichlet smoothing: sum over the query terms in the document of log(1 + tf/(mu p(t|C))),
+    #plus |q| log(mu/(|d| + mu)) for every document, kept as a prior per document
+    name = 'DIRICHLET'
+    prunable = False
+
+    def calculate_impacts(self, tf, doc_lengths, params):
+        mu = params['dirichlet_mu']
+        collection_prob = np.asarray(tf.sum(axis=1)).ravel()/doc_lengths.sum()
+        impacts = np.log(1 + tf.data/(mu*np.repeat(collection_prob, np.diff(tf.indptr))))
+        return impacts, np.log(mu/(doc_lengths + mu))
+
+    def document_scores(self, vector_model, docs, accumulators, query_weights):
+        #The float32 priors are widened first, as in matrix_scores, a scalar times a float32 array would stay float32
+        return accumulators*vector_model.impact_scales[self.name] + query_weights.sum()*vector_model.doc_priors[self.name][docs].astype(np.float64)
+
+    def matrix_scores(self, vector_model, queries_matrix):
+        similarity_matrix = super().matrix_scores(vector_model, queries_matrix)
+        query_lengths = np.asarray(queries_matrix.sum(axis=1)).ravel()
+        query_rows = np.repeat(np.arange(similarity_matrix.shape[0]), np.diff(similarity_matrix.indptr))
+        similarity_matrix.data += query_lengths[query_rows]*vector_model.doc_priors[self.name][similarity_matrix.indices]
+        return similarity_matrix
+
+SCORERS = {scorer.name: scorer for scorer in (CosineScorer, BM25Scorer, BM25PlusScorer, DirichletScorer)}
+IMPACT_SCORERS = [name for name, scorer in SCORERS.items() if issubclass(scorer, ImpactScorer)]
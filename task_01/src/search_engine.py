@@ -1,24 +1,96 @@
 import pandas as pd
 import numpy as np
-from numpy.linalg import norm
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+import scipy.sparse as sp
+import json
 import logging
+import os
+import re
 import time
+from concurrent.futures import ProcessPoolExecutor
+from analyzer import Analyzer
+from instrumentation import Instrumentation
+from postings import PostingsReader
+from query_cache import QueryCache, DISK_MAX_ENTRIES
+from result_writer import ResultWriter, RESULT_WRITERS
+from segments import MANIFEST_FILENAME, SegmentedIndex
+import index_format
+import scoring
+from vector_model import VectorModel
 
 logging.basicConfig(format='[%(asctime)s][%(levelname)s - %(className)s] %(message)s', level=logging.INFO, datefmt='%d/%m/%Y - %H:%M:%S')
 logger_extra_dict = {'className': 'SearchEngine'}
 logger = logging.getLogger(__name__)
 SRC_FOLDER_PATH = ''
 
+#"WORDS" matches the exact phrase and "WORDS"~N the words within N positions of each other, in any order
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+POSITION_BITS = 32 #Phrase matches are keyed by document << POSITION_BITS | position of the phrase start
+SCORE_TOLERANCE = 1e-9 #Relative slack of the MaxScore cuts, sums of the same scores in another order may differ in the last bits
+SEARCH_CHUNK_QUERIES = 1000 #Queries searched before their results are written, which bounds the results held in memory
+
+shard_engine = None
+shard_model = None
+
+def init_shard_worker(path: str):
+    #Each worker process keeps one shard of the vector model loaded, with its own SearchEngine
+    global shard_engine, shard_model
+    logger.setLevel(logging.WARNING)
+    shard_engine = SearchEngine('SearchEngineShard')
+    shard_engine.positional_index = shard_engine.read_positional_index()
+    shard_model = VectorModel.load(path)
+
+def search_shard(query_dict: dict, top_k: int) -> dict:
+    #Runs in a worker process: ranks the documents of its shard, returning the DocNumbers and scores of each query
+    if shard_engine.config['batch']:
+        query_similarity_result_dict = shard_engine.calculate_batch_similarity(shard_model, query_dict, top_k)
+    else:
+        query_similarity_result_dict = {query_number: shard_engine.search(shard_model, query_text, top_k) for query_number, query_text in query_dict.items()}
+    return {query_number: (similarity_df.index.to_numpy().astype(np.int64), similarity_df['Similarity'].to_numpy()) for query_number, similarity_df in query_similarity_result_dict.items()}
+
+class ShardPool:
+    #One worker process per shard of the vector model. Queries are sent to every shard and the results of
+    #the shards are merged, so each shard could as well be searched on another machine.
+
+    def __init__(self, paths: list[str], version: str, terms_count: int, documents_count: int) -> None:
+        self.version = version
+        self.terms_count = terms_count
+        self.documents_count = documents_count
+        self.executors = [ProcessPoolExecutor(1, initializer=init_shard_worker, initargs=(path,)) for path in paths]
+        #Worker processes are started and load their shard up front, instead of on the first query
+        for future in [executor.submit(int) for executor in self.executors]:
+            future.result()
+
+    def search(self, query_dict: dict, top_k: int) -> dict:
+        futures = [executor.submit(search_shard, query_dict, top_k) for executor in self.executors]
+        shards_results = [future.result() for future in futures]
+        return {query_number: self.merge_results([shard_results[query_number] for shard_results in shards_results], top_k) for query_number in query_dict}
+
+    def merge_results(self, shards_results: list, top_k: int) -> pd.DataFrame:
+        #Same order as a single model: by decreasing score, ties by DocNumber
+        docs = np.concatenate([docs for docs, _ in shards_results])
+        scores = np.concatenate([scores for _, scores in shards_results])
+        order = np.lexsort((docs, -scores))
+        if top_k > 0:
+            order = order[:top_k]
+        return pd.DataFrame(scores[order], index=docs[order].astype(str), columns=['Similarity'])
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
 class SearchEngine:
 
-    def __init__(self) -> None:
+    def __init__(self, stage: str = 'SearchEngine') -> None:
         logger.info('Starting execution...', extra=logger_extra_dict)
         self.config = self.read_config_file(SRC_FOLDER_PATH + 'config/BUSCA.CFG')
         self.data_folder_path = SRC_FOLDER_PATH + 'data/'
         self.result_folder_path = SRC_FOLDER_PATH + 'result/'
-        self.stop_words = set(s.upper() for s in stopwords.words('english')).union(".", ",", ";", "!", "?", ";", "=", "<", "+", "``", "%", "[", "]", "(", ")", '"', "'", ":", "-", "")
+        self.analyzer = Analyzer()
+        self.scorer = scoring.SCORERS[self.config['scorer']]()
+        self.instrumentation = Instrumentation(stage, SRC_FOLDER_PATH)
+        self.positional_index = None
+        self.positions_warning_logged = False
+        self.cache = None
         
 
     def read_config_file(self, path: str):
@@ -26,7 +98,16 @@ class SearchEngine:
         config = {
             'model': None,
             'query': None,
-            'results': None
+            'results': None,
+            'top_k': 0,
+            'batch': False,
+            'positions': None,
+            'scorer': scoring.CosineScorer.name,
+            'shards': 1,
+            'cache': 0,
+            'cache_disk': None,
+            'cache_disk_max': DISK_MAX_ENTRIES,
+            'results_format': 'LEGADO'
         }
 
         try:
@@ -41,6 +122,24 @@ class SearchEngine:
                         config['query'] = value
                     elif key == 'RESULTADOS':
                         config['results'] = value
+                    elif key == 'TOPK':
+                        config['top_k'] = int(value)
+                    elif key == 'LOTE':
+                        config['batch'] = value.upper() in ('S', 'Y')
+                    elif key == 'POSICOES':
+                        config['positions'] = value
+                    elif key == 'PONTUACAO':
+                        config['scorer'] = value.upper()
+                    elif key == 'FRAGMENTOS':
+                        config['shards'] = int(value)
+                    elif key == 'CACHE':
+                        config['cache'] = int(value)
+                    elif key == 'CACHE_DISCO':
+                        config['cache_disk'] = value
+                    elif key == 'CACHE_DISCO_MAX':
+                        config['cache_disk_max'] = int(value)
+                    elif key == 'FORMATO':
+                        config['results_format'] = value.upper()
         except FileNotFoundError:
             logger.error(f'Config file "{path}" not found. Exiting program.', extra=logger_extra_dict)
             exit(1)
@@ -48,14 +147,31 @@ class SearchEngine:
             logger.error(f'Error while reading config file. Please check file structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
 
+        if config['results_format'] not in RESULT_WRITERS:
+            logger.error(f'Unknown results format "{config["results_format"]}" in FORMATO. Available: {", ".join(RESULT_WRITERS)}. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        if config['scorer'] not in scoring.SCORERS:
+            logger.error(f'Unknown scorer "{config["scorer"]}" in PONTUACAO. Available: {", ".join(scoring.SCORERS)}. Exiting program.', extra=logger_extra_dict)
+            exit(1)
         logger.info('Config file read successfully.', extra=logger_extra_dict)
         return config
 
-    def read_vector_model(self) -> pd.DataFrame:
+    def check_scorer(self, vector_model: VectorModel):
+        #Impact scores are computed by the Indexer, only for the scorers listed in its config file
+        if not self.scorer.check_model(vector_model):
+            logger.error(f'The vector model has no impact scores for {self.scorer.name}. Please add PONTUACAO={self.scorer.name} to INDEX.CFG and run the Indexer again. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        logger.info(f'Ranking documents with the {self.scorer.name} scorer.', extra=logger_extra_dict)
+
+    def read_vector_model(self) -> VectorModel:
         logger.info(f'Reading vector model file: {self.config["model"]}', extra=logger_extra_dict)
         filepath = self.result_folder_path + self.config['model']
         try:
-            vector_model = pd.read_csv(filepath, sep=';', index_col=0)
+            with self.instrumentation.span('read_model'):
+                if filepath.endswith('.csv'):
+                    vector_model = VectorModel.from_dataframe(pd.read_csv(filepath, sep=';', index_col=0))
+                else:
+                    vector_model = VectorModel.load(filepath)
         except FileNotFoundError:
             logger.error(f'Input file "{self.config["model"]}" not found. Exiting program.', extra=logger_extra_dict)
             exit(1)
@@ -63,9 +179,73 @@ class SearchEngine:
             logger.error(f'Error while reading vector model input file. Please check file structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
 
+        self.instrumentation.count_file_bytes('bytes_read', filepath)
         logger.info('Vector model read successfully.', extra=logger_extra_dict)
         return vector_model
+
+    def read_shards(self) -> ShardPool:
+        #The shards written by the Indexer with FRAGMENTOS, <name>_<shard>.idx, each one loaded by its own worker process
+        shards = self.config['shards']
+        filepaths = [VectorModel.shard_path(self.result_folder_path + self.config['model'], shard) for shard in range(shards)]
+        logger.info(f'Reading {shards} vector model shards: {", ".join(VectorModel.shard_path(self.config["model"], shard) for shard in range(shards))}', extra=logger_extra_dict)
+        try:
+            with self.instrumentation.span('read_model'):
+                shard_files = [index_format.IndexFile(filepath) for filepath in filepaths]
+                #The shards share the terms and the impact scores, so the first one is enough to check the scorer
+                first_shard = VectorModel.load(filepaths[0])
+        except FileNotFoundError:
+            logger.error(f'Vector model shard not found. Please set FRAGMENTOS={shards} in INDEX.CFG and run the Indexer again. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        except Exception:
+            logger.error(f'Error while reading vector model shards. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        for shard, shard_file in enumerate(shard_files):
+            if shard_file.meta.get('shard') != shard or shard_file.meta.get('shards') != shards:
+                logger.error(f'"{filepaths[shard]}" is not shard {shard} of {shards}. Please set FRAGMENTOS={shards} in INDEX.CFG and run the Indexer again. Exiting program.', extra=logger_extra_dict)
+                exit(1)
+            self.instrumentation.count_file_bytes('bytes_read', filepaths[shard])
+        if len({shard_file.meta.get('version') for shard_file in shard_files}) > 1:
+            logger.error(f'The vector model shards come from different runs of the Indexer. Please run the Indexer again. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        self.check_scorer(first_shard)
+
+        try:
+            with self.instrumentation.span('start_shards'):
+                shard_pool = ShardPool(filepaths, first_shard.version, len(first_shard.terms), sum(len(shard_file.section('doc_numbers')) for shard_file in shard_files))
+        except Exception:
+            logger.error(f'Error while starting the shard worker processes. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        logger.info('Vector model shards read successfully.', extra=logger_extra_dict)
+        return shard_pool
     
+    def read_positional_index(self) -> PostingsReader:
+        #The postings with positions are only needed by phrase and proximity queries, so they are optional.
+        #POSICOES may also be the folder of a segmented index, whose live postings are looked up in each segment.
+        if not self.config['positions']:
+            return None
+        logger.info(f'Reading positional index file: {self.config["positions"]}', extra=logger_extra_dict)
+        filepath = self.result_folder_path + self.config['positions']
+        try:
+            with self.instrumentation.span('read_positions'):
+                if os.path.isdir(filepath):
+                    if not os.path.exists(os.path.join(filepath, MANIFEST_FILENAME)):
+                        raise FileNotFoundError(filepath)
+                    positional_index = SegmentedIndex(filepath)
+                else:
+                    positional_index = PostingsReader(filepath)
+        except FileNotFoundError:
+            logger.error(f'Input file "{self.config["positions"]}" not found. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        except Exception:
+            logger.error(f'Error while reading positional index input file. Please check file structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        if not positional_index.has_positions:
+            logger.error(f'Input file "{self.config["positions"]}" has no positions. Please run the ReverseListGenerator again. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+
+        logger.info('Positional index read successfully.', extra=logger_extra_dict)
+        return positional_index
+
     def read_queries_file(self) -> dict:
         logger.info(f'Reading processed queries file: {self.config["query"]}', extra=logger_extra_dict)
         filepath = self.result_folder_path + self.config['query']
@@ -89,62 +269,365 @@ class SearchEngine:
         return query_dict
 
     def tokenize_query_text(self, text: str):
-        text = text.replace('/', ' ')
-        tokens = word_tokenize(text)
-        filtered_tokens = [word for word in tokens if (word not in self.stop_words and not word.isdigit())]
-        return filtered_tokens
+        #Repeated query strings are answered from the analyzer cache
+        return list(self.analyzer.analyze_query(text))
+
+    def parse_query_operators(self, query_text: str):
+        #Quoted phrases of two or more terms become operators, each one a list of (term, position) and the
+        #proximity distance (None for an exact phrase). All the words are still scored by the vector model.
+        operators = []
+        for match in PHRASE_PATTERN.finditer(query_text):
+            phrase_terms = self.analyzer.analyze_query_positions(match.group(1))
+            if len(phrase_terms) > 1:
+                operators.append((phrase_terms, int(match.group(2)) if match.group(2) else None))
+        return PHRASE_PATTERN.sub(lambda match: f'"{match.group(1)}"', query_text), operators
+
+    def match_phrase(self, phrase_terms: tuple) -> np.ndarray:
+        #Each occurrence is keyed by its document and the position the phrase would start at.
+        #A document matches when the keys of all the terms intersect.
+        first_position = phrase_terms[0][1]
+        matches = None
+        for term, position in phrase_terms:
+            docs, tfs, positions = self.positional_index.lookup(term)
+            starts = positions - (position - first_position)
+            keys = (np.repeat(docs, tfs) << POSITION_BITS | starts)[starts >= 0]
+            matches = keys if matches is None else np.intersect1d(matches, keys, assume_unique=True)
+            if len(matches) == 0:
+                break
+        return np.unique(matches >> POSITION_BITS)
+
+    def minimum_window(self, positions: list, term_ids: list, terms_count: int) -> int:
+        #Smallest distance between the first and last positions of a window holding all the terms
+        term_counts = [0]*terms_count
+        covered, start, best = 0, 0, np.inf
+        for end, term_id in enumerate(term_ids):
+            covered += term_counts[term_id] == 0
+            term_counts[term_id] += 1
+            while covered == terms_count:
+                best = min(best, positions[end] - positions[start])
+                term_counts[term_ids[start]] -= 1
+                covered -= term_counts[term_ids[start]] == 0
+                start += 1
+        return best
+
+    def match_proximity(self, phrase_terms: tuple, distance: int) -> np.ndarray:
+        #Only documents holding all the terms are scanned, with the positions of every term merged in order
+        terms = list(dict.fromkeys(term for term, _ in phrase_terms))
+        terms_postings = [self.positional_index.lookup(term) for term in terms]
+        candidate_docs = terms_postings[0][0]
+        for docs, _, _ in terms_postings[1:]:
+            candidate_docs = np.intersect1d(candidate_docs, docs, assume_unique=True)
+        if len(candidate_docs) == 0:
+            return candidate_docs
+
+        occurrence_docs, occurrence_positions, occurrence_terms = [], [], []
+        for term_id, (docs, tfs, positions) in enumerate(terms_postings):
+            docs = np.repeat(docs, tfs)
+            in_candidates = np.isin(docs, candidate_docs)
+            occurrence_docs.append(docs[in_candidates])
+            occurrence_positions.append(positions[in_candidates])
+            occurrence_terms.append(np.full(in_candidates.sum(), term_id))
+        occurrence_docs, occurrence_positions, occurrence_terms = np.concatenate(occurrence_docs), np.concatenate(occurrence_positions), np.concatenate(occurrence_terms)
+        order = np.lexsort((occurrence_positions, occurrence_docs))
+        splits = np.flatnonzero(np.diff(occurrence_docs[order])) + 1
+
+        matches = [doc for doc, positions, term_ids in zip(candidate_docs, np.split(occurrence_positions[order], splits), np.split(occurrence_terms[order], splits))
+                   if self.minimum_window(positions.tolist(), term_ids.tolist(), len(terms)) <= distance]
+        return np.array(matches, dtype=np.int64)
+
+    def match_operators(self, vector_model: VectorModel, operators: list) -> np.ndarray:
+        #Columns of the model of the documents that satisfy every operator, or None when there is nothing to filter
+        if not operators:
+            return None
+        if self.positional_index is None:
+            if not self.positions_warning_logged:
+                logger.warning('Phrase and proximity operators are ignored, POSICOES is not set in the config file.', extra=logger_extra_dict)
+                self.positions_warning_logged = True
+            return None
+
+        allowed_doc_numbers = None
+        for phrase_terms, distance in operators:
+            doc_numbers = self.match_phrase(phrase_terms) if distance is None else self.match_proximity(phrase_terms, distance)
+            allowed_doc_numbers = doc_numbers if allowed_doc_numbers is None else np.intersect1d(allowed_doc_numbers, doc_numbers, assume_unique=True)
+        self.instrumentation.count('operators', len(operators))
+
+        return np.flatnonzero(np.isin(vector_model.doc_numbers, allowed_doc_numbers))
     
-    def calculate_query_tf_idf(self, vector_model_df: pd.DataFrame, query_tokens: list[str]):
-        query_idf = vector_model_df['idf'].where(vector_model_df.index.isin(query_tokens), 0)
-        return query_idf
+    def calculate_query_weights(self, vector_model: VectorModel, query_tokens: list[str]):
+        #Sparse query vector: the query terms found in the model, weighted by the scorer
+        query_term_ids, query_term_counts = np.unique(np.array([vector_model.term_ids[token] for token in query_tokens if token in vector_model.term_ids], dtype=np.int64), return_counts=True)
+        return query_term_ids, self.scorer.query_weights(vector_model, query_term_ids, query_term_counts)
     
-    def calculate_query_similarity(self, vector_model_df: pd.DataFrame, query_tf_idf: pd.Series) -> pd.DataFrame:
-        docs_tf_idf_vectors = vector_model_df.values.T
-        cosine_similarity = np.dot(docs_tf_idf_vectors, query_tf_idf)/(norm(docs_tf_idf_vectors, axis=1)*norm(query_tf_idf))
-        similarity_df = pd.DataFrame(cosine_similarity, index=vector_model_df.columns, columns=['Similarity'])
-        similarity_df.drop(similarity_df[similarity_df['Similarity'] == 0].index, inplace=True)
-        similarity_df.drop('idf')
-        return similarity_df
-
-    def write_output_to_file(self, queries_similarity_df_list: dict):
-        logger.info(f'Writing results to file: {self.config["results"]}', extra=logger_extra_dict)
-        filepath = self.result_folder_path + self.config['results']
-        
+    def restrict_postings(self, docs: np.ndarray, values: np.ndarray, allowed_docs: np.ndarray):
+        if allowed_docs is None:
+            return docs, values
+        in_allowed = np.isin(docs, allowed_docs, assume_unique=True)
+        return docs[in_allowed], values[in_allowed]
+
+    def calculate_query_similarity(self, vector_model: VectorModel, query_weights, allowed_docs: np.ndarray = None) -> pd.DataFrame:
+        #Term-at-a-time evaluation: only the postings of the query terms are visited
+        query_term_ids, query_term_weights = query_weights
+        postings_docs, postings_scores = [], []
+        for term_id, query_weight in zip(query_term_ids, query_term_weights):
+            docs, scores = self.restrict_postings(*self.scorer.term_postings(vector_model, term_id), allowed_docs)
+            postings_docs.append(docs)
+            postings_scores.append(scores*query_weight)
+
+        if not postings_docs or not np.any(query_term_weights):
+            return pd.DataFrame(columns=['Similarity'], dtype=float)
+
+        candidate_docs, candidate_ids = np.unique(np.concatenate(postings_docs), return_inverse=True)
+        accumulators = self.scorer.accumulate(candidate_ids, np.concatenate(postings_scores), len(candidate_docs))
+        matched = accumulators > 0
+        candidate_docs, accumulators = candidate_docs[matched], accumulators[matched]
+        similarity = self.scorer.document_scores(vector_model, candidate_docs, accumulators, query_term_weights)
+        return pd.DataFrame(similarity, index=vector_model.doc_numbers[candidate_docs].astype(str), columns=['Similarity'])
+
+    def calculate_top_k_similarity(self, vector_model: VectorModel, query_weights, k: int, allowed_docs: np.ndarray = None) -> pd.DataFrame:
+        #MaxScore: terms are processed by decreasing upper bound. Once the bounds of the remaining terms add up to
+        #less than the current k-th score, documents not seen yet can't reach the top k, so only the current
+        #candidates are updated, and candidates that can't reach the k-th score anymore are dropped.
+        query_term_ids, query_term_weights = query_weights
+        if len(query_term_ids) == 0 or not np.any(query_term_weights):
+            return pd.DataFrame(columns=['Similarity'], dtype=float)
+        if not self.scorer.prunable:
+            similarity_df = self.calculate_query_similarity(vector_model, query_weights, allowed_docs)
+            return similarity_df.sort_values(by='Similarity', ascending=False, kind='stable').head(k)
+
+        terms_bound = query_term_weights*self.scorer.term_upper_bounds(vector_model, query_term_ids)
+        terms_order = np.argsort(-terms_bound, kind='stable')
+        remaining_bound = np.cumsum(terms_bound[terms_order][::-1])[::-1] #Bound of the terms not processed yet, including the current one
+
+        candidate_docs = np.zeros(0, dtype=np.int64)
+        candidate_scores = np.zeros(0, dtype=self.scorer.accumulator_dtype)
+        threshold = tolerance = 0.0
+        terms_postings = {}
+        for position, term_index in enumerate(terms_order):
+            docs, scores = self.restrict_postings(*self.scorer.term_postings(vector_model, query_term_ids[term_index]), allowed_docs)
+            scores = scores*query_term_weights[term_index]
+
+            if len(candidate_docs) >= k and remaining_bound[position] < threshold - tolerance:
+                keep = candidate_scores + remaining_bound[position] >= threshold - tolerance
+                candidate_docs, candidate_scores = candidate_docs[keep], candidate_scores[keep]
+                in_candidates = np.isin(docs, candidate_docs, assume_unique=True)
+                docs, scores = docs[in_candidates], scores[in_candidates]
+            terms_postings[term_index] = (docs, scores)
+
+            all_docs = np.concatenate((candidate_docs, docs))
+            candidate_docs, ids = np.unique(all_docs, return_inverse=True)
+            candidate_scores = self.scorer.accumulate(ids, np.concatenate((candidate_scores, scores)), len(candidate_docs))
+            if len(candidate_scores) >= k:
+                threshold = np.partition(candidate_scores, len(candidate_scores) - k)[len(candidate_scores) - k]
+                tolerance = threshold*SCORE_TOLERANCE
+
+        #The scores above were added up in the order of the bounds. The documents that may still be in the top k,
+        #ties included, are scored again adding up the terms in the same order as calculate_query_similarity, and
+        #ties are broken by DocNumber before the cut, so the top k is the head of the full ranking.
+        if len(candidate_scores) >= k:
+            candidate_docs = candidate_docs[candidate_scores >= threshold - tolerance]
+        postings_docs, postings_scores = zip(*(self.restrict_postings(*terms_postings[term_index], candidate_docs) for term_index in range(len(query_term_ids))))
+        candidate_ids = np.searchsorted(candidate_docs, np.concatenate(postings_docs))
+        accumulators = self.scorer.accumulate(candidate_ids, np.concatenate(postings_scores), len(candidate_docs))
+        matched = accumulators > 0
+        candidate_docs, accumulators = candidate_docs[matched], accumulators[matched]
+        similarity = self.scorer.document_scores(vector_model, candidate_docs, accumulators, query_term_weights)
+        top_k = np.lexsort((candidate_docs, -similarity))[:k] #candidate_docs are sorted like the DocNumbers
+        return pd.DataFrame(similarity[top_k], index=vector_model.doc_numbers[candidate_docs[top_k]].astype(str), columns=['Similarity'])
+
+    def calculate_batch_similarity(self, vector_model: VectorModel, query_dict: dict, k: int) -> dict:
+        #All queries are scored at once: (queries x terms) @ (terms x documents), see Scorer.matrix_scores
+        rows, cols, weights = [], [], []
+        rows_allowed_docs = {}
+        with self.instrumentation.span('tokenize'):
+            for row, query_text in enumerate(query_dict.values()):
+                query_text, operators = self.parse_query_operators(query_text)
+                query_term_ids, query_term_weights = self.calculate_query_weights(vector_model, self.tokenize_query_text(query_text))
+                rows.append(np.full(len(query_term_ids), row))
+                cols.append(query_term_ids)
+                weights.append(query_term_weights)
+                if operators:
+                    with self.instrumentation.span('positions'):
+                        rows_allowed_docs[row] = self.match_operators(vector_model, operators)
+        rows, cols, weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+        self.instrumentation.count('queries', len(query_dict))
+        self.instrumentation.count('query_terms', len(cols))
+
+        with self.instrumentation.span('scoring'):
+            queries_matrix = sp.csr_matrix((weights, (rows, cols)), shape=(len(query_dict), len(vector_model.terms)))
+            similarity_matrix = self.scorer.matrix_scores(vector_model, queries_matrix)
+            for row, allowed_docs in rows_allowed_docs.items():
+                if allowed_docs is not None:
+                    start, end = similarity_matrix.indptr[row], similarity_matrix.indptr[row + 1]
+                    similarity_matrix.data[start:end][~np.isin(similarity_matrix.indices[start:end], allowed_docs)] = 0
+            similarity_matrix.eliminate_zeros()
+
+        #Ranks every (query, document) pair inside its query and keeps the k best ones of each query
+        with self.instrumentation.span('sort'):
+            query_rows = np.repeat(np.arange(len(query_dict)), np.diff(similarity_matrix.indptr))
+            order = np.lexsort((similarity_matrix.indices, -similarity_matrix.data, query_rows))
+            ranks = np.arange(len(order)) - similarity_matrix.indptr[query_rows[order]]
+            if k > 0:
+                order = order[ranks < k]
+        docs, scores = similarity_matrix.indices[order], similarity_matrix.data[order]
+        splits = np.cumsum(np.bincount(query_rows[order], minlength=len(query_dict)))[:-1]
+
+        query_similarity_result_dict = {}
+        for query_number, query_docs, query_scores in zip(query_dict.keys(), np.split(docs, splits), np.split(scores, splits)):
+            query_similarity_result_dict[query_number] = pd.DataFrame(query_scores, index=vector_model.doc_numbers[query_docs].astype(str), columns=['Similarity'])
+        return query_similarity_result_dict
+
+    def search(self, vector_model: VectorModel, query_text: str, top_k: int) -> pd.DataFrame:
+        with self.instrumentation.span('tokenize'):
+            query_text, operators = self.parse_query_operators(query_text)
+            query_tokens = self.tokenize_query_text(query_text)
+            query_weights = self.calculate_query_weights(vector_model, query_tokens)
+        allowed_docs = None
+        if operators:
+            with self.instrumentation.span('positions'):
+                allowed_docs = self.match_operators(vector_model, operators)
+        self.instrumentation.count('queries')
+        self.instrumentation.count('query_terms', len(query_weights[0]))
+        with self.instrumentation.span('scoring'):
+            if top_k > 0:
+                return self.calculate_top_k_similarity(vector_model, query_weights, top_k, allowed_docs)
+            return self.calculate_query_similarity(vector_model, query_weights, allowed_docs)
+
+    def search_queries(self, query_dict: dict, top_k: int, vector_model: VectorModel = None, shard_pool: ShardPool = None) -> dict:
+        if shard_pool is not None:
+            self.instrumentation.count('queries', len(query_dict))
+            with self.instrumentation.span('scoring'):
+                return shard_pool.search(query_dict, top_k)
+        if self.config['batch']:
+            return self.calculate_batch_similarity(vector_model, query_dict, top_k)
+        return {query_number: self.search(vector_model, query_text, top_k) for query_number, query_text in query_dict.items()}
+
+    def query_cache_key(self, query_text: str, top_k: int) -> str:
+        #Queries with the same tokens and operators have the same results, however they are written. Without a
+        #positional index the operators are ignored, so whether one is loaded is part of the key.
+        query_text, operators = self.parse_query_operators(query_text)
+        return json.dumps([self.scorer.name, top_k, self.has_positional_index(), self.tokenize_query_text(query_text), operators])
+
+    def has_positional_index(self) -> bool:
+        #Shard workers read the positional index themselves, from the same POSICOES
+        return self.positional_index is not None or (self.config['shards'] > 1 and bool(self.config['positions']))
+
+    def search_cached(self, query_dict: dict, top_k: int, search_queries) -> dict:
+        #Queries found in the cache are answered from it, the others by search_queries(dict of the missing queries)
+        if self.cache is None:
+            return search_queries(query_dict)
+        with self.instrumentation.span('cache'):
+            keys = {query_number: self.query_cache_key(query_text, top_k) for query_number, query_text in query_dict.items()}
+            cached_results = {query_number: self.cache.get(key) for query_number, key in keys.items()}
+        missing_queries = {query_number: query_dict[query_number] for query_number, similarity_df in cached_results.items() if similarity_df is None}
+        if not missing_queries:
+            return cached_results
+        query_similarity_result_dict = search_queries(missing_queries)
+        with self.instrumentation.span('cache'):
+            for query_number in missing_queries:
+                self.cache.put(keys[query_number], query_similarity_result_dict[query_number])
+        return {query_number: query_similarity_result_dict[query_number] if similarity_df is None else similarity_df for query_number, similarity_df in cached_results.items()}
+
+    def open_cache(self, index_version: str):
+        #Only the process answering the queries keeps a cache, not the shard workers.
+        #Cached results of another version of the index are dropped.
+        if self.config['cache'] <= 0 and not self.config['cache_disk']:
+            return
+        cache_disk_path = self.result_folder_path + self.config['cache_disk'] if self.config['cache_disk'] else None
+        try:
+            self.cache = QueryCache(self.config['cache'], cache_disk_path, self.config['cache_disk_max'])
+            self.cache.set_version(index_version)
+        except Exception:
+            logger.error(f'Couldn\'t open the query cache file "{self.config["cache_disk"]}". Exiting program.', extra=logger_extra_dict)
+            exit(1)
+
+    def close_cache(self):
+        if self.cache is not None:
+            for name, value in self.cache.stats.items():
+                self.instrumentation.count(f'cache_{name}', value)
+            logger.info(f'Query cache: {self.cache.stats["hits"]} hits, {self.cache.stats["disk_hits"]} disk hits, {self.cache.stats["misses"]} misses.', extra=logger_extra_dict)
+            self.cache.close()
+            self.cache = None
+
+    def open_result_writer(self) -> ResultWriter:
+        logger.info(f'Writing results to file: {self.config["results"]} ({self.config["results_format"]} format)', extra=logger_extra_dict)
+        try:
+            return RESULT_WRITERS[self.config['results_format']](self.result_folder_path + self.config['results'], self.scorer.name)
+        except Exception:
+            logger.error(f'Couldn\'t write output results file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+
+    def write_results(self, result_writer: ResultWriter, query_similarity_result_dict: dict) -> dict:
+        #Ranks the documents of each query and hands them to the writer, returning the rankings
+        ranked_result_dict = {}
+        try:
+            with self.instrumentation.span('write'):
+                for query_number, similarity_df in query_similarity_result_dict.items():
+                    with self.instrumentation.span('sort'):
+                        similarity_df = similarity_df.sort_values(by='Similarity', ascending=False, kind='stable')
+                    result_writer.write(query_number, similarity_df.index.to_numpy().astype(np.int64), similarity_df['Similarity'].to_numpy())
+                    self.instrumentation.count('results', len(similarity_df))
+                    ranked_result_dict[query_number] = similarity_df
+        except Exception:
+            logger.error(f'Couldn\'t write output results file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
+            exit(1)
+        return ranked_result_dict
+
+    def close_result_writer(self, result_writer: ResultWriter):
         try:
-            with open(filepath, 'w') as f:
-                f.write(f'QueryNumber;DocsRankInfo\n')
-                for query_number, similarity_df in queries_similarity_df_list.items():
-                    similarity_df.sort_values(by='Similarity', ascending=False, inplace=True)
-                    rank = 1
-                    for row in similarity_df.iterrows():
-                        l = [rank, row[0], row[1]['Similarity']]
-                        rank += 1
-                        f.write(f'{query_number};{str(l)}\n')
+            with self.instrumentation.span('write'):
+                result_writer.close()
         except Exception:
             logger.error(f'Couldn\'t write output results file. Please check folder structure. Exiting program.', extra=logger_extra_dict)
             exit(1)
+        self.instrumentation.count_file_bytes('bytes_written', result_writer.path)
         logger.info('Results file generated successfully.', extra=logger_extra_dict)
 
-    def run(self):
-        vector_model = self.read_vector_model()
-        query_dict = self.read_queries_file()
-        query_similarity_result_dict = {}
+    def run(self, vector_model: VectorModel = None, query_dict: dict = None, positional_index=None, keep_results: bool = True) -> dict:
+        #The model, the queries and the postings with positions may come from the previous stages,
+        #otherwise they are read from MODELO, CONSULTAS and POSICOES.
+        #The results are written as the queries are searched, and only returned with keep_results.
+        #With FRAGMENTOS, the shards are searched by worker processes, which read the postings with positions themselves.
+        #A model passed in memory is searched whole.
+        shard_pool = None
+        if vector_model is None and self.config['shards'] > 1:
+            shard_pool = self.read_shards()
+        else:
+            if vector_model is None:
+                vector_model = self.read_vector_model()
+            self.check_scorer(vector_model)
+        if query_dict is None:
+            query_dict = self.read_queries_file()
+        self.open_cache(vector_model.version if shard_pool is None else shard_pool.version)
+        if shard_pool is None:
+            if positional_index is not None and positional_index.has_positions:
+                self.positional_index = positional_index
+            else:
+                self.positional_index = self.read_positional_index()
         logger.info(f'Calculating document ranking for each query...', extra=logger_extra_dict)
-        start_time = time.time()
-        for query_number, query_text in query_dict.items():
-            query_tokens = self.tokenize_query_text(query_text)
-            query_tf_idf = self.calculate_query_tf_idf(vector_model, query_tokens)
-            query_similarity_df = self.calculate_query_similarity(vector_model, query_tf_idf)
-            query_similarity_result_dict[query_number] = query_similarity_df
-        end_time = time.time()
-        run_time = end_time - start_time
+        top_k = self.config['top_k']
+        result_writer = self.open_result_writer()
+        query_similarity_result_dict = {}
+        query_items = list(query_dict.items())
+        run_time = 0.0
+        for start in range(0, len(query_items), SEARCH_CHUNK_QUERIES):
+            start_time = time.time()
+            chunk_result_dict = self.search_cached(dict(query_items[start:start + SEARCH_CHUNK_QUERIES]), top_k, lambda query_dict: self.search_queries(query_dict, top_k, vector_model, shard_pool))
+            run_time += time.time() - start_time
+            chunk_result_dict = self.write_results(result_writer, chunk_result_dict)
+            if keep_results:
+                query_similarity_result_dict.update(chunk_result_dict)
+        if shard_pool is not None:
+            shard_pool.close()
+        self.close_cache()
         avg_time = run_time/len(query_dict)
         logger.info(f'Document ranking for each query calculated successfully.', extra=logger_extra_dict)
         logger.info(f'Total processing time for all queries: {run_time: .2e}s', extra=logger_extra_dict)
         logger.info(f'Average processing time per query: {avg_time: .2e}s', extra=logger_extra_dict)
-        self.write_output_to_file(query_similarity_result_dict)
+        self.close_result_writer(result_writer)
+        self.instrumentation.finish()
         logger.info('All processing done. Program exiting.', extra=logger_extra_dict)
+        return query_similarity_result_dict
 
 if __name__ == '__main__':
     se = SearchEngine()
-    se.run()
\ No newline at end of file
+    se.run(keep_results=False)
\ No newline at end of file
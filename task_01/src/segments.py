@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+import uuid
+import numpy as np
+from postings import Postings, PostingsReader, range_indices
+
+MANIFEST_FILENAME = 'manifest.json'
+MAX_SEGMENTS = 4 #Above this number of segments, they are merged in the background
+
+class SegmentedIndex:
+    #Inverted index split in immutable segments, each one written by an incremental run.
+    #The manifest keeps, for each segment, its documents with their length (number of tokens) and generation (the
+    #segment they were first written to), and the documents deleted from it (tombstones). For each input file, it
+    #keeps its signature and the documents it currently provides. So the live documents and their statistics are
+    #known without reading the segments, and the Indexer only reads the postings of documents it hasn't seen.
+
+    def __init__(self, folder_path: str) -> None:
+        self.folder_path = folder_path
+        os.makedirs(folder_path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.merge_thread = None
+        self.readers = {}
+        self.manifest = self.read_manifest()
+
+    def read_manifest(self) -> dict:
+        path = os.path.join(self.folder_path, MANIFEST_FILENAME)
+        if not os.path.exists(path):
+            #id tells apart the generations of an index rebuilt from scratch in the same folder
+            return {'id': uuid.uuid4().hex, 'version': 0, 'next_segment': 0, 'segments': [], 'files': {}, 'obsolete': []}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def write_manifest(self):
+        path = os.path.join(self.folder_path, MANIFEST_FILENAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(path + '.tmp', path) #Readers always see a complete manifest
+
+    @property
+    def id(self) -> str:
+        return self.manifest['id']
+
+    @property
+    def version(self) -> int:
+        return self.manifest['version']
+
+    @property
+    def segments_count(self) -> int:
+        return len(self.manifest['segments'])
+
+    def source_files(self) -> dict:
+        return {filename: info['signature'] for filename, info in self.manifest['files'].items()}
+
+    def segment_path(self, segment: dict) -> str:
+        return os.path.join(self.folder_path, segment['name'])
+
+    def add_segment(self, postings: Postings, files: dict):
+        #files maps each input file of the segment to its signature and the documents read from it
+        with self.lock:
+            new_docs = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + [np.asarray(info['docs'], dtype=np.int64) for info in files.values()]))
+            self.tombstone_documents(new_docs) #A document read again replaces its previous version
+
+            generation = self.manifest['next_segment']
+            name = f'segment_{generation:06d}.idx'
+            postings.write(os.path.join(self.folder_path, name))
+            docs = postings.doc_numbers()
+            lengths = np.bincount(np.searchsorted(docs, postings.docs), weights=postings.tfs, minlength=len(docs)).astype(np.int64)
+            self.manifest['next_segment'] += 1
+            self.manifest['segments'].append({'name': name, 'docs': docs.tolist(), 'lengths': lengths.tolist(), 'generations': [generation]*len(docs), 'deleted': []})
+            for filename, info in files.items():
+                self.manifest['files'][filename] = {'signature': info['signature'], 'docs': list(map(int, info['docs']))}
+            self.manifest['version'] += 1
+            self.write_manifest()
+
+    def delete_documents(self, doc_numbers):
+        with self.lock:
+            if self.tombstone_documents(np.asarray(doc_numbers, dtype=np.int64)):
+                self.manifest['version'] += 1
+                self.write_manifest()
+
+    def delete_source_file(self, filename: str):
+        with self.lock:
+            info = self.manifest['files'].pop(filename)
+            self.tombstone_documents(np.asarray(info['docs'], dtype=np.int64))
+            self.manifest['version'] += 1
+            self.write_manifest()
+
+    def tombstone_documents(self, doc_numbers: np.ndarray) -> int:
+        deleted_count = 0
+        for segment in self.manifest['segments']:
+            live_docs = np.setdiff1d(segment['docs'], segment['deleted'])
+            deleted = np.intersect1d(live_docs, doc_numbers)
+            if len(deleted):
+                segment['deleted'] = sorted(segment['deleted'] + deleted.tolist())
+                deleted_count += len(deleted)
+
+        removed = set(doc_numbers.tolist())
+        for info in self.manifest['files'].values():
+            info['docs'] = [doc for doc in info['docs'] if doc not in removed]
+        return deleted_count
+
+    def segment_documents(self, segment: dict):
+        #Documents of a segment with their generation and length, and a mask of the live ones
+        docs = np.asarray(segment['docs'], dtype=np.int64)
+        return docs, np.asarray(segment['generations'], dtype=np.int64), np.asarray(segment['lengths'], dtype=np.int64), ~np.isin(docs, segment['deleted'])
+
+    def live_documents(self):
+        #DocNumbers (ascending), generations and lengths of the live documents, from the manifest only
+        docs, generations, lengths = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for segment in self.manifest['segments']:
+            segment_docs, segment_generations, segment_lengths, live = self.segment_documents(segment)
+            docs.append(segment_docs[live])
+            generations.append(segment_generations[live])
+            lengths.append(segment_lengths[live])
+        docs, generations, lengths = np.concatenate(docs), np.concatenate(generations), np.concatenate(lengths)
+        order = np.argsort(docs)
+        return docs[order], generations[order], lengths[order]
+
+    def read_documents(self, doc_numbers: np.ndarray, read_positions: bool = True) -> Postings:
+        #Postings of the given live documents. Only the segments holding some of them are read.
+        postings_list = []
+        for segment in self.manifest['segments']:
+            segment_docs, _, _, live = self.segment_documents(segment)
+            unwanted = segment_docs[~(live & np.isin(segment_docs, doc_numbers))]
+            if len(unwanted) < len(segment_docs):
+                postings_list.append(Postings.read(self.segment_path(segment), read_positions).remove_documents(unwanted))
+        return Postings.concatenate(postings_list)
+
+    def live_postings(self) -> Postings:
+        with self.lock:
+            return Postings.concatenate([Postings.read(self.segment_path(segment)).remove_documents(segment['deleted']) for segment in self.manifest['segments']])
+
+    @property
+    def has_positions(self) -> bool:
+        return self.segments_count > 0 and all(self.segment_reader(segment).has_positions for segment in self.manifest['segments'])
+
+    def segment_reader(self, segment: dict) -> PostingsReader:
+        if segment['name'] not in self.readers:
+            self.readers[segment['name']] = PostingsReader(self.segment_path(segment))
+        return self.readers[segment['name']]
+
+    def lookup(self, term: str):
+        #Documents (ascending), tfs and positions of a term in the live documents of every segment, like
+        #PostingsReader.lookup, so the SearchEngine can read the positions straight from the segments
+        docs, tfs, positions = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for segment in self.manifest['segments']:
+            segment_docs, segment_tfs, segment_positions = self.segment_reader(segment).lookup(term)
+            live = ~np.isin(segment_docs, segment['deleted'])
+            docs.append(segment_docs[live])
+            tfs.append(segment_tfs[live])
+            positions.append(segment_positions[np.repeat(live, segment_tfs)])
+        docs, tfs, positions = np.concatenate(docs), np.concatenate(tfs), np.concatenate(positions)
+        order = np.argsort(docs)
+        return docs[order], tfs[order], positions[range_indices((np.cumsum(tfs) - tfs)[order], tfs[order])]
+
+    def merge_segments(self):
+        with self.lock:
+            merged_segments = [dict(segment, deleted=list(segment['deleted'])) for segment in self.manifest['segments']]
+        if len(merged_segments) < 2:
+            return
+
+        #The segments are read and merged without holding the lock, tombstones added meanwhile are carried over
+        merged_postings = Postings.concatenate([Postings.read(self.segment_path(segment)).remove_documents(segment['deleted']) for segment in merged_segments])
+        merged_documents = [self.segment_documents(segment) for segment in merged_segments]
+        docs, generations, lengths = (np.concatenate([documents[i][documents[3]] for documents in merged_documents]) for i in range(3))
+        order = np.argsort(docs)
+
+        with self.lock:
+            name = f'segment_{self.manifest["next_segment"]:06d}.idx'
+            merged_postings.write(os.path.join(self.folder_path, name))
+            self.manifest['next_segment'] += 1
+
+            previous_deleted = {segment['name']: set(segment['deleted']) for segment in merged_segments}
+            merged_names = set(previous_deleted.keys())
+            new_deleted = set()
+            for segment in self.manifest['segments']:
+                if segment['name'] in merged_names:
+                    new_deleted.update(set(segment['deleted']) - previous_deleted[segment['name']])
+            remaining_segments = [s for s in self.manifest['segments'] if s['name'] not in merged_names]
+            merged_segment = {'name': name, 'docs': docs[order].tolist(), 'lengths': lengths[order].tolist(), 'generations': generations[order].tolist(), 'deleted': sorted(new_deleted)}
+            self.manifest['segments'] = [merged_segment] + remaining_segments
+            #Readers of the previous manifest (e.g. the Indexer of the same pipeline) may still open the merged
+            #segments, so their files are only removed by the next update
+            self.manifest['obsolete'] += sorted(merged_names)
+            self.write_manifest()
+
+    def remove_obsolete_segments(self):
+        with self.lock:
+            removed = []
+            for name in self.manifest['obsolete']:
+                try:
+                    os.remove(os.path.join(self.folder_path, name))
+                    removed.append(name)
+                except FileNotFoundError:
+                    removed.append(name)
+                except OSError: #Still open by another process, removed next time
+                    pass
+            if removed:
+                self.manifest['obsolete'] = [name for name in self.manifest['obsolete'] if name not in removed]
+                self.write_manifest()
+
+    def start_background_merge(self):
+        #The merge thread keeps running while the next stages of the pipeline run. The process only waits for it
+        #when it exits.
+        if self.segments_count > MAX_SEGMENTS and (self.merge_thread is None or not self.merge_thread.is_alive()):
+            self.merge_thread = threading.Thread(target=self.merge_segments)
+            self.merge_thread.start()
+
+    def wait_background_merge(self):
+        if self.merge_thread is not None:
+            self.merge_thread.join()
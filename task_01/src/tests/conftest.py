@@ -0,0 +1,42 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+#The tests import the modules the way main.py does, and every stage reads its config and data from src/
+SRC_FOLDER_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/'
+sys.path.insert(0, SRC_FOLDER_PATH)
+
+@pytest.fixture(scope='session')
+def stages():
+    import benchmark
+    benchmark.set_stage_folder(SRC_FOLDER_PATH)
+    return SRC_FOLDER_PATH
+
+@pytest.fixture(scope='session')
+def cfc_postings(stages):
+    from inverted_index_generator import ReverseListGenerator
+    return ReverseListGenerator().build_postings()
+
+@pytest.fixture(scope='session')
+def cfc_vector_model(cfc_postings):
+    #Model of the CFC collection with the impacts of every scorer, tf not normalized
+    import scoring
+    from indexer import Indexer
+    indexer = Indexer()
+    indexer.config['scorers'] = list(scoring.IMPACT_SCORERS)
+    return indexer.create_term_doc_matrix(cfc_postings, False)
+
+@pytest.fixture(scope='session')
+def cfc_queries(stages):
+    from query_processor import QueryProcessor
+    query_dict, _ = QueryProcessor().read_input_file()
+    return query_dict
+
+def assert_same_ranking(similarity_df, expected_df, rtol: float = 0.0):
+    #Same documents in the same order (ties broken by DocNumber), scores equal up to rtol
+    assert similarity_df.index.tolist() == expected_df.index.tolist()
+    if rtol:
+        np.testing.assert_allclose(similarity_df['Similarity'].to_numpy(), expected_df['Similarity'].to_numpy(), rtol=rtol)
+    else:
+        np.testing.assert_array_equal(similarity_df['Similarity'].to_numpy(), expected_df['Similarity'].to_numpy())
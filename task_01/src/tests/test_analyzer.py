@@ -0,0 +1,32 @@
+import glob
+import random
+import pytest
+from nltk.tokenize import word_tokenize
+import xml_records
+from analyzer import Analyzer
+from conftest import SRC_FOLDER_PATH
+
+PUNCTUATION = ' .,;:!?\'"`()[]{}<>-/%$&@#*=+\n\t'
+
+@pytest.fixture(scope='module')
+def analyzer() -> Analyzer:
+    return Analyzer()
+
+def test_tokens_match_word_tokenize_on_cfc(analyzer):
+    #Documents are tokenized upper case, as analyze_document does, and queries as written in the queries file
+    texts = [text.upper() for filepath in sorted(glob.glob(SRC_FOLDER_PATH + 'data/cf7*.xml')) for _, text in xml_records.iter_documents(filepath)]
+    texts += [text for _, text, _ in xml_records.iter_queries(SRC_FOLDER_PATH + 'data/cfquery.xml')]
+    for text in texts:
+        assert analyzer.tokenize(text) == word_tokenize(text)
+
+def test_tokens_match_word_tokenize_on_punctuation(analyzer):
+    #Contractions, quotes and sentence ends next to other punctuation are where the Treebank rules interact
+    random_generator = random.Random(0)
+    words = ['CYSTIC', 'FIBROSIS', "CAN'T", 'CANNOT', 'GONNA', "O'NEIL", 'DR.', 'E.G.', 'U.S.', '1.5', '...', '--', "''", '``']
+    for _ in range(2000):
+        text = ''.join(random_generator.choice(words) if random_generator.random() < 0.5 else random_generator.choice(PUNCTUATION) for _ in range(random_generator.randint(1, 20)))
+        assert analyzer.tokenize(text) == word_tokenize(text), text
+
+def test_analyze_filters_stop_words_and_digits(analyzer):
+    assert analyzer.analyze_document('The effect of 2 drugs on cystic fibrosis.') == ['EFFECT', 'DRUGS', 'CYSTIC', 'FIBROSIS']
+    assert analyzer.analyze_document_positions('The effect of 2 drugs') == [('EFFECT', 1), ('DRUGS', 4)]
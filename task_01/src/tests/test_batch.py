@@ -0,0 +1,21 @@
+import pytest
+import scoring
+from conftest import assert_same_ranking
+from search_engine import SearchEngine
+
+#Impact scores are integer sums scaled once, so both modes give the same floats. The cosine adds the float32
+#weights in another order (sparse matrix product), its scores may differ by rounding (about 1e-7).
+TOLERANCES = {'COSSENO': 1e-6, 'BM25': 0.0, 'BM25+': 0.0, 'DIRICHLET': 0.0}
+
+@pytest.mark.parametrize('scorer_name', list(scoring.SCORERS))
+@pytest.mark.parametrize('k', [1, 10, 0])
+def test_batch_matches_per_query_search(stages, cfc_vector_model, cfc_queries, scorer_name, k):
+    engine = SearchEngine()
+    engine.scorer = scoring.SCORERS[scorer_name]()
+    batch_results = engine.calculate_batch_similarity(cfc_vector_model, cfc_queries, k)
+    assert list(batch_results.keys()) == list(cfc_queries.keys())
+    for query_number, query_text in cfc_queries.items():
+        expected_df = engine.search(cfc_vector_model, query_text, k)
+        if k == 0: #Without a cut, search leaves the ranking to write_results
+            expected_df = expected_df.sort_values(by='Similarity', ascending=False, kind='stable')
+        assert_same_ranking(batch_results[query_number], expected_df, TOLERANCES[scorer_name])
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import evaluator
+from conftest import SRC_FOLDER_PATH
+from evaluator import Evaluator
+
+#Query 1: relevant 10 (2 votes), 20 (1 vote) and 30 (3 votes), ranked 10, 40, 20, 50, 60
+#Query 2: relevant 5 (1 vote), ranked 7, 8, 5
+#Query 3: relevant 1, nothing retrieved. Query 4 has no relevant documents and is left out.
+RESULTS = [(1, [10, 40, 20, 50, 60]), (2, [7, 8, 5]), (4, [1, 2])]
+EXPECTED = [(1, 10, 1), (1, 10, 2), (1, 20, 1), (1, 30, 3), (1, 40, 0), (2, 5, 1), (3, 1, 4)]
+
+IDEAL_DCG_1 = 3 + 2/np.log2(3) + 1/2
+
+@pytest.fixture
+def evaluation(monkeypatch):
+    monkeypatch.setattr(evaluator, 'SRC_FOLDER_PATH', SRC_FOLDER_PATH)
+    ev = Evaluator()
+    ev.config['k'] = [1, 3, 5]
+    results_df = pd.DataFrame([(query, rank, doc) for query, docs in RESULTS for rank, doc in enumerate(docs, start=1)], columns=['QueryNumber', 'Rank', 'DocNumber'])
+    expected_df = ev.relevant_documents(pd.DataFrame(EXPECTED, columns=['QueryNumber', 'DocNumber', 'DocVotes']))
+    return ev, ev.calculate_metrics(results_df, expected_df)
+
+def test_relevant_documents(evaluation):
+    ev, _ = evaluation
+    expected_df = ev.relevant_documents(pd.DataFrame(EXPECTED, columns=['QueryNumber', 'DocNumber', 'DocVotes']))
+    assert list(expected_df.itertuples(index=False, name=None)) == [(1, 10, 2), (1, 20, 1), (1, 30, 3), (2, 5, 1), (3, 1, 4)]
+
+def test_precision_at_k(evaluation):
+    _, result = evaluation
+    np.testing.assert_array_equal(result['query_numbers'], [1, 2, 3])
+    np.testing.assert_allclose(result['metrics']['P@1'], [1, 0, 0])
+    np.testing.assert_allclose(result['metrics']['P@3'], [2/3, 1/3, 0])
+    np.testing.assert_allclose(result['metrics']['P@5'], [2/5, 1/5, 0]) #Always divided by k
+
+def test_r_precision(evaluation):
+    _, result = evaluation
+    np.testing.assert_allclose(result['metrics']['R-Precision'], [2/3, 0, 0])
+
+def test_average_precision(evaluation):
+    ev, result = evaluation
+    np.testing.assert_allclose(result['metrics']['AP'], [(1 + 2/3)/3, 1/3, 0]) #Relevant documents not retrieved add 0
+    assert ev.build_report(result)['mean']['MAP'] == pytest.approx(((1 + 2/3)/3 + 1/3)/3)
+
+def test_ndcg(evaluation):
+    _, result = evaluation
+    np.testing.assert_allclose(result['metrics']['nDCG@1'], [2/3, 0, 0])
+    np.testing.assert_allclose(result['metrics']['nDCG@3'], [(2 + 1/2)/IDEAL_DCG_1, 1/2, 0])
+    np.testing.assert_allclose(result['metrics']['nDCG'], [(2 + 1/2)/IDEAL_DCG_1, 1/2, 0])
+
+def test_interpolated_precision(evaluation):
+    _, result = evaluation
+    #Query 1 reaches recall 1/3 with precision 1 and 2/3 with precision 2/3, query 2 recall 1 with precision 1/3
+    np.testing.assert_allclose(result['interpolated_precision'], [
+        [1, 1, 1, 1, 2/3, 2/3, 2/3, 0, 0, 0, 0],
+        [1/3]*11,
+        [0]*11,
+    ])
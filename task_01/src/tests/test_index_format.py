@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import index_format
+from postings import Postings, encode_postings, encode_positions
+
+def test_varint_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**32, 2**62 + 5], dtype=np.int64)
+    encoded = index_format.encode_varint(values)
+    assert encoded.dtype == np.uint8
+    assert len(encoded) == index_format.varint_lengths(values).sum()
+    np.testing.assert_array_equal(index_format.varint_lengths(values), [1, 1, 1, 2, 2, 2, 3, 5, 9])
+    np.testing.assert_array_equal(index_format.decode_varint(encoded), values)
+    assert len(index_format.decode_varint(index_format.encode_varint(np.zeros(0, dtype=np.int64)))) == 0
+
+def test_gaps_round_trip():
+    #Lists of 3, 0, 1 and 2 values, each one ascending
+    values = np.array([2, 5, 9, 4, 1, 1000], dtype=np.int64)
+    lengths = np.array([3, 0, 1, 2])
+    gaps = index_format.encode_gaps(values, lengths)
+    np.testing.assert_array_equal(gaps, [2, 3, 4, 4, 1, 999])
+    np.testing.assert_array_equal(index_format.decode_gaps(index_format.decode_varint(index_format.encode_varint(gaps)), lengths), values)
+
+@pytest.mark.parametrize('terms', [[], ['CYSTIC'], ['CYSTIC', 'FIBROSIS', 'AÇÃO']])
+def test_terms_round_trip(terms):
+    assert index_format.decode_terms(index_format.encode_terms(terms)) == terms
+
+def test_index_file_round_trip(tmp_path):
+    raw_path = tmp_path / 'raw.tmp'
+    raw_path.write_bytes(np.arange(5, dtype=np.float64).tobytes())
+    sections = {'bytes': np.array([1, 2, 3], dtype=np.uint8), 'raw': (str(raw_path), np.float64), 'empty': np.zeros(0, dtype=np.uint32)}
+    index_format.write_index_file(str(tmp_path / 'file.idx'), 'test', sections, {'version': 'v1'})
+    index_file = index_format.IndexFile(str(tmp_path / 'file.idx'))
+    assert index_file.kind == 'test' and index_file.meta == {'version': 'v1'}
+    np.testing.assert_array_equal(index_file.section('bytes'), [1, 2, 3])
+    np.testing.assert_array_equal(index_file.section('raw'), np.arange(5))
+    assert index_file.section('raw').dtype == np.float64
+    assert len(index_file.section('empty')) == 0
+    for info in index_file.sections.values():
+        assert info['offset'] % index_format.ALIGNMENT == 0
+
+def test_postings_codecs_round_trip():
+    postings = Postings.from_inverted_list({'CYSTIC': [(3, [0, 7]), (1, [4])], 'FIBROSIS': [(130, [5, 300]), (3, [1, 8, 20])], 'LUNG': [(2, [2])]})
+    docs, tfs, docs_bytes, tfs_bytes = encode_postings(postings.doc_freq, postings.docs, postings.tfs)
+    assert docs_bytes.sum() == len(docs) and tfs_bytes.sum() == len(tfs)
+    np.testing.assert_array_equal(index_format.decode_gaps(index_format.decode_varint(docs), postings.doc_freq), postings.docs)
+    np.testing.assert_array_equal(index_format.decode_varint(tfs), postings.tfs)
+    positions, positions_bytes = encode_positions(postings.doc_freq, postings.tfs, postings.positions)
+    assert positions_bytes.sum() == len(positions)
+    np.testing.assert_array_equal(index_format.decode_gaps(index_format.decode_varint(positions), postings.tfs), postings.positions)
+
+def test_postings_file_round_trip(tmp_path):
+    postings = Postings.from_inverted_list({'CYSTIC': [(3, [0, 7]), (1, [4])], 'FIBROSIS': [(130, [5, 300]), (3, [1, 8, 20])], 'LUNG': [(2, [2])]})
+    postings.write(str(tmp_path / 'postings.idx'))
+    read = Postings.read(str(tmp_path / 'postings.idx'))
+    assert read.terms == postings.terms
+    for name in ('doc_freq', 'docs', 'tfs', 'positions'):
+        np.testing.assert_array_equal(getattr(read, name), getattr(postings, name))
+
+def test_vector_model_file_round_trip(tmp_path, cfc_vector_model):
+    from vector_model import VectorModel
+    cfc_vector_model.save(str(tmp_path / 'modelo.idx'))
+    vector_model = VectorModel.load(str(tmp_path / 'modelo.idx'))
+    assert vector_model.terms == cfc_vector_model.terms and vector_model.version == cfc_vector_model.version
+    #The upper bounds are stored as computed at build time, saving a loaded model doesn't loosen them again
+    vector_model.save(str(tmp_path / 'copia.idx'))
+    vector_model = VectorModel.load(str(tmp_path / 'copia.idx'))
+    np.testing.assert_array_equal(vector_model.term_upper_bounds, cfc_vector_model.term_upper_bounds)
+    for name in cfc_vector_model.impacts:
+        np.testing.assert_array_equal(vector_model.impacts[name], cfc_vector_model.impacts[name])
+        np.testing.assert_array_equal(vector_model.impact_upper_bounds(name), cfc_vector_model.impact_upper_bounds(name))
+        assert np.all(vector_model.impact_upper_bounds(name)[vector_model.normalized_weights.tocoo().row] >= vector_model.impacts[name])
+
+def test_vector_model_without_version_rejected(tmp_path, cfc_vector_model):
+    from vector_model import VectorModel
+    cfc_vector_model.save(str(tmp_path / 'modelo.idx'))
+    index_file = index_format.IndexFile(str(tmp_path / 'modelo.idx'))
+    sections = {name: index_file.section(name) for name in index_file.sections}
+    meta = {key: value for key, value in index_file.meta.items() if key != 'version'}
+    index_format.write_index_file(str(tmp_path / 'sem_versao.idx'), 'model', sections, meta)
+    with pytest.raises(ValueError):
+        VectorModel.load(str(tmp_path / 'sem_versao.idx'))
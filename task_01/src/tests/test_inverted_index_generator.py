@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from inverted_index_generator import ReverseListGenerator
+from postings import Postings
+
+def assert_same_postings(postings: Postings, expected: Postings):
+    assert postings.terms == expected.terms
+    np.testing.assert_array_equal(postings.doc_freq, expected.doc_freq)
+    np.testing.assert_array_equal(postings.docs, expected.docs)
+    np.testing.assert_array_equal(postings.tfs, expected.tfs)
+    np.testing.assert_array_equal(postings.positions, expected.positions)
+
+@pytest.mark.parametrize('memory_mb', [0.5, 4])
+def test_block_build_matches_in_memory_build(stages, tmp_path, cfc_postings, memory_mb):
+    generator = ReverseListGenerator()
+    generator.result_folder_path = str(tmp_path) + '/'
+    generator.config.update({'write': ['lista_invertida.idx'], 'memory_mb': memory_mb, 'segments': None, 'processes': 1})
+    assert generator.run() is None
+    if memory_mb < 1:
+        assert generator.instrumentation.spans['index/write_block'][1] > 1
+    #Merged blocks come out with the terms sorted
+    assert_same_postings(Postings.read(str(tmp_path / 'lista_invertida.idx')), cfc_postings.sort_terms())
+
+def test_parallel_build_matches_serial_build(stages, cfc_postings):
+    generator = ReverseListGenerator()
+    generator.config['processes'] = 2
+    assert_same_postings(generator.build_postings(), cfc_postings)
+
+def test_missing_input_file(stages):
+    generator = ReverseListGenerator()
+    generator.config['read'] = ['inexistente.xml']
+    with pytest.raises(SystemExit):
+        generator.build_postings()
+    with pytest.raises(SystemExit):
+        generator.read_input_files()
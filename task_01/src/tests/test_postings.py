@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from postings import Postings, PostingsReader
+
+@pytest.fixture
+def postings() -> Postings:
+    return Postings.from_inverted_list({'CYSTIC': [(3, [0, 7]), (1, [4])], 'FIBROSIS': [(1, [5]), (3, [1, 8, 20])], 'LUNG': [(2, [2])]})
+
+def assert_lookup(lookup, docs: list, tfs: list, positions: list):
+    np.testing.assert_array_equal(lookup[0], docs)
+    np.testing.assert_array_equal(lookup[1], tfs)
+    np.testing.assert_array_equal(lookup[2], positions)
+
+def test_lookup(postings):
+    assert_lookup(postings.lookup('FIBROSIS'), [1, 3], [1, 3], [5, 1, 8, 20])
+    assert_lookup(postings.lookup('PANCREAS'), [], [], [])
+
+def test_reader_lookup(postings, tmp_path):
+    postings.write(str(tmp_path / 'postings.idx'))
+    reader = PostingsReader(str(tmp_path / 'postings.idx'))
+    for term in ('CYSTIC', 'FIBROSIS', 'LUNG', 'PANCREAS'):
+        for read, expected in zip(reader.lookup(term), postings.lookup(term)):
+            np.testing.assert_array_equal(read, expected)
+
+def test_lookup_without_positions(postings, tmp_path):
+    postings.write(str(tmp_path / 'postings.idx'))
+    with pytest.raises(ValueError):
+        Postings.read(str(tmp_path / 'postings.idx'), read_positions=False).lookup('CYSTIC')
+    Postings(postings.terms, postings.doc_freq, postings.docs, postings.tfs).write(str(tmp_path / 'no_positions.idx'))
+    with pytest.raises(ValueError):
+        PostingsReader(str(tmp_path / 'no_positions.idx')).lookup('CYSTIC')
+
+@pytest.mark.parametrize('buffer_postings', [1, 2, 3, 100])
+def test_reader_iteration_in_buffers(postings, tmp_path, buffer_postings):
+    postings.write(str(tmp_path / 'postings.idx'))
+    reader = PostingsReader(str(tmp_path / 'postings.idx'))
+    terms = []
+    for term, docs, tfs, positions in reader.iter_terms(buffer_postings):
+        terms.append(term)
+        assert_lookup((docs, tfs, positions), *reader.lookup(term))
+    assert terms == postings.terms
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+from query_cache import QueryCache
+
+def similarity(docs: list, scores: list) -> pd.DataFrame:
+    return pd.DataFrame(scores, index=[str(doc) for doc in docs], columns=['Similarity'])
+
+def assert_same_results(similarity_df: pd.DataFrame, expected: pd.DataFrame):
+    assert similarity_df.index.tolist() == expected.index.tolist()
+    np.testing.assert_array_equal(similarity_df['Similarity'].to_numpy(), expected['Similarity'].to_numpy())
+
+def test_lru_eviction():
+    cache = QueryCache(2)
+    cache.set_version('v1')
+    cache.put('a', similarity([1], [0.5]))
+    cache.put('b', similarity([2], [0.4]))
+    assert cache.get('a') is not None #'a' becomes the most recently used
+    cache.put('c', similarity([3], [0.3]))
+    assert cache.get('b') is None
+    assert_same_results(cache.get('a'), similarity([1], [0.5]))
+    assert_same_results(cache.get('c'), similarity([3], [0.3]))
+    assert cache.stats == {'hits': 3, 'disk_hits': 0, 'misses': 1, 'evictions': 1}
+
+def test_results_copied():
+    #Changing a returned DataFrame doesn't change the cached entry
+    cache = QueryCache(10)
+    cache.set_version('v1')
+    cache.put('a', similarity([1, 2], [0.5, 0.7]))
+    cache.get('a').sort_values(by='Similarity', inplace=True)
+    scores = cache.get('a')['Similarity'].to_numpy()
+    scores *= 2
+    assert_same_results(cache.get('a'), similarity([1, 2], [0.5, 0.7]))
+
+def test_disk_tier_across_runs(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = QueryCache(1, path)
+    cache.set_version('v1')
+    cache.put('a', similarity([1, 2], [0.5, 0.25]))
+    cache.put('b', similarity([3], [0.125]))
+    #'a' left the memory tier, it is read back from disk
+    assert_same_results(cache.get('a'), similarity([1, 2], [0.5, 0.25]))
+    assert cache.stats['disk_hits'] == 1
+    cache.close()
+
+    cache = QueryCache(1, path)
+    cache.set_version('v1')
+    assert_same_results(cache.get('b'), similarity([3], [0.125]))
+    assert_same_results(cache.get('b'), similarity([3], [0.125]))
+    assert cache.stats == {'hits': 1, 'disk_hits': 1, 'misses': 0, 'evictions': 0}
+    cache.close()
+
+def test_disk_tier_eviction(tmp_path):
+    #The least recently used entries are dropped once the disk tier holds more than its maximum
+    cache = QueryCache(0, str(tmp_path / 'cache.db'), disk_max_entries=2)
+    cache.set_version('v1')
+    cache.put('a', similarity([1], [0.5]))
+    cache.put('b', similarity([2], [0.5]))
+    assert cache.get('a') is not None
+    cache.put('c', similarity([3], [0.5]))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats['evictions'] == 1
+    cache.close()
+
+@pytest.mark.parametrize('reopen', [False, True])
+def test_version_change_drops_entries(tmp_path, reopen):
+    path = str(tmp_path / 'cache.db')
+    cache = QueryCache(10, path)
+    cache.set_version('v1')
+    cache.put('a', similarity([1], [0.5]))
+    if reopen:
+        cache.close()
+        cache = QueryCache(10, path)
+    cache.set_version('v2')
+    assert cache.get('a') is None
+    cache.close()
+
+    #Back to the first version, the entries are gone from disk as well
+    cache = QueryCache(10, path)
+    cache.set_version('v1')
+    assert cache.get('a') is None
+    cache.close()
+
+def test_same_version_keeps_entries(tmp_path):
+    cache = QueryCache(10, str(tmp_path / 'cache.db'))
+    cache.set_version('v1')
+    cache.put('a', similarity([1], [0.5]))
+    cache.set_version('v1')
+    assert cache.get('a') is not None
+    cache.close()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import shutil
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import pytest
+import query_server
+import search_engine
+from conftest import SRC_FOLDER_PATH
+from query_server import QueryServer
+from search_engine import SearchEngine
+
+QUERIES = ['CYSTIC FIBROSIS', 'PULMONARY FUNCTION IN CHILDREN', '"SWEAT CHLORIDE" TEST', 'XYZZY']
+
+@pytest.fixture(scope='module')
+def folder(tmp_path_factory, stages, cfc_postings, cfc_vector_model):
+    #Stage folder with the CFC model and positional index, and a server on an ephemeral port
+    folder = tmp_path_factory.mktemp('servidor')
+    shutil.copytree(SRC_FOLDER_PATH + 'config', folder / 'config')
+    (folder / 'result').mkdir()
+    cfc_vector_model.save(str(folder / 'result' / 'modelo_vetorial.idx'))
+    cfc_postings.write(str(folder / 'result' / 'lista_invertida.idx'))
+    (folder / 'config' / 'SERVIDOR.CFG').write_text('HOST=127.0.0.1\nPORTA=0\nTOPK=10')
+    (folder / 'config' / 'BUSCA.CFG').write_text('MODELO=modelo_vetorial.idx\nCONSULTAS=consultas_processadas.csv\nRESULTADOS=resultados.csv\nPOSICOES=lista_invertida.idx\nCACHE=100\nPONTUACAO=BM25')
+    return str(folder) + '/'
+
+@pytest.fixture(scope='module')
+def server(folder):
+    previous_paths = query_server.SRC_FOLDER_PATH, search_engine.SRC_FOLDER_PATH
+    query_server.SRC_FOLDER_PATH = search_engine.SRC_FOLDER_PATH = folder
+    server = QueryServer()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    yield server, server.server.sockets[0].getsockname()[1]
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    query_server.SRC_FOLDER_PATH, search_engine.SRC_FOLDER_PATH = previous_paths
+
+def request(port: int, target: str, data: bytes = None):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{target}', data=data) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+@pytest.mark.parametrize('k', [1, 10, 50])
+def test_search_matches_search_engine(server, folder, cfc_vector_model, k):
+    server, port = server
+    engine = SearchEngine()
+    engine.positional_index = engine.read_positional_index()
+    for query_text in QUERIES:
+        status, body = request(port, f'/search?q={urllib.parse.quote(query_text.lower())}&k={k}')
+        assert status == 200 and body['query'] == query_text
+        expected_df = engine.search(cfc_vector_model, query_text, k)
+        assert [result['doc'] for result in body['results']] == expected_df.index.astype(int).tolist()
+        assert [result['similarity'] for result in body['results']] == expected_df['Similarity'].tolist()
+        assert [result['rank'] for result in body['results']] == list(range(1, len(expected_df) + 1))
+
+def test_default_top_k_and_cache(server):
+    server, port = server
+    _, body = request(port, '/search?q=CYSTIC+FIBROSIS')
+    assert len(body['results']) == server.config['top_k']
+    hits = server.search_engine.cache.stats['hits']
+    _, cached_body = request(port, '/search?q=cystic%20%20fibrosis')
+    assert cached_body['results'] == body['results']
+    assert server.search_engine.cache.stats['hits'] == hits + 1
+
+def test_health(server, cfc_vector_model):
+    server, port = server
+    status, body = request(port, '/health')
+    assert status == 200
+    assert body['status'] == 'ok'
+    assert body['terms'] == len(cfc_vector_model.terms) and body['documents'] == len(cfc_vector_model.doc_numbers)
+    assert 'cache' in body
+
+@pytest.mark.parametrize('target, data, expected_status', [
+    ('/search', None, 400),
+    ('/search?q=CYSTIC&k=dez', None, 400),
+    ('/busca?q=CYSTIC', None, 404),
+    ('/search?q=CYSTIC', b'q=CYSTIC', 405),
+])
+def test_error_responses(server, target, data, expected_status):
+    _, port = server
+    status, body = request(port, target, data)
+    assert status == expected_status
+    assert 'error' in body
+
+def test_malformed_request_line(server):
+    _, port = server
+    with socket.create_connection(('127.0.0.1', port)) as connection:
+        connection.sendall(b'GET\r\n\r\n')
+        response = connection.makefile('rb').read()
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert 'error' in json.loads(response.split(b'\r\n\r\n', 1)[1])
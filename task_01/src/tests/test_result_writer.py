@@ -0,0 +1,97 @@
+import ast
+import numpy as np
+import pandas as pd
+import pytest
+import evaluator
+import index_format
+import result_writer
+from conftest import SRC_FOLDER_PATH
+from evaluator import Evaluator
+from result_writer import RESULT_WRITERS
+
+BASELINE_PATH = SRC_FOLDER_PATH + 'result/resultados.csv'
+
+def read_baseline_results() -> dict:
+    #Rankings of the resultados.csv committed with the baseline, QueryNumber;[rank, 'DocNumber', similarity].
+    #The baseline also ranked the idf column of the model as a document, that line is left out.
+    rankings = {}
+    with open(BASELINE_PATH, 'r') as f:
+        next(f)
+        for line in f:
+            query_number, rank_info = line.rstrip('\n').split(';')
+            _, doc, score = ast.literal_eval(rank_info)
+            docs, scores = rankings.setdefault(query_number, ([], []))
+            if doc != 'idf':
+                docs.append(int(doc))
+                scores.append(score)
+    return rankings
+
+@pytest.fixture(scope='module')
+def baseline_rankings() -> dict:
+    return read_baseline_results()
+
+def baseline_without_idf() -> str:
+    #The baseline file without the idf lines, the documents ranked after one moving up a rank
+    lines = []
+    with open(BASELINE_PATH, 'r') as f:
+        lines.append(next(f))
+        idf_query = None
+        for line in f:
+            query_number, rank_info = line.split(';', 1)
+            if "'idf'" in rank_info:
+                idf_query = query_number
+                continue
+            if query_number == idf_query:
+                rank, rest = rank_info[1:].split(',', 1)
+                line = f'{query_number};[{int(rank) - 1},{rest}'
+            lines.append(line)
+    return ''.join(lines)
+
+def write_results(path: str, format: str, rankings: dict):
+    writer = RESULT_WRITERS[format](path, 'COSSENO')
+    for query_number, (docs, scores) in rankings.items():
+        writer.write(query_number, np.array(docs, dtype=np.int64), np.array(scores, dtype=np.float64))
+    writer.close()
+
+@pytest.mark.parametrize('buffer_results', [1000, result_writer.WRITER_BUFFER_RESULTS])
+def test_legacy_output_identical_to_baseline(tmp_path, monkeypatch, baseline_rankings, buffer_results):
+    monkeypatch.setattr(result_writer, 'WRITER_BUFFER_RESULTS', buffer_results)
+    write_results(str(tmp_path / 'resultados.csv'), 'LEGADO', baseline_rankings)
+    assert (tmp_path / 'resultados.csv').read_bytes() == baseline_without_idf().encode('utf-8')
+
+def test_legacy_line_format(tmp_path):
+    #Same text as str([rank, 'DocNumber', similarity]), as the baseline SearchEngine wrote each line
+    rankings = {'7': ([12, 3], [1/3, 1e-05]), '10': ([5], [0.1])}
+    write_results(str(tmp_path / 'resultados.csv'), 'LEGADO', rankings)
+    expected = 'QueryNumber;DocsRankInfo\n'
+    for query_number, (docs, scores) in rankings.items():
+        for rank, (doc, score) in enumerate(zip(docs, scores), start=1):
+            expected += f'{query_number};{str([rank, str(doc), score])}\n'
+    assert (tmp_path / 'resultados.csv').read_text() == expected
+
+@pytest.mark.parametrize('format, filename', [('LEGADO', 'resultados.csv'), ('CSV', 'resultados.csv'), ('TREC', 'resultados.txt'), ('BINARIO', 'resultados.idx')])
+def test_round_trip_through_evaluator(tmp_path, monkeypatch, baseline_rankings, format, filename):
+    monkeypatch.setattr(result_writer, 'WRITER_BUFFER_RESULTS', 50)
+    rankings = baseline_rankings
+    write_results(str(tmp_path / filename), format, rankings)
+
+    monkeypatch.setattr(evaluator, 'SRC_FOLDER_PATH', SRC_FOLDER_PATH)
+    ev = Evaluator()
+    ev.result_folder_path = str(tmp_path) + '/'
+    ev.config['results'] = filename
+    results_df = ev.read_results_file()
+    expected_df = pd.DataFrame([(int(query_number), rank, doc) for query_number, (docs, _) in rankings.items() for rank, doc in enumerate(docs, start=1)], columns=['QueryNumber', 'Rank', 'DocNumber'])
+    pd.testing.assert_frame_equal(results_df.reset_index(drop=True), expected_df, check_dtype=False)
+
+def test_scores_round_trip(tmp_path, baseline_rankings):
+    rankings = baseline_rankings
+    expected_scores = np.concatenate([scores for _, scores in rankings.values()])
+    write_results(str(tmp_path / 'resultados.idx'), 'BINARIO', rankings)
+    index_file = index_format.IndexFile(str(tmp_path / 'resultados.idx'))
+    assert index_file.kind == 'results' and index_file.meta == {'run': 'COSSENO'}
+    np.testing.assert_array_equal(index_file.section('scores'), expected_scores)
+
+    write_results(str(tmp_path / 'resultados.txt'), 'TREC', rankings)
+    trec_df = pd.read_csv(tmp_path / 'resultados.txt', sep=' ', header=None, names=['QueryNumber', 'Q0', 'DocNumber', 'Rank', 'Similarity', 'Run'], float_precision='round_trip')
+    assert (trec_df['Q0'] == 'Q0').all() and (trec_df['Run'] == 'COSSENO').all()
+    np.testing.assert_array_equal(trec_df['Similarity'].to_numpy(), expected_scores)
@@ -0,0 +1,66 @@
+import numpy as np
+import scipy.sparse as sp
+import pytest
+import scoring
+
+PARAMS = {'bm25_k1': 1.2, 'bm25_b': 0.75, 'bm25_delta': 1.0, 'dirichlet_mu': 2000.0}
+
+@pytest.fixture
+def tf() -> sp.csr_matrix:
+    #3 terms x 4 documents
+    return sp.csr_matrix(np.array([[1, 0, 3, 0], [2, 1, 0, 0], [0, 0, 1, 7]], dtype=np.float64))
+
+def test_base_classes_are_abstract():
+    with pytest.raises(TypeError):
+        scoring.Scorer()
+    with pytest.raises(TypeError):
+        scoring.ImpactScorer()
+    for scorer in scoring.SCORERS.values():
+        scorer()
+
+def test_quantize_impacts():
+    impacts = np.array([0.0, 1e-6, 0.5, 2.0, 10.0])
+    quantized, scale = scoring.quantize_impacts(impacts)
+    assert quantized.dtype == np.uint8
+    assert quantized.max() == scoring.IMPACT_LEVELS
+    assert quantized[0] == 0 and quantized[1] == 1 #Positive impacts never round down to 0
+    assert np.all(np.abs(quantized[2:]*scale - impacts[2:]) <= scale/2)
+
+def test_bm25_impacts(tf):
+    doc_lengths = np.array([3.0, 1.0, 4.0, 7.0])
+    impacts, doc_priors = scoring.BM25Scorer().calculate_impacts(tf, doc_lengths, PARAMS)
+    assert doc_priors is None
+    k1, b = PARAMS['bm25_k1'], PARAMS['bm25_b']
+    expected = []
+    for term, row in enumerate(tf.toarray()):
+        idf = np.log(1 + (4 - np.count_nonzero(row) + 0.5)/(np.count_nonzero(row) + 0.5))
+        expected += [idf*f*(k1 + 1)/(f + k1*(1 - b + b*doc_lengths[doc]/doc_lengths.mean())) for doc, f in enumerate(row) if f]
+    np.testing.assert_allclose(impacts, expected)
+    plus_impacts, _ = scoring.BM25PlusScorer().calculate_impacts(tf, doc_lengths, PARAMS)
+    np.testing.assert_allclose(plus_impacts - impacts, np.full(6, np.log(2))*PARAMS['bm25_delta']) #Every term is in 2 of the 4 documents
+
+@pytest.mark.parametrize('scorer_name', scoring.IMPACT_SCORERS)
+def test_quantized_impacts_close_to_exact(cfc_vector_model, cfc_postings, scorer_name):
+    #The impacts stored in the model are within half a quantization step of the exact impacts
+    from vector_model import VectorModel
+    scorer = scoring.SCORERS[scorer_name]()
+    selected_postings = cfc_postings.select_terms(np.isin(cfc_postings.terms, cfc_vector_model.terms))
+    tf = VectorModel.term_frequencies(selected_postings, cfc_vector_model.doc_numbers)
+    doc_lengths = np.bincount(np.searchsorted(cfc_vector_model.doc_numbers, cfc_postings.docs), weights=cfc_postings.tfs, minlength=len(cfc_vector_model.doc_numbers))
+    impacts, _ = scorer.calculate_impacts(tf, doc_lengths, PARAMS)
+    scale = cfc_vector_model.impact_scales[scorer_name]
+    np.testing.assert_array_less(np.abs(cfc_vector_model.impacts[scorer_name]*scale - impacts), scale/2 + 1e-9)
+
+@pytest.mark.parametrize('scorer_name', ['BM25', 'BM25+'])
+def test_repeated_query_term(stages, cfc_vector_model, scorer_name):
+    #Each occurrence of a query term adds its impact again, the integer sums don't wrap around
+    from search_engine import SearchEngine
+    engine = SearchEngine()
+    engine.scorer = scoring.SCORERS[scorer_name]()
+    term_id = int(np.argmax(cfc_vector_model.impact_upper_bounds(scorer_name)))
+    term = cfc_vector_model.terms[term_id]
+    single_df = engine.search(cfc_vector_model, term, 0)
+    repeated_df = engine.search(cfc_vector_model, f'{term} {term} {term}', 0)
+    assert repeated_df.index.tolist() == single_df.index.tolist()
+    np.testing.assert_allclose(repeated_df['Similarity'].to_numpy(), 3*single_df['Similarity'].to_numpy())
+    np.testing.assert_allclose(single_df['Similarity'].max(), cfc_vector_model.impact_upper_bounds(scorer_name)[term_id]*cfc_vector_model.impact_scales[scorer_name])
@@ -0,0 +1,134 @@
+import re
+import shutil
+import numpy as np
+import pytest
+import scoring
+from conftest import SRC_FOLDER_PATH
+from indexer import Indexer
+from inverted_index_generator import ReverseListGenerator
+from segments import SegmentedIndex
+
+FILES = ['cf74.xml', 'cf75.xml', 'cf76.xml']
+
+@pytest.fixture
+def folder(stages, tmp_path):
+    (tmp_path / 'data').mkdir()
+    for filename in FILES + ['cf77.xml']:
+        shutil.copy(SRC_FOLDER_PATH + 'data/' + filename, tmp_path / 'data' / filename)
+    return str(tmp_path) + '/'
+
+def update_index(folder, files, delete=()):
+    generator = ReverseListGenerator()
+    generator.data_folder_path = folder + 'data/'
+    generator.result_folder_path = folder
+    generator.config.update({'read': files, 'write': [], 'segments': 'segmentos', 'delete': list(delete), 'processes': 1})
+    generator.run()
+
+def new_indexer(folder):
+    indexer = Indexer()
+    indexer.result_folder_path = folder
+    indexer.config.update({'segments': 'segmentos', 'write': ['modelo.idx'], 'tf_normalized': True, 'scorers': list(scoring.IMPACT_SCORERS), 'shards': 1})
+    return indexer
+
+def assert_same_model(model, expected):
+    #Terms of an updated model may be in another order than the ones of a full build
+    assert sorted(model.terms) == sorted(expected.terms)
+    order = np.array([model.term_ids[term] for term in expected.terms], dtype=np.int64)
+    np.testing.assert_array_equal(model.doc_numbers, expected.doc_numbers)
+    np.testing.assert_allclose(model.idf[order], expected.idf, rtol=1e-6)
+    np.testing.assert_allclose(model.doc_norms, expected.doc_norms, rtol=1e-6)
+    weights = model.normalized_weights[order]
+    np.testing.assert_array_equal(weights.indices, expected.normalized_weights.indices)
+    np.testing.assert_allclose(weights.data, expected.normalized_weights.data, rtol=1e-5)
+    for name in expected.impacts:
+        impacts = model.impact_matrix(name)[order]
+        #Quantized impacts may differ by one step when a float rounds on the other side of a boundary
+        assert np.abs(impacts.data - expected.impact_matrix(name).data).max() <= 1
+        assert model.impact_scales[name] == pytest.approx(expected.impact_scales[name], rel=1e-6)
+
+def last_segment_documents(folder):
+    #Documents without any token are left out of the segments, as they are of a full build
+    return len(SegmentedIndex(folder + 'segmentos').manifest['segments'][-1]['docs'])
+
+def full_build(folder):
+    indexer = new_indexer(folder)
+    return indexer.create_term_doc_matrix(SegmentedIndex(folder + 'segmentos').live_postings(), True)
+
+def test_incremental_updates_match_full_build(folder):
+    update_index(folder, FILES[:2])
+    indexer = new_indexer(folder)
+    model = indexer.run()
+    assert indexer.instrumentation.counters['documents_added'] == len(model.doc_numbers)
+
+    #New file: only its documents are read
+    update_index(folder, FILES)
+    indexer = new_indexer(folder)
+    model = indexer.run()
+    assert indexer.instrumentation.counters['documents_added'] == last_segment_documents(folder)
+    assert indexer.instrumentation.counters['documents_removed'] == 0
+    assert_same_model(model, full_build(folder))
+
+    #Deleted records
+    deleted = model.doc_numbers[[0, 10, 100]].tolist()
+    update_index(folder, FILES, delete=deleted)
+    indexer = new_indexer(folder)
+    model = indexer.run()
+    assert indexer.instrumentation.counters['documents_added'] == 0
+    assert indexer.instrumentation.counters['documents_removed'] == 3
+    assert not np.isin(deleted, model.doc_numbers).any()
+    assert_same_model(model, full_build(folder))
+
+    #Changed file, without its first record: its other documents are read again
+    with open(folder + 'data/cf75.xml', 'r') as f:
+        text = f.read()
+    first_record = re.search(r'<RECORD>.*?</RECORD>', text, re.DOTALL).group(0)
+    with open(folder + 'data/cf75.xml', 'w') as f:
+        f.write(text.replace(first_record, '', 1))
+    previous_docs = len(model.doc_numbers)
+    update_index(folder, FILES, delete=deleted)
+    indexer = new_indexer(folder)
+    model = indexer.run()
+    added_docs = last_segment_documents(folder)
+    assert 0 < indexer.instrumentation.counters['documents_added'] == added_docs
+    assert indexer.instrumentation.counters['documents_removed'] == previous_docs + added_docs - len(model.doc_numbers)
+    assert_same_model(model, full_build(folder))
+
+def test_update_after_merge_reads_nothing(folder):
+    update_index(folder, FILES[:1])
+    update_index(folder, FILES[:2])
+    update_index(folder, FILES)
+    new_indexer(folder).run()
+
+    segmented_index = SegmentedIndex(folder + 'segmentos')
+    segmented_index.merge_segments()
+    assert segmented_index.segments_count == 1
+    indexer = new_indexer(folder)
+    model = indexer.run()
+    assert indexer.instrumentation.counters['documents_added'] == 0
+    assert indexer.instrumentation.counters['documents_removed'] == 0
+    assert_same_model(model, full_build(folder))
+
+def test_model_rebuilt_with_other_options(folder):
+    update_index(folder, FILES[:2])
+    new_indexer(folder).run()
+    indexer = new_indexer(folder)
+    indexer.config['tf_normalized'] = False
+    model = indexer.run()
+    assert indexer.instrumentation.counters['documents_added'] == len(model.doc_numbers)
+    expected = new_indexer(folder).create_term_doc_matrix(SegmentedIndex(folder + 'segmentos').live_postings(), False)
+    assert_same_model(model, expected)
+
+def test_positions_read_from_segments(folder):
+    update_index(folder, FILES[:2])
+    update_index(folder, FILES, delete=[1])
+    segmented_index = SegmentedIndex(folder + 'segmentos')
+    assert segmented_index.has_positions
+    live_postings = segmented_index.live_postings()
+    for term in ['CYSTIC', 'FIBROSIS', 'PATIENTS']:
+        term_id = live_postings.terms.index(term)
+        start, stop = live_postings.term_starts()[term_id], live_postings.term_starts()[term_id] + live_postings.doc_freq[term_id]
+        docs, tfs, positions = segmented_index.lookup(term)
+        np.testing.assert_array_equal(docs, np.sort(live_postings.docs[start:stop]))
+        order = np.argsort(live_postings.docs[start:stop])
+        np.testing.assert_array_equal(tfs, live_postings.tfs[start:stop][order])
+        assert len(positions) == tfs.sum()
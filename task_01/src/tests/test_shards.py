@@ -0,0 +1,47 @@
+import shutil
+import pytest
+import scoring
+import search_engine
+from conftest import SRC_FOLDER_PATH, assert_same_ranking
+from search_engine import SearchEngine
+from vector_model import VectorModel
+
+SHARDS = 3
+
+#Each shard scores its documents with the global idf and impact scales, so the scores are the ones of the
+#whole model; the cosine sums may differ by rounding when the batch mode multiplies the shard matrices.
+TOLERANCES = {'COSSENO': 1e-6, 'BM25': 0.0, 'BM25+': 0.0, 'DIRICHLET': 0.0}
+
+@pytest.fixture(scope='module')
+def folder(tmp_path_factory, stages, cfc_vector_model):
+    #Stage folder with the CFC model split the way the Indexer does with FRAGMENTOS
+    folder = tmp_path_factory.mktemp('fragmentos')
+    shutil.copytree(SRC_FOLDER_PATH + 'config', folder / 'config')
+    (folder / 'result').mkdir()
+    for shard, shard_model in enumerate(cfc_vector_model.partition(SHARDS)):
+        shard_model.save(VectorModel.shard_path(str(folder / 'result' / 'modelo_vetorial.idx'), shard), {'shard': shard, 'shards': SHARDS})
+    return folder
+
+@pytest.fixture
+def shard_pool(folder, monkeypatch, request):
+    #The worker processes are forked after BUSCA.CFG is written, so they read the same scorer and mode
+    scorer_name, batch = request.param
+    (folder / 'config' / 'BUSCA.CFG').write_text(f'MODELO=modelo_vetorial.idx\nCONSULTAS=consultas_processadas.csv\nRESULTADOS=resultados.csv\nFRAGMENTOS={SHARDS}\nPONTUACAO={scorer_name}\nLOTE={"S" if batch else "N"}')
+    monkeypatch.setattr(search_engine, 'SRC_FOLDER_PATH', str(folder) + '/')
+    shard_pool = SearchEngine().read_shards()
+    yield scorer_name, shard_pool
+    shard_pool.close()
+
+@pytest.mark.parametrize('shard_pool', [(scorer_name, batch) for scorer_name in scoring.SCORERS for batch in (False, True)], indirect=True)
+@pytest.mark.parametrize('k', [10, 0])
+def test_shards_match_per_query_search(cfc_vector_model, cfc_queries, shard_pool, k):
+    scorer_name, shard_pool = shard_pool
+    assert shard_pool.documents_count == len(cfc_vector_model.doc_numbers)
+    engine = SearchEngine()
+    engine.scorer = scoring.SCORERS[scorer_name]()
+    shard_results = shard_pool.search(cfc_queries, k)
+    for query_number, query_text in cfc_queries.items():
+        expected_df = engine.search(cfc_vector_model, query_text, k)
+        if k == 0: #Without a cut, search leaves the ranking to write_results
+            expected_df = expected_df.sort_values(by='Similarity', ascending=False, kind='stable')
+        assert_same_ranking(shard_results[query_number], expected_df, TOLERANCES[scorer_name])
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scoring
+from search_engine import SearchEngine
+
+@pytest.fixture(scope='module')
+def engine(stages):
+    return SearchEngine()
+
+def exhaustive_head(engine: SearchEngine, vector_model, query_weights, k: int) -> pd.DataFrame:
+    similarity_df = engine.calculate_query_similarity(vector_model, query_weights)
+    return similarity_df.sort_values(by='Similarity', ascending=False, kind='stable').head(k)
+
+@pytest.mark.parametrize('scorer_name', list(scoring.SCORERS))
+@pytest.mark.parametrize('k', [1, 5, 10, 50])
+def test_top_k_is_head_of_full_ranking(engine, cfc_vector_model, cfc_queries, scorer_name, k):
+    engine.scorer = scoring.SCORERS[scorer_name]()
+    for query_text in cfc_queries.values():
+        query_weights = engine.calculate_query_weights(cfc_vector_model, engine.tokenize_query_text(query_text))
+        top_k_df = engine.calculate_top_k_similarity(cfc_vector_model, query_weights, k)
+        expected_df = exhaustive_head(engine, cfc_vector_model, query_weights, k)
+        assert top_k_df.index.tolist() == expected_df.index.tolist()
+        np.testing.assert_array_equal(top_k_df['Similarity'].to_numpy(), expected_df['Similarity'].to_numpy())
+
+@pytest.mark.parametrize('scorer_name', ['COSSENO', 'BM25'])
+def test_top_k_with_allowed_docs(engine, cfc_vector_model, cfc_queries, scorer_name):
+    #Documents left out by the phrase operators are left out of the top k as well
+    engine.scorer = scoring.SCORERS[scorer_name]()
+    allowed_docs = np.arange(0, len(cfc_vector_model.doc_numbers), 3)
+    for query_text in cfc_queries.values():
+        query_weights = engine.calculate_query_weights(cfc_vector_model, engine.tokenize_query_text(query_text))
+        top_k_df = engine.calculate_top_k_similarity(cfc_vector_model, query_weights, 10, allowed_docs)
+        expected_df = engine.calculate_query_similarity(cfc_vector_model, query_weights, allowed_docs).sort_values(by='Similarity', ascending=False, kind='stable').head(10)
+        assert top_k_df.index.tolist() == expected_df.index.tolist()
+
+def test_ties_broken_by_doc_number(engine, cfc_vector_model):
+    #A single term query scores all the documents with the same tf and length equally
+    engine.scorer = scoring.SCORERS['BM25']()
+    term_id = np.argmax(np.diff(cfc_vector_model.normalized_weights.indptr))
+    query_weights = (np.array([term_id]), engine.scorer.query_weights(cfc_vector_model, np.array([term_id]), np.array([1])))
+    top_k_df = engine.calculate_top_k_similarity(cfc_vector_model, query_weights, 20)
+    assert top_k_df.index.tolist() == exhaustive_head(engine, cfc_vector_model, query_weights, 20).index.tolist()
+    for score, docs in top_k_df.groupby('Similarity', sort=False):
+        assert docs.index.astype(int).tolist() == sorted(docs.index.astype(int))
@@ -0,0 +1,43 @@
+import glob
+import os
+import xml.etree.ElementTree as ET
+import pytest
+import xml_records
+from conftest import SRC_FOLDER_PATH
+
+DATA_FOLDER_PATH = SRC_FOLDER_PATH + 'data/'
+COLLECTION_FILES = sorted(glob.glob(DATA_FOLDER_PATH + 'cf7*.xml'))
+
+def element_tree_documents(filepath: str) -> list:
+    documents = []
+    for record in ET.parse(filepath).getroot().iter('RECORD'):
+        text = record.findtext('ABSTRACT')
+        if text is None:
+            text = record.findtext('EXTRACT')
+        documents.append((int(record.findtext('RECORDNUM')), text or ''))
+    return documents
+
+def element_tree_queries(filepath: str) -> list:
+    return [(int(query.findtext('QueryNumber').strip()), query.findtext('QueryText') or '', [(item.text, item.get('score')) for item in query.findall('Records/Item')]) for query in ET.parse(filepath).getroot().iter('QUERY')]
+
+@pytest.mark.parametrize('chunk_bytes', [7, 1000, 1 << 20])
+@pytest.mark.parametrize('filepath', COLLECTION_FILES, ids=os.path.basename)
+def test_documents_match_element_tree(monkeypatch, filepath, chunk_bytes):
+    monkeypatch.setattr(xml_records, 'READ_CHUNK_BYTES', chunk_bytes)
+    assert list(xml_records.iter_documents(filepath)) == element_tree_documents(filepath)
+
+@pytest.mark.parametrize('chunk_bytes', [7, 1 << 20])
+def test_queries_match_element_tree(monkeypatch, chunk_bytes):
+    monkeypatch.setattr(xml_records, 'READ_CHUNK_BYTES', chunk_bytes)
+    filepath = DATA_FOLDER_PATH + 'cfquery.xml'
+    assert list(xml_records.iter_queries(filepath)) == element_tree_queries(filepath)
+
+def test_references_decoded_like_element_tree(tmp_path):
+    #Only the XML entities and character references are decoded, each of them once; escaped HTML entities are kept
+    filepath = tmp_path / 'records.xml'
+    filepath.write_bytes(b'<FILE><RECORD><RECORDNUM>1</RECORDNUM><ABSTRACT>a &lt;b&gt; &amp; &quot;c&quot; &apos;d&apos; &#150; &#x3b1;&#x41; '
+                         b'&amp;lt; &amp;#65; &amp;nbsp; &amp;eacute\r\ne\rf</ABSTRACT></RECORD>'
+                         b'<RECORD><RECORDNUM>2</RECORDNUM><EXTRACT>x &#38;lt;</EXTRACT></RECORD><RECORD><RECORDNUM>3</RECORDNUM></RECORD></FILE>')
+    documents = list(xml_records.iter_documents(str(filepath)))
+    assert documents == element_tree_documents(str(filepath))
+    assert documents == [(1, 'a <b> & "c" \'d\' \x96 \u03b1A &lt; &#65; &nbsp; &eacute\ne\nf'), (2, 'x &lt;'), (3, '')]
@@ -0,0 +1,215 @@
+import os
+import uuid
+from functools import cached_property
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import index_format
+import instrumentation
+from postings import Postings
+
+UPPER_BOUND_MARGIN = 1e-5 #The scores are float64 sums of float32 weights, so the upper bounds are loosened by this factor when computed
+
+class VectorModel:
+    #Document vectors are stored L2-normalized in float32, with the norm of each tf-idf vector and the idf of
+    #each term kept apart, so the cosine with a query is a single sparse dot product.
+
+    def __init__(self, terms: list[str], doc_numbers: np.ndarray, normalized_weights: sp.csr_matrix, idf: np.ndarray, doc_norms: np.ndarray, term_upper_bounds: np.ndarray = None, version: str = None) -> None:
+        self.terms = terms
+        self.doc_numbers = doc_numbers
+        self.normalized_weights = normalized_weights #Sparse term x document matrix with W_ij/|d_j|
+        self.idf = idf
+        self.doc_norms = doc_norms #|d_j| of the tf-idf vectors
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.term_upper_bounds = term_upper_bounds if term_upper_bounds is not None else self.calculate_term_upper_bounds()
+        self.version = version or uuid.uuid4().hex #Identifies the build of the index, a new model always gets a new version
+        #Quantized impact scores of each scorer, aligned with the nonzeros of normalized_weights (see scoring.py)
+        self.impacts = {}
+        self.impact_scales = {}
+        self.doc_priors = {}
+        self.impact_matrices = {}
+        self.impact_bounds = {} #Highest impact of each term, computed with the impacts and stored with them
+        #Models built from a segmented index also keep the tf of each posting, the highest tf and the generation of
+        #each document, so the next build only reads the documents added since (see Indexer.update_term_doc_matrix)
+        self.segments = None
+        self.tfs = None
+        self.doc_max_tfs = None
+        self.doc_generations = None
+
+    @classmethod
+    def from_weights(cls, terms: list[str], doc_numbers: np.ndarray, weights: sp.csr_matrix, idf: np.ndarray):
+        #Builds the model from the tf-idf weights (W_ij)
+        weights = sp.csr_matrix(weights, dtype=np.float64)
+        doc_norms = np.sqrt(np.bincount(weights.indices, weights=weights.data**2, minlength=len(doc_numbers)))
+        inverse_norms = np.divide(1.0, doc_norms, out=np.zeros_like(doc_norms), where=doc_norms > 0)
+        normalized_data = (weights.data*inverse_norms[weights.indices]).astype(np.float32)
+        normalized_weights = sp.csr_matrix((normalized_data, weights.indices, weights.indptr), shape=weights.shape)
+        return cls(terms, doc_numbers, normalized_weights, np.asarray(idf, dtype=np.float32), doc_norms.astype(np.float32))
+
+    @cached_property
+    def weights(self) -> sp.csr_matrix:
+        #tf-idf weights (W_ij), only needed for the dense layout described in MODELO.txt
+        return self.normalized_weights @ sp.diags(self.doc_norms.astype(np.float64))
+
+    def calculate_term_upper_bounds(self) -> np.ndarray:
+        #Highest W_ij/|d_j| of each term, an upper bound of its contribution to the cosine of any document.
+        #Only called when the model is built, loaded models keep the stored bounds, so the margin is applied once.
+        return (self.term_maxima(self.normalized_weights.data, np.float32)*(1 + UPPER_BOUND_MARGIN)).astype(np.float32)
+
+    def term_maxima(self, data: np.ndarray, dtype) -> np.ndarray:
+        #Highest value of each term among the given values, aligned with the nonzeros of normalized_weights
+        maxima = np.zeros(len(self.terms), dtype=dtype)
+        non_empty = np.diff(self.normalized_weights.indptr) > 0
+        if non_empty.any():
+            maxima[non_empty] = np.maximum.reduceat(data, self.normalized_weights.indptr[:-1][non_empty])
+        return maxima
+
+    def term_postings(self, term_id: int):
+        start, end = self.normalized_weights.indptr[term_id], self.normalized_weights.indptr[term_id + 1]
+        return self.normalized_weights.indices[start:end], self.normalized_weights.data[start:end]
+
+    def set_segment_statistics(self, segments: dict, tfs: np.ndarray, doc_max_tfs: np.ndarray, doc_generations: np.ndarray):
+        #segments identifies the segmented index and the options the model was built with
+        self.segments = segments
+        self.tfs = tfs
+        self.doc_max_tfs = doc_max_tfs
+        self.doc_generations = doc_generations
+
+    def tf_matrix(self) -> sp.csr_matrix:
+        return sp.csr_matrix((self.tfs.astype(np.float64), self.normalized_weights.indices, self.normalized_weights.indptr), shape=self.normalized_weights.shape)
+
+    def add_impacts(self, name: str, impacts: np.ndarray, scale: float, doc_priors: np.ndarray = None, upper_bounds: np.ndarray = None):
+        self.impacts[name] = impacts
+        self.impact_scales[name] = scale
+        #Impacts are integers, so their upper bounds are exact and need no margin
+        self.impact_bounds[name] = upper_bounds if upper_bounds is not None else self.term_maxima(impacts, np.uint8)
+        if doc_priors is not None:
+            self.doc_priors[name] = np.asarray(doc_priors, dtype=np.float32)
+
+    def term_impacts(self, name: str, term_id: int):
+        start, end = self.normalized_weights.indptr[term_id], self.normalized_weights.indptr[term_id + 1]
+        return self.normalized_weights.indices[start:end], self.impacts[name][start:end]
+
+    def impact_upper_bounds(self, name: str) -> np.ndarray:
+        return self.impact_bounds[name]
+
+    def impact_matrix(self, name: str) -> sp.csr_matrix:
+        if name not in self.impact_matrices:
+            self.impact_matrices[name] = sp.csr_matrix((self.impacts[name].astype(np.int64), self.normalized_weights.indices, self.normalized_weights.indptr), shape=self.normalized_weights.shape)
+        return self.impact_matrices[name]
+
+    def select_documents(self, cols: np.ndarray):
+        #Model of the given columns (in increasing order), with the same terms, idf and impact scales, so its
+        #scores are the ones of the whole model
+        columns = np.full(len(self.doc_numbers), -1, dtype=np.int64)
+        columns[cols] = np.arange(len(cols))
+        indices = columns[self.normalized_weights.indices]
+        keep = indices >= 0
+        term_rows = np.repeat(np.arange(len(self.terms)), np.diff(self.normalized_weights.indptr))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(term_rows[keep], minlength=len(self.terms)))))
+        weights = sp.csr_matrix((self.normalized_weights.data[keep], indices[keep], indptr), shape=(len(self.terms), len(cols)))
+        vector_model = VectorModel(self.terms, self.doc_numbers[cols], weights, self.idf, self.doc_norms[cols], version=self.version)
+        for name, impacts in self.impacts.items():
+            doc_priors = self.doc_priors[name][cols] if name in self.doc_priors else None
+            vector_model.add_impacts(name, impacts[keep], self.impact_scales[name], doc_priors)
+        return vector_model
+
+    def partition(self, shards: int) -> list:
+        #Documents are assigned by DocNumber, so a document stays in the same shard when the collection grows
+        shard_of_docs = self.doc_numbers % shards
+        return [self.select_documents(np.flatnonzero(shard_of_docs == shard)) for shard in range(shards)]
+
+    @staticmethod
+    def shard_path(path: str, shard: int) -> str:
+        root, extension = os.path.splitext(path)
+        return f'{root}_{shard}{extension}'
+
+    @staticmethod
+    def term_frequencies(postings: Postings, doc_numbers: np.ndarray) -> sp.csr_matrix:
+        #Sparse term x document matrix with the tf of each posting
+        cols = np.searchsorted(doc_numbers, postings.docs)
+        return sp.csr_matrix((postings.tfs.astype(np.float64), (postings.term_rows(), cols)), shape=(len(postings.terms), len(doc_numbers)))
+
+    @classmethod
+    def from_postings(cls, postings: Postings, doc_numbers: np.ndarray, tf_normalized: bool):
+        with instrumentation.span('tf'):
+            tf = cls.term_frequencies(postings, doc_numbers)
+        return cls.from_term_frequencies(postings.terms, doc_numbers, tf, tf_normalized)
+
+    @classmethod
+    def from_term_frequencies(cls, terms: list[str], doc_numbers: np.ndarray, tf: sp.csr_matrix, tf_normalized: bool, doc_max_tfs: np.ndarray = None):
+        #tf is left unchanged. doc_max_tfs, the highest tf of each document, is taken from tf when not given.
+        weights = sp.csr_matrix(tf, dtype=np.float64, copy=True)
+        with instrumentation.span('tf'):
+            if tf_normalized:
+                if doc_max_tfs is None:
+                    doc_max_tfs = tf.max(axis=0).toarray().ravel()
+                weights.data /= doc_max_tfs[weights.indices]
+
+        with instrumentation.span('idf'):
+            doc_freq = np.diff(weights.indptr)
+            idf = np.log10(len(doc_numbers)/doc_freq)
+            weights.data *= np.repeat(idf, doc_freq) #Calculates tf-idf on the nonzero entries only
+        with instrumentation.span('normalize'):
+            return cls.from_weights(terms, doc_numbers, weights, idf)
+
+    @classmethod
+    def from_dataframe(cls, model_df: pd.DataFrame):
+        #Reads the dense layout described in MODELO.txt
+        docs_columns = model_df.columns[model_df.columns != 'idf']
+        weights = sp.csr_matrix(model_df[docs_columns].to_numpy())
+        return cls.from_weights(model_df.index.tolist(), docs_columns.astype(np.int64).to_numpy(), weights, model_df['idf'].to_numpy())
+
+    def to_dataframe(self, start: int = 0, stop: int = None) -> pd.DataFrame:
+        #Dense view of the terms in [start, stop), in the layout described in MODELO.txt
+        model_df = pd.DataFrame(self.weights[start:stop].toarray(), index=self.terms[start:stop], columns=self.doc_numbers)
+        model_df['idf'] = self.idf[start:stop]
+        return model_df
+
+    def save(self, path: str, meta: dict = None):
+        doc_freq = np.diff(self.normalized_weights.indptr)
+        sections = {
+            'terms': index_format.encode_terms(self.terms),
+            'doc_numbers': self.doc_numbers.astype(np.uint32),
+            'doc_freq': doc_freq.astype(np.uint32),
+            'docs': index_format.encode_varint(index_format.encode_gaps(self.normalized_weights.indices, doc_freq)),
+            'weights': self.normalized_weights.data.astype(np.float32),
+            'doc_norms': self.doc_norms.astype(np.float32),
+            'idf': self.idf.astype(np.float32),
+            'term_upper_bounds': self.term_upper_bounds.astype(np.float32),
+        }
+        for name, impacts in self.impacts.items():
+            sections[f'impacts_{name}'] = impacts
+            sections[f'impact_bounds_{name}'] = self.impact_bounds[name]
+            if name in self.doc_priors:
+                sections[f'priors_{name}'] = self.doc_priors[name]
+        if self.segments is not None:
+            sections['tfs'] = index_format.encode_varint(self.tfs)
+            sections['doc_max_tfs'] = self.doc_max_tfs.astype(np.uint32)
+            sections['doc_generations'] = self.doc_generations.astype(np.uint32)
+            meta = {'segments': self.segments, **(meta or {})}
+        index_format.write_index_file(path, 'model', sections, {'impact_scales': self.impact_scales, 'version': self.version, **(meta or {})})
+
+    @classmethod
+    def load(cls, path: str):
+        #Only the docids need decoding, the float arrays are used straight from the memory-mapped file
+        index_file = index_format.IndexFile(path)
+        if index_file.kind != 'model':
+            raise ValueError(f'"{path}" is not a vector model file.')
+        terms = index_format.decode_terms(index_file.section('terms'))
+        doc_freq = index_file.section('doc_freq').astype(np.int64)
+        doc_numbers = index_file.section('doc_numbers').astype(np.int64)
+        indices = index_format.decode_gaps(index_format.decode_varint(index_file.section('docs')), doc_freq)
+        indptr = np.concatenate(([0], np.cumsum(doc_freq)))
+        weights = sp.csr_matrix((index_file.section('weights'), indices, indptr), shape=(len(doc_freq), len(doc_numbers)))
+        #The version keys the query cache, so a model without one can't be used
+        if 'version' not in index_file.meta:
+            raise ValueError(f'"{path}" has no version. Please run the Indexer again.')
+        vector_model = cls(terms, doc_numbers, weights, index_file.section('idf'), index_file.section('doc_norms'), index_file.section('term_upper_bounds'), index_file.meta['version'])
+        for name, scale in index_file.meta.get('impact_scales', {}).items():
+            doc_priors = index_file.section(f'priors_{name}') if f'priors_{name}' in index_file.sections else None
+            vector_model.add_impacts(name, index_file.section(f'impacts_{name}'), scale, doc_priors, index_file.section(f'impact_bounds_{name}'))
+        if 'segments' in index_file.meta:
+            tfs = index_format.decode_varint(index_file.section('tfs'))
+            vector_model.set_segment_statistics(index_file.meta['segments'], tfs, index_file.section('doc_max_tfs').astype(np.int64), index_file.section('doc_generations').astype(np.int64))
+        return vector_model
@@ -0,0 +1,63 @@
+import re
+import xml.etree.ElementTree as ET
+
+READ_CHUNK_BYTES = 1 << 20 #Bytes read from the file at a time
+#The five predefined XML entities and numeric character references, the only references a DTD-less parser decodes
+ENTITY_PATTERN = re.compile(r'&(?:#([0-9]+)|#x([0-9a-fA-F]+)|(amp|lt|gt|quot|apos));')
+XML_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+#The CFC files follow fixed DTDs (data/cfc-2.dtd and data/cfcquery-2.dtd): the record tags have no attributes, and
+#the fields used here hold only text. So records are cut out of the raw bytes and the fields are found with plain
+#byte searches, instead of building the tree of every record (authors, references and citations included).
+
+def iter_elements(filepath: str, tag: str):
+    #Streams the bytes of each <tag>...</tag> element, reading the file in chunks, so memory is bounded by the
+    #size of a chunk plus the largest element
+    start_tag, end_tag = f'<{tag}>'.encode(), f'</{tag}>'.encode()
+    buffer = b''
+    with open(filepath, 'rb') as f:
+        while chunk := f.read(READ_CHUNK_BYTES):
+            buffer += chunk
+            position = 0
+            while (start := buffer.find(start_tag, position)) >= 0 and (end := buffer.find(end_tag, start)) >= 0:
+                position = end + len(end_tag)
+                yield buffer[start:position]
+            #Keeps the unfinished element, or the last bytes of the chunk, where a start tag may have been cut
+            start = buffer.find(start_tag, position)
+            buffer = buffer[start:] if start >= 0 else buffer[max(position, len(buffer) - len(start_tag) + 1):]
+
+def element_text(element: bytes, tag: bytes) -> str:
+    #Text of the first <tag> inside the element, None if there is no such tag. Entities and line breaks are
+    #decoded the same way an XML parser does.
+    start = element.find(b'<' + tag + b'>')
+    if start < 0:
+        return None
+    start += len(tag) + 2
+    text = element[start:element.find(b'</' + tag + b'>', start)].decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return ENTITY_PATTERN.sub(decode_entity, text) if '&' in text else text
+
+def decode_entity(match: re.Match) -> str:
+    #A single pass, so the text of a reference (e.g. &amp;lt;) is never decoded again
+    decimal, hexadecimal, name = match.groups()
+    if name:
+        return XML_ENTITIES[name]
+    return chr(int(decimal) if decimal else int(hexadecimal, 16))
+
+def iter_documents(filepath: str):
+    #(RECORDNUM, text) of each RECORD of a CFC collection file. The text is the ABSTRACT, or the EXTRACT when
+    #there is no abstract, and empty when the record has neither.
+    for record in iter_elements(filepath, 'RECORD'):
+        text = element_text(record, b'ABSTRACT')
+        if text is None:
+            text = element_text(record, b'EXTRACT')
+        yield int(element_text(record, b'RECORDNUM')), text or ''
+
+def iter_queries(filepath: str):
+    #(QueryNumber, QueryText, [(DocNumber, score), ...]) of each QUERY of the CFC queries file.
+    #Queries are small, and the judged documents have attributes, so each one is parsed as XML.
+    for query_bytes in iter_elements(filepath, 'QUERY'):
+        query = ET.fromstring(query_bytes)
+        items = [(item.text, item.get('score')) for item in query.findall('Records/Item')]
+        yield int(query.find('QueryNumber').text.strip()), query.find('QueryText').text or '', items